@@ -0,0 +1,104 @@
+# Barnes-Hut gravity
+# The massive bodies are put in a quadtree. Seen from far enough away (node width / distance < theta), a whole node pulls like one body at
+# its centre of mass, so each target only needs O(log N) interactions rather than N.
+# The tree is walked for all of the targets at once: each node is visited a single time with the array of targets that got that far,
+# so the Python overhead is per node and the per-target work is all NumPy
+
+import numpy as np
+from consts import *
+import engine
+
+
+class QuadTree(object):
+	"""
+	Quadtree over source bodies, stored as flat lists of per-node values
+	"""
+	def __init__(self, pos, mass, ids=None, leaf_size=BH_LEAF_SIZE, max_depth=BH_MAX_DEPTH):
+		self.pos = pos
+		self.mass = mass
+		self.ids = np.arange(len(pos)) if ids is None else ids
+		self.leaf_size = leaf_size
+		self.max_depth = max_depth
+
+		self.com = []       # Centre of mass of each node
+		self.node_mass = [] # Total mass of each node
+		self.width = []     # Width of each node's square
+		self.children = []  # Indices of each node's children (None for leaves)
+		self.bodies = []    # Indices of the bodies in each leaf (None for other nodes)
+
+		if len(pos) > 0:
+			lo = pos.min(axis=0)
+			hi = pos.max(axis=0)
+			half = max(hi[0] - lo[0], hi[1] - lo[1]) / 2 * (1 + 1e-9) + DIST_THRESHOLD
+			centre = (lo + hi) / 2
+			self.build(np.arange(len(pos)), centre[0], centre[1], half, 0)
+
+	def __len__(self):
+		return len(self.node_mass)
+
+	def build(self, idx, cx, cy, half, depth):
+		node = len(self.node_mass)
+		m = self.mass[idx]
+		total = m.sum()
+		self.com.append((self.pos[idx] * m[:, np.newaxis]).sum(axis=0) / total)
+		self.node_mass.append(total)
+		self.width.append(2 * half)
+		self.children.append(None)
+		self.bodies.append(None)
+
+		if len(idx) <= self.leaf_size or depth >= self.max_depth:
+			self.bodies[node] = idx
+			return node
+
+		quadrant = (self.pos[idx, 0] >= cx).astype(int) + 2 * (self.pos[idx, 1] >= cy)
+		children = []
+		for q in range(4):
+			sub = idx[quadrant == q]
+			if len(sub) > 0:
+				x = cx + (half / 2 if q & 1 else -half / 2)
+				y = cy + (half / 2 if q & 2 else -half / 2)
+				children.append(self.build(sub, x, y, half / 2, depth + 1))
+		self.children[node] = children
+		return node
+
+	def accels(self, target_pos, target_ids=None, theta=BH_THETA):
+		"""
+		Acceleration on each target caused by all of the bodies in the tree, and which targets sit exactly on top of one of them
+		A target and body with the same id are the same object, so it doesn't pull itself
+		"""
+		n = len(target_pos)
+		accels = np.zeros((n, 2))
+		collided = np.zeros(n, dtype=bool)
+		if n == 0 or len(self) == 0:
+			return accels, collided
+		if target_ids is None:
+			target_ids = np.full(n, -1)
+
+		stack = [ (0, np.arange(n)) ]
+		while stack:
+			node, targets = stack.pop()
+			bodies = self.bodies[node]
+			if bodies is not None: # Leaf, so just do the pairs directly
+				a, c = engine.gravity_accels(target_pos[targets], self.pos[bodies], self.mass[bodies], target_ids[targets], self.ids[bodies])
+				accels[targets] += a
+				collided[targets] |= c
+				continue
+
+			rel = self.com[node] - target_pos[targets]
+			dist_sq = rel[:, 0]**2 + rel[:, 1]**2
+			far = self.width[node]**2 < theta**2 * dist_sq # width / dist < theta, so treat the node as one body
+			if far.any():
+				ok = far & (dist_sq >= DIST_THRESHOLD**2)
+				accels[targets[ok]] += G * self.node_mass[node] * rel[ok] / (dist_sq[ok] ** 1.5)[:, np.newaxis]
+			near = targets[~far]
+			if len(near) > 0:
+				for child in self.children[node]:
+					stack.append((child, near))
+		return accels, collided
+
+
+def tree_accels(target_pos, source_pos, source_mass, target_ids=None, source_ids=None, theta=BH_THETA):
+	"""
+	Same as engine.gravity_accels(), but using a Barnes-Hut tree built over the sources
+	"""
+	return QuadTree(source_pos, source_mass, source_ids).accels(target_pos, target_ids, theta)
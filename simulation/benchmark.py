@@ -0,0 +1,230 @@
+# Benchmarks
+# Times the force calculation, position update and integrator step for systems of 11 up to 10^5 bodies, a step of the real simulation,
+# the headless simulated-days-per-second rate, and the renderer (off screen, on SDL's dummy video driver).
+# Each result is compared with the baseline saved in BENCH_BASELINE for this machine, and anything more than BENCH_TOLERANCE slower than
+# it counts as a regression (exit status 1). Timings only mean anything next to ones from the same machine, so the file keeps a separate
+# baseline for each one (by host name); --save on a new machine to start one
+# python benchmark.py                  run everything and compare with the baseline
+# python benchmark.py --quick          skip the largest systems
+# python benchmark.py --save           run everything and save the results as the new baseline
+# python benchmark.py -k render        only the benchmarks with "render" in their name
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time as timer
+import numpy as np
+from math import *
+from consts import *
+import simulation as sim
+from engine import SystemState
+from integrators import make_integrator
+import kernels
+
+
+def measure(function, min_time=BENCH_MIN_TIME, repeat=BENCH_REPEAT):
+	"""
+	Time (seconds) of one call of `function`, from the fastest of `repeat` runs of enough calls to take at least `min_time` each
+	The fastest rather than the average, since anything else running on the machine only ever makes it slower
+	"""
+	function() # Warm up (caches, lazily built arrays, ...)
+	number = 1
+	while True:
+		start = timer.perf_counter()
+		for _ in range(number):
+			function()
+		taken = timer.perf_counter() - start
+		if taken >= min_time:
+			break
+		number *= 2 if taken == 0 else max(2, min(10, ceil(min_time / taken)))
+	times = [ taken / number ]
+	for _ in range(repeat - 1):
+		start = timer.perf_counter()
+		for _ in range(number):
+			function()
+		times.append((timer.perf_counter() - start) / number)
+	return min(times)
+
+
+def random_system(n, seed=0):
+	"""
+	SystemState of the sun and n - 1 bodies on roughly circular orbits between 0.3 and 30 AU
+	"""
+	rng = np.random.default_rng(seed)
+	cam = sim.Camera()
+	objects = [ sim.SpaceObject("Sun", 0, 0, 0, 0, SUN_M, 6.96e8, 0xffdd59, cam) ]
+	r = rng.uniform(0.3, 30, n - 1) * AU
+	angle = rng.uniform(0, 2 * pi, n - 1)
+	v = np.sqrt(G * SUN_M / r)
+	mass = 10 ** rng.uniform(20, 27, n - 1)
+	for i in range(n - 1):
+		objects.append(sim.SpaceObject(f"Body {i}", r[i] * cos(angle[i]), r[i] * sin(angle[i]), -v[i] * sin(angle[i]), v[i] * cos(angle[i]), mass[i], 1e6, 0xffffff, cam))
+	return SystemState(objects)
+
+
+# Each benchmark is a function returning the function to time, with the setup done outside of it
+def bench_net_accels(n, solver):
+	state = random_system(n)
+	state.solver = solver
+	return lambda: state.net_accels()
+
+def bench_update_pos(n):
+	state = random_system(n)
+	accels = np.zeros((n, 2))
+	return lambda: state.update_pos(1.0, accels)
+
+def bench_integrator_step(n, solver):
+	state = random_system(n)
+	state.solver = solver
+	integrator = make_integrator(INTEGRATOR)
+	accel_fn = lambda pos, t: state.net_accels(pos)
+	def step():
+		state.pos, state.vel, _ = integrator.step(state.pos, state.vel, 1.0, accel_fn)
+	return step
+
+def bench_simulate_step():
+	"""
+	One frame's worth of simulate() on the real solar system
+	"""
+	simulation = sim.Simulation()
+	frame = { "ms": 0 }
+	def step():
+		frame["ms"] += 1000 / FPS
+		simulation.simulate(1000 / FPS, frame["ms"])
+	return step
+
+def headless_days_per_sec(days=BENCH_HEADLESS_DAYS, dt=SECS_IN_A_DAY / 24):
+	"""
+	Simulated days per second of wall time of the headless loop (run_simulation() without the sampling)
+	"""
+	simulation = sim.Simulation()
+	steps = ceil(days * SECS_IN_A_DAY / dt)
+	start = timer.perf_counter()
+	for step in range(1, steps + 1):
+		simulation.advance(dt, step * dt, iterations=1)
+	return steps * dt / SECS_IN_A_DAY / (timer.perf_counter() - start)
+
+def bench_render(n):
+	"""
+	A whole frame of the presentation's drawing (orbits, bodies, rocket trail), plus n - 11 extra bodies if n > 11
+	"""
+	os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+	import pygame as pg
+	import presentation
+	from render import Renderer
+	from trail import Trail
+	pg.init()
+	window = pg.display.set_mode((INIT_WIN_WIDTH, INIT_WIN_HEIGHT))
+	camera = sim.Camera()
+	presentation.init_objects(camera, window, pg.font.SysFont(None, 24))
+	objects = sim.space_objects
+	if n > len(objects):
+		objects = objects + list(random_system(n - len(objects) + 1).objects[1:])
+		SystemState(objects)
+	trail = Trail()
+	for a in np.linspace(0, 2 * pi, 2000):
+		trail.add([ 1e9 * cos(a), 1e9 * sin(a) ])
+	renderer = Renderer(camera)
+	def frame():
+		window.fill(BLACK)
+		renderer.begin()
+		renderer.draw_trail(trail, sim.earth.pos, (255, 0, 0))
+		renderer.draw_orbits(presentation.orbit_objects)
+		renderer.draw_space_objects(objects)
+		camera.rotate(0.1) # Different view each frame, so nothing is drawn from the cache
+	return frame
+
+
+def benchmarks(quick=False):
+	"""
+	(name, unit, function) for every benchmark. Lower is better for "s", higher for "days/s"
+	"""
+	sizes = [ 11, 100, 1000, 10000 ]
+	bh_sizes = [ 1000, 10000 ] + ([] if quick else [ 100000 ])
+	for n in sizes:
+		yield f"net_accels direct n={n}", "s", lambda n=n: measure(bench_net_accels(n, "direct"))
+	for n in bh_sizes:
+		yield f"net_accels barnes_hut n={n}", "s", lambda n=n: measure(bench_net_accels(n, "barnes_hut"))
+	for n in sizes + ([] if quick else [ 100000 ]):
+		yield f"update_pos n={n}", "s", lambda n=n: measure(bench_update_pos(n))
+	for n in sizes:
+		solver = "direct" if n <= 1000 else "barnes_hut"
+		yield f"{INTEGRATOR} step {solver} n={n}", "s", lambda n=n, solver=solver: measure(bench_integrator_step(n, solver))
+	yield "simulate step", "s", lambda: measure(bench_simulate_step())
+	yield "headless", "days/s", headless_days_per_sec
+	for n in [ 11, 10000 ]:
+		yield f"render frame n={n}", "s", lambda n=n: measure(bench_render(n))
+
+
+def compare(results, baseline, tolerance=BENCH_TOLERANCE):
+	"""
+	Names of the results more than `tolerance` worse than the baseline
+	"""
+	regressions = []
+	for name, (value, unit) in results.items():
+		if name not in baseline:
+			continue
+		base = baseline[name]["value"]
+		ratio = value / base if unit == "s" else base / value # > 1 is slower either way
+		if ratio > 1 + tolerance:
+			regressions.append(name)
+	return regressions
+
+
+def machine_id():
+	compiled = ", Numba kernels" if kernels.enabled() else "" # Kept apart from the NumPy results, as they're a different machine as far as speed goes
+	return f"{platform.node()} ({platform.machine()}, Python {platform.python_version()}{compiled})"
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark the simulation and the renderer")
+	parser.add_argument("--quick", action="store_true", help="Skip the largest systems")
+	parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+	parser.add_argument("--baseline", default=BENCH_BASELINE, help="Baseline file to compare with (or save to)")
+	parser.add_argument("--tolerance", type=float, default=BENCH_TOLERANCE, help="How much slower than the baseline counts as a regression (fraction)")
+	parser.add_argument("--backend", choices=kernels.BACKENDS, default=KERNEL_BACKEND, help="Time the compiled Numba kernels, or NumPy (see kernels.py)")
+	parser.add_argument("-k", "--filter", default=None, help="Only run the benchmarks with this in their name")
+	args = parser.parse_args(argv)
+	kernels.use_backend(args.backend)
+	kernels.warm_up() # Compiling isn't what's being timed
+
+	baselines = {}
+	if os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			baselines = json.load(f)
+	machine = machine_id()
+	baseline = baselines.get(machine, {})
+	if not baseline and not args.save:
+		print(f"No baseline for {machine} in {args.baseline} yet, run with --save to make one")
+
+	results = {}
+	print(f"{'benchmark':<36} {'result':>14} {'baseline':>14} {'ratio':>7}")
+	for name, unit, run in benchmarks(args.quick):
+		if args.filter is not None and args.filter not in name:
+			continue
+		value = run()
+		results[name] = (value, unit)
+		base = baseline.get(name, {}).get("value")
+		ratio = "" if base is None else f"{(value / base if unit == 's' else base / value):.2f}"
+		shown = f"{value * 1e3:.3f} ms" if unit == "s" else f"{value:.1f} {unit}"
+		shown_base = "" if base is None else (f"{base * 1e3:.3f} ms" if unit == "s" else f"{base:.1f} {unit}")
+		print(f"{name:<36} {shown:>14} {shown_base:>14} {ratio:>7}", flush=True)
+
+	if args.save:
+		baseline.update({ name: { "value": value, "unit": unit } for name, (value, unit) in results.items() })
+		baselines[machine] = baseline
+		with open(args.baseline, "w") as f:
+			json.dump(baselines, f, indent=1, sort_keys=True)
+		print(f"Saved baseline for {machine} to {args.baseline}")
+		return 0
+
+	regressions = compare(results, baseline, args.tolerance)
+	for name in regressions:
+		print(f"REGRESSION: {name} is more than {args.tolerance:.0%} slower than the baseline")
+	return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
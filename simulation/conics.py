@@ -0,0 +1,236 @@
+# Patched conics
+# Rather than feeling every body in the system, the rocket only feels the one whose sphere of influence it's in (the moon near the moon, the
+# Earth near the Earth, the sun everywhere else), so each leg of its flight is a conic around one body. The spheres of influence nest like
+# the orbits do, using the centres from the scenario, and their radii are worked out once from the masses and orbits at the start.
+# The rocket is also carried along with its dominant body as that falls around the bodies it orbits, which is what keeps a rocket inside
+# the Earth's sphere of influence going around the sun with it. Where more accuracy is wanted, some (or all) of the other bodies can add
+# their perturbations: how much harder they pull on the rocket than on the dominant body.
+# Each body's children are kept in order of the band of distances their orbits sweep through, so only the few whose band the rocket is in
+# need checking, however many small bodies go around the sun
+
+import bisect
+import numpy as np
+from math import *
+from consts import *
+from engine import gravity_accels
+
+
+def sphere_of_influence(distance, mass, centre_mass):
+	"""
+	Radius of the sphere of influence of a body of `mass` `distance` meters from a centre of `centre_mass` (Laplace's a * (m / M)^(2/5))
+	"""
+	return distance * (mass / centre_mass)**0.4
+
+def orbit_band(rel_pos, rel_vel, mu):
+	"""
+	Closest and furthest (inf if it isn't a closed orbit) bodies at rel_pos, rel_vel (n, 2) relative to centres with gravitational
+	parameters mu get to them
+	"""
+	r = np.hypot(rel_pos[:, 0], rel_pos[:, 1])
+	h = rel_pos[:, 0] * rel_vel[:, 1] - rel_pos[:, 1] * rel_vel[:, 0] # Angular momentum (per unit mass)
+	energy = (rel_vel[:, 0]**2 + rel_vel[:, 1]**2) / 2 - mu / np.maximum(r, DIST_THRESHOLD)
+	e = np.sqrt(np.maximum(1 + 2 * energy * h**2 / mu**2, 0))
+	semi_latus = h**2 / mu
+	return semi_latus / (1 + e), np.where(e < 1, semi_latus / np.maximum(1 - e, 1e-300), np.inf)
+
+def pull(pos, target, source, mass):
+	"""
+	Acceleration (x, y) of something at `target` towards a `mass` at `source`, rows of pos. Nothing closer than DIST_THRESHOLD (see engine.py)
+	"""
+	dx = pos[source, 0] - pos[target, 0]
+	dy = pos[source, 1] - pos[target, 1]
+	dist_sq = dx * dx + dy * dy
+	if dist_sq < DIST_THRESHOLD**2:
+		return 0.0, 0.0
+	f = G * mass / (dist_sq * sqrt(dist_sq))
+	return f * dx, f * dy
+
+def pulls(target, source, mass):
+	"""
+	Accelerations (n, 2) of things at `target` (n, 2) towards masses `mass` ((k,) or (n, k)) at `source` (n, k, 2), each thing with its
+	own sources. Nothing closer than DIST_THRESHOLD (see engine.py)
+	"""
+	diff = source - target[:, np.newaxis]
+	dist_sq = diff[:, :, 0]**2 + diff[:, :, 1]**2
+	near = dist_sq < DIST_THRESHOLD**2
+	dist_sq[near] = 1 # Anything will do, it's zeroed anyway
+	f = G * mass / (dist_sq * np.sqrt(dist_sq))
+	f[near] = 0
+	return np.einsum("nk,nkj->nj", f, diff)
+
+
+class PatchedConics(object):
+	"""
+	Spheres of influence of the massive bodies of a SystemState, and the pull of the dominant one on the rocket
+	centres holds the row each body orbits (-1 for none). Bodies without a centre have an infinite sphere of influence
+	"""
+	def __init__(self, centres, mass, radius, bodies, perturbers=(), band_min=None, band_max=None):
+		"""
+		band_min and band_max are the closest and furthest each body gets to its centre (anywhere at all if not given)
+		"""
+		self.centres = np.asarray(centres, dtype=int)
+		self.mass = np.asarray(mass, dtype=float)
+		self.radius = np.asarray(radius, dtype=float)
+		self.radius_sq = self.radius**2
+		self.bodies = np.asarray(bodies, dtype=int)         # Rows that can be dominant
+		self.perturbers = np.asarray(perturbers, dtype=int) # Rows that add perturbations when they aren't dominant
+		self.roots = self.bodies[self.centres[self.bodies] < 0]
+
+		# Children of each body in order of how close their spheres of influence get to it, and the widest band any of them covers
+		band_min = np.zeros(len(self.centres)) if band_min is None else np.asarray(band_min, dtype=float)
+		band_max = np.full(len(self.centres), np.inf) if band_max is None else np.asarray(band_max, dtype=float)
+		inner = band_min - self.radius
+		outer = band_max + self.radius
+		self.children = {}
+		for centre in np.unique(self.centres[self.bodies]):
+			if centre < 0:
+				continue
+			rows = self.bodies[self.centres[self.bodies] == centre]
+			rows = rows[np.argsort(inner[rows], kind="stable")]
+			self.children[int(centre)] = ( rows, inner[rows].tolist(), float(np.max(outer[rows] - inner[rows])) )
+		self.has_children = np.zeros(len(self.centres), dtype=bool)
+		self.has_children[list(self.children)] = True
+
+	@classmethod
+	def from_state(cls, state, centres, exclude=(), perturbers=()):
+		"""
+		Spheres of influence of every massive body of a SystemState (but the rows in `exclude`, e.g. the rocket) going around `centres`,
+		sized from how far each is from its centre now. Bodies not impacted by gravity (like the moon on its rails) still count
+		"""
+		centres = np.array(centres, dtype=int)
+		bodies = np.flatnonzero(state.mass > 0)
+		bodies = bodies[~np.isin(bodies, exclude)]
+		centres[~np.isin(centres, bodies)] = -1 # Anything going around one of the excluded bodies counts as going around nothing
+		radius = np.full(len(state), np.inf)
+		band_min = np.zeros(len(state))
+		band_max = np.full(len(state), np.inf)
+		orbiting = bodies[centres[bodies] >= 0]
+		if len(orbiting):
+			c = centres[orbiting]
+			rel_pos = state.pos[orbiting] - state.pos[c]
+			radius[orbiting] = sphere_of_influence(np.hypot(rel_pos[:, 0], rel_pos[:, 1]), state.mass[orbiting], state.mass[c])
+			band_min[orbiting], band_max[orbiting] = orbit_band(rel_pos, state.vel[orbiting] - state.vel[c], G * state.mass[c])
+			band_min[orbiting] *= 1 - CONICS_BAND_MARGIN # Integrated orbits wander a little
+			band_max[orbiting] *= 1 + CONICS_BAND_MARGIN
+		return cls(centres, state.mass, radius, bodies, [ row for row in perturbers if row in bodies ], band_min, band_max)
+
+	def dominant(self, rocket_pos, pos):
+		"""
+		Row of the body whose sphere of influence something at rocket_pos is in, with the bodies at `pos`
+		Goes down the hierarchy from the body without a centre pulling on it hardest, into whichever sphere it's in at each level
+		"""
+		rocket_pos = np.asarray(rocket_pos, dtype=float)
+		if len(self.roots) == 1:
+			current = int(self.roots[0])
+		else:
+			d_sq = np.sum((pos[self.roots] - rocket_pos)**2, axis=1)
+			current = int(self.roots[np.argmax(self.mass[self.roots] / np.maximum(d_sq, DIST_THRESHOLD**2))])
+		while current in self.children:
+			rows, inner, width = self.children[current]
+			d = hypot(rocket_pos[0] - pos[current, 0], rocket_pos[1] - pos[current, 1])
+			rows = rows[bisect.bisect_left(inner, d - width):bisect.bisect_right(inner, d)] # Only the ones whose band it's in
+			if len(rows) == 0:
+				break
+			d_sq = np.sum((pos[rows] - rocket_pos)**2, axis=1)
+			inside = d_sq < self.radius_sq[rows]
+			if not inside.any():
+				break
+			current = int(rows[inside][np.argmin(d_sq[inside])]) # Overlapping spheres (shouldn't happen) go to the nearest
+		return current
+
+	def frame_accel(self, row, pos):
+		"""
+		Acceleration of body `row` at `pos` as it falls around the bodies it orbits, from its centre, its centre's centre and so on
+		"""
+		ax = ay = 0.0
+		while self.centres[row] >= 0:
+			c = self.centres[row]
+			x, y = pull(pos, row, c, self.mass[c])
+			ax += x
+			ay += y
+			row = c
+		return ax, ay
+
+	def accels(self, rocket_pos, pos):
+		"""
+		Acceleration (an (n, 2) array) of rockets at rocket_pos when the bodies are at `pos`, along with which sit right on their dominant body
+		"""
+		n = len(rocket_pos)
+		accels = np.zeros((n, 2))
+		collided = np.zeros(n, dtype=bool)
+		here = np.concatenate((rocket_pos, pos))
+		for i in range(n):
+			dom = self.dominant(rocket_pos[i], pos)
+			collided[i] = rocket_pos[i, 0] == pos[dom, 0] and rocket_pos[i, 1] == pos[dom, 1]
+			frame_x, frame_y = self.frame_accel(dom, pos)
+			x, y = pull(here, i, n + dom, self.mass[dom])
+			accels[i] = frame_x + x, frame_y + y
+			others = self.perturbers[self.perturbers != dom]
+			if len(others):
+				# How much harder each of them pulls on the rocket than on the dominant body (and so on the frame it's moving in)
+				both, _ = gravity_accels(np.stack((rocket_pos[i], pos[dom])), pos[others], self.mass[others])
+				accels[i] += both[0] - both[1]
+		return accels, collided
+
+	def batch_dominant(self, rocket_pos, pos):
+		"""
+		dominant() for things at rocket_pos (n, 2) all at once, with the bodies at pos[i] (n, bodies, 2) for each
+		"""
+		n = len(rocket_pos)
+		if len(self.roots) == 1:
+			current = np.full(n, self.roots[0])
+		else:
+			d_sq = np.sum((pos[:, self.roots] - rocket_pos[:, np.newaxis])**2, axis=2)
+			current = self.roots[np.argmax(self.mass[self.roots] / np.maximum(d_sq, DIST_THRESHOLD**2), axis=1)]
+		going = np.ones(n, dtype=bool) # Still going down the hierarchy
+		while True:
+			going &= self.has_children[current]
+			if not going.any():
+				return current
+			for centre in set(current[going].tolist()):
+				group = np.flatnonzero(going & (current == centre))
+				rows, inner, width = self.children[int(centre)]
+				inner = np.asarray(inner)
+				d = np.hypot(rocket_pos[group, 0] - pos[group, centre, 0], rocket_pos[group, 1] - pos[group, centre, 1])
+				# Only the ones whose band it's in
+				k = np.arange(len(rows))
+				in_band = (k >= np.searchsorted(inner, d - width, side="left")[:, np.newaxis]) & (k < np.searchsorted(inner, d, side="right")[:, np.newaxis])
+				d_sq = np.sum((pos[group[:, np.newaxis], rows] - rocket_pos[group, np.newaxis])**2, axis=2)
+				inside = in_band & (d_sq < self.radius_sq[rows])
+				found = inside.any(axis=1)
+				going[group[~found]] = False
+				nearest = np.argmin(np.where(inside, d_sq, np.inf), axis=1) # Overlapping spheres (shouldn't happen) go to the nearest
+				current[group[found]] = rows[nearest[found]]
+
+	def batch_frame_accels(self, rows, pos):
+		"""
+		frame_accel() of bodies `rows`, one for each of pos (n, bodies, 2)
+		"""
+		n = len(rows)
+		accels = np.zeros((n, 2))
+		rows = rows.copy()
+		falling = self.centres[rows] >= 0
+		while falling.any():
+			i = np.flatnonzero(falling)
+			c = self.centres[rows[i]]
+			accels[i] += pulls(pos[i, rows[i]], pos[i, c][:, np.newaxis], self.mass[c][:, np.newaxis])
+			rows[i] = c
+			falling = self.centres[rows] >= 0
+		return accels
+
+	def batch_accels(self, rocket_pos, pos):
+		"""
+		accels() with the bodies somewhere different for each rocket, at pos[i] (n, bodies, 2) (e.g. at different times), all at once
+		"""
+		n = len(rocket_pos)
+		each = np.arange(n)
+		dom = self.batch_dominant(rocket_pos, pos)
+		dom_pos = pos[each, dom]
+		collided = np.all(rocket_pos == dom_pos, axis=1)
+		accels = self.batch_frame_accels(dom, pos) + pulls(rocket_pos, dom_pos[:, np.newaxis], self.mass[dom][:, np.newaxis])
+		if len(self.perturbers):
+			# How much harder each of the others pulls on the rocket than on the dominant body (and so on the frame it's moving in)
+			mass = np.where(self.perturbers == dom[:, np.newaxis], 0, self.mass[self.perturbers])
+			source = pos[:, self.perturbers]
+			accels += pulls(rocket_pos, source, mass) - pulls(dom_pos, source, mass)
+		return accels, collided
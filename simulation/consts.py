@@ -1,4 +1,7 @@
+import os
+
 DEBUG = 0
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__)) # Caches are kept in here, wherever the simulation is run from
 
 # Awaiting data from Conor/Jack
 # Constants relating to the logistics
@@ -12,11 +15,102 @@ AU = 149597870700    # Astronomical unit in meters
 SECS_IN_A_DAY = 60*60*24
 DIST_THRESHOLD = 1e3 # No two SpaceObjects should be closer than this to each other (hopefully)
 SUN_M = 1.99e30      # Mass of sun (kg)
+MOON_ORBIT_RADIUS = 384400e3 # 384400 km
+MOON_PERIOD_DAYS = 27.3
+
+# Engine
+ACCEL_CHUNK_PAIRS = 1 << 20 # Max number of body pairs worked out at once by the batched gravity calculation (bounds memory use)
+GRAVITY_SOLVER = "direct"   # "direct" works out every pair, "barnes_hut" uses a quadtree (see barnes_hut.py), better for thousands of bodies
+KERNEL_BACKEND = "auto"     # "numba" runs the physics' inner loops as compiled kernels (see kernels.py), "numpy" doesn't, "auto" does if Numba is installed
+KERNEL_PARALLEL_MIN = 1 << 14 # Loop iterations (bodies, or target-source pairs for gravity) before the kernels split the work across threads
+KERNEL_CACHE_DIR = os.path.join(PACKAGE_DIR, "kernel_cache") # Where compiled kernels are kept between runs
+BH_THETA = 0.5              # Barnes-Hut opening angle. Smaller is more accurate but slower (0 is the same as direct)
+BH_LEAF_SIZE = 16           # Max bodies in a quadtree leaf, which are summed directly
+BH_MAX_DEPTH = 48           # Stop splitting quadtree nodes past this depth (bodies on top of each other)
+BH_MIN_BODIES = 256         # Below this many massive bodies the direct sum is quicker anyway
+ROCKET_GRAVITY_BOOST = 300000 # Make the moon's pull on the rocket stronger to better demonstrate slingshotting (the simulation gets slowed down a lot)
+LAUNCH_SPEED_SCALE = 0.003    # Rocket launches towards the moon at this times the Earth-moon distance per second
+ROCKET_GRAVITY = "moon"       # The rocket feels just the (boosted) moon, or with "soi" the body whose sphere of influence it's in (see conics.py)
+ROCKET_PERTURBERS = ()        # Bodies adding their perturbations to the "soi" model
+
+# Kepler rails (see kepler.py)
+KEPLER_TOL = 1e-12    # Kepler's equation is solved to within this (radians)
+KEPLER_MAX_ITER = 20  # Newton iterations allowed for it
+
+# Patched conics (see conics.py)
+CONICS_BAND_MARGIN = 0.1 # Spheres of influence are looked for this much (relatively) outside the band of distances their orbits cover
+
+# Events (see events.py)
+EVENT_TIME_TOL = 1e-6 # Events are pinned down to within this many seconds
+EVENT_MAX_ITER = 60   # Root-finding iterations allowed for each one
+
+# Scenarios (see scenario.py)
+SCENARIO_CACHE_DIR = os.path.join(PACKAGE_DIR, "scenario_cache") # Where parsed scenarios are cached
+
+# Test particles (see particles.py)
+BELT_MIN_AU = 2.2 # Asteroid belt
+BELT_MAX_AU = 3.2
+
+# Launch sweeps (see sweep.py)
+SWEEP_DURATION = 3600                      # Seconds to follow each launched rocket for
+SWEEP_DT = 1                               # Timestep after launch (seconds)
+SWEEP_WARMUP_DT = 3600                     # Timestep while simulating up to the launch epoch (seconds)
+SWEEP_ESCAPE_DIST = 10 * MOON_ORBIT_RADIUS # The rocket has escaped once it's this far from the Earth
+
+# Launch optimizer (see optimize.py)
+OPTIMIZE_EPOCHS = (0, 30)                                                      # Launch epochs searched (days from the start)
+OPTIMIZE_DIRECTIONS = (-30, 30)                                                # Launch directions searched (degrees away from the moon)
+OPTIMIZE_DELTA_V = (0.001 * MOON_ORBIT_RADIUS, 0.005 * MOON_ORBIT_RADIUS)      # Launch speeds searched (meters/sec)
+OPTIMIZE_POPULATION = 12       # Launches flown together in each generation
+OPTIMIZE_GENERATIONS = 30      # Most generations to run
+OPTIMIZE_SIGMA = 0.3           # Starting spread of the search, as a fraction of the ranges
+OPTIMIZE_TOL = 1e-4            # Stop once the spread is down to this fraction of the ranges
+OPTIMIZE_DT = 60               # Timestep of the flights (seconds), which the adaptive integrator splits up where it needs to. Flights can stop after any of them
+OPTIMIZE_INTEGRATOR = "dopri5"
+OPTIMIZE_PASS_DIST = MOON_ORBIT_RADIUS # A flight is over once it's this far past the target and not coming back
+OPTIMIZE_TARGET_ALTITUDE = 100e3       # Closest approach aimed for above the target's surface (meters)
+
+# Ephemeris (see ephemeris.py)
+EPHEMERIS_SPAN_DAYS = 365               # How long a planetary ephemeris covers
+EPHEMERIS_INTERVAL = SECS_IN_A_DAY / 8  # Seconds between stored samples
+EPHEMERIS_SUBSTEPS = 3                  # Integration steps per sample when building one
+EPHEMERIS_DIR = os.path.join(PACKAGE_DIR, "ephemeris_cache") # Where built ephemerides are kept
+
+# Trajectory recordings (see trajectory.py)
+TRAJECTORY_SEGMENT_STEPS = 4096 # Samples per segment file
+
+# Snapshots (see snapshot.py)
+SNAPSHOT_EVERY_DAYS = 30 # Simulated days between the snapshots a headless run saves as it goes
+
+# Profiling (see profiling.py)
+PROFILE = False            # Whether the per-phase timers are on from the start (the presentation and --profile turn them on anyway)
+PROFILE_WINDOW = 60        # Frames the overlay's rolling breakdown is averaged over
+
+# Benchmarks (see benchmark.py)
+BENCH_BASELINE = os.path.join(PACKAGE_DIR, "benchmark_baseline.json") # Per-machine results, so not committed
+BENCH_TOLERANCE = 0.3      # Results this much slower than the baseline count as regressions
+BENCH_MIN_TIME = 0.2       # Seconds each timed run lasts at least
+BENCH_REPEAT = 5           # Timed runs per benchmark (the fastest is kept)
+BENCH_HEADLESS_DAYS = 365  # Simulated days the headless benchmark runs for
+
+# Integrators (see integrators.py)
+INTEGRATOR = "leapfrog"         # One of "kinematic" (the original constant-acceleration step), "leapfrog", "rk4", "dopri5" (adaptive), "block" (per body)
+INTEGRATOR_RTOL = 1e-8          # Relative error allowed per substep by the adaptive integrator
+INTEGRATOR_ATOL_POS = 1e3       # Absolute position error allowed per substep (meters)
+INTEGRATOR_ATOL_VEL = 1e-3      # Absolute velocity error allowed per substep (meters/sec)
+INTEGRATOR_MAX_SUBSTEPS = 10000 # Give up refining after this many substeps in one step
+BLOCK_ETA = 0.005               # Block timesteps are this times how long each body's acceleration takes to change by its own size
+BLOCK_MAX_LEVEL = 12            # Block timesteps go down to the step over 2^this
 
 # Animation things
 FPS = 60                 # Frames per second of the animation
 ITERATIONS_PER_FRAME = 1 # How many times the physics is calculated per frame. The higher, the more accurate, but the slower the program will run
+PHYSICS_DT = 10          # Fixed timestep (seconds) of the physics worker the presentation uses (see worker.py)
+PHYSICS_SNAPSHOTS = 8    # How many of the worker's latest states are kept to interpolate between
 DAYS_PER_SEC = 1         # How many (Earth) days pass in one second of the animation
+LAUNCH_MS = 17000        # When the rocket launches in the presentation (milliseconds since the start)
+REPLAY_SKIP_DAYS = 1     # How far the arrow keys skip when replaying a recording
+REPLAY_SPEED_STEP = 2    # Factor the up/down keys change the replay speed by
 
 # Deprecated time-animation things
 #DAYS = 10                         # Number of days to simulate
@@ -30,6 +124,14 @@ INIT_WIN_WIDTH = 1000
 INIT_WIN_HEIGHT = 800
 MAX_AU = 32 # Used for sizing the screen
 ORBIT_WIDTH = 1
+HUD_CACHE_SIZE = 256 # Most rendered pieces of text kept (see hud.py)
+
+# Rocket trail (see trail.py)
+TRAIL_CAPACITY = 4096     # Most points kept
+TRAIL_MIN_DIST = 5e5      # Points closer than this (meters) to the last one are dropped
+TRAIL_MIN_ANGLE = 0.5     # Points turning less than this (degrees) from the last segment just extend it
+TRAIL_WIDTH = 2
+TRAIL_MAX_PIXELS = 1 << 20 # Trail points are clamped to this far off screen before being drawn
 
 # Colours
 ORBIT_DARKEN = 0.6
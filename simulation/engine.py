@@ -0,0 +1,152 @@
+# State-array N-body engine
+# Positions, velocities and masses of every SpaceObject live in contiguous float64 arrays so that the
+# gravitational pull between all pairs can be worked out in one batched NumPy pass
+
+import numpy as np
+from consts import *
+import barnes_hut
+import kernels
+
+
+def gravity_accels(target_pos, source_pos, source_mass, target_ids=None, source_ids=None):
+	"""
+	Acceleration (m/s^2) on each target caused by every source, as an (n_targets, 2) array
+	Pairs closer than DIST_THRESHOLD contribute nothing. If ids are given, a target and source with the same id are the same body, so don't pull each other
+	Also returns a boolean array marking targets which sit exactly on top of a source (the old [ None, None ] case)
+	"""
+	n_targets = len(target_pos)
+	n_sources = len(source_pos)
+	accels = np.zeros((n_targets, 2))
+	collided = np.zeros(n_targets, dtype=bool)
+	if n_targets == 0 or n_sources == 0:
+		return accels, collided
+	if kernels.enabled():
+		return kernels.gravity_accels(target_pos, source_pos, source_mass, target_ids, source_ids)
+
+	# Work through the targets in chunks so the (targets x sources) pair arrays stay a sensible size
+	chunk = max(1, ACCEL_CHUNK_PAIRS // n_sources)
+	for start in range(0, n_targets, chunk):
+		stop = min(start + chunk, n_targets)
+		rel = source_pos[np.newaxis, :, :] - target_pos[start:stop, np.newaxis, :] # rel[i, j] is source j relative to target i
+		dist_sq = rel[:, :, 0]**2 + rel[:, :, 1]**2
+		if target_ids is not None:
+			pair = target_ids[start:stop, np.newaxis] != source_ids[np.newaxis, :] # No self-interaction
+		else:
+			pair = np.ones(dist_sq.shape, dtype=bool)
+
+		collided[start:stop] = (pair & (dist_sq == 0)).any(axis=1)
+		pair &= dist_sq >= DIST_THRESHOLD**2 # Just say there's no force acting between bodies which have essentially collided
+		d = np.where(pair, dist_sq, np.inf) # Pairs without a force get an infinite distance, so 1/r^3 comes out as 0
+		inv_r3 = 1 / (d * np.sqrt(d))
+		# a = G*m/r^2 in the direction of rel/r
+		accels[start:stop] = G * np.einsum("ij,ijk->ik", inv_r3 * source_mass, rel)
+	return accels, collided
+
+
+class SystemState(object):
+	"""
+	Contiguous arrays holding the state of a list of SpaceObjects. Each object becomes a view onto one row
+	"""
+	def __init__(self, objects=(), solver=GRAVITY_SOLVER, theta=BH_THETA):
+		self.objects = list(objects)
+		self.solver = solver # "direct" (every pair) or "barnes_hut" (quadtree, see barnes_hut.py)
+		self.theta = theta   # Barnes-Hut opening angle
+		n = len(self.objects)
+		self.pos = np.zeros((n, 2))           # In meters
+		self.vel = np.zeros((n, 2))           # In meters/sec
+		self.mass = np.zeros(n)               # In kg
+		self.active = np.ones(n, dtype=bool)  # impacted_by_gravity of each object
+		self.rails = np.zeros(n, dtype=bool)  # Objects which move themselves (e.g. the moon) rather than being integrated
+		for i, so in enumerate(self.objects):
+			self.pos[i] = so.pos
+			self.vel[i] = so.vel
+			self.mass[i] = so.mass
+			self.active[i] = so.impacted_by_gravity
+			self.rails[i] = so.on_rails
+		for i, so in enumerate(self.objects):
+			so.bind(self, i)
+
+	@classmethod
+	def from_arrays(cls, objects, pos, vel, mass, active=None, rails=None, solver=GRAVITY_SOLVER, theta=BH_THETA):
+		"""
+		State of `objects` taken from arrays (a row per object) rather than from the objects themselves, then bound to them
+		"""
+		state = cls((), solver, theta)
+		state.objects = list(objects)
+		n = len(state.objects)
+		state.pos = np.array(pos, dtype=float).reshape(n, 2)
+		state.vel = np.array(vel, dtype=float).reshape(n, 2)
+		state.mass = np.array(mass, dtype=float).reshape(n)
+		state.active = np.ones(n, dtype=bool) if active is None else np.array(active, dtype=bool).reshape(n)
+		state.rails = np.zeros(n, dtype=bool) if rails is None else np.array(rails, dtype=bool).reshape(n)
+		for i, so in enumerate(state.objects):
+			so.bind(state, i)
+		return state
+
+	def __len__(self):
+		return len(self.objects)
+
+	def index_of(self, so):
+		return self.objects.index(so)
+
+	def net_accels(self, pos=None, rows=None):
+		"""
+		Net acceleration on every object caused by all of the others (at positions `pos` if given, rather than their current ones)
+		Objects not impacted by gravity neither feel nor cause it, and ones on rails move themselves so don't need to feel it
+		With `rows`, only those objects' accelerations are worked out, and the rest are left as zeros
+		"""
+		if pos is None:
+			pos = self.pos
+		accels = np.zeros((len(self), 2))
+		collided = np.zeros(len(self), dtype=bool)
+		feels = self.active & ~self.rails
+		if rows is not None:
+			wanted = np.zeros(len(self), dtype=bool)
+			wanted[rows] = True
+			feels &= wanted
+		targets = np.flatnonzero(feels)
+		sources = np.flatnonzero(self.active & (self.mass > 0)) # Massless objects feel gravity but don't cause any
+		if self.solver == "barnes_hut" and len(sources) >= BH_MIN_BODIES:
+			accels[targets], collided[targets] = barnes_hut.tree_accels(pos[targets], pos[sources], self.mass[sources], targets, sources, self.theta)
+		else:
+			accels[targets], collided[targets] = gravity_accels(pos[targets], pos[sources], self.mass[sources], targets, sources)
+		return accels, collided
+
+	def accels_on(self, target_pos, pos=None):
+		"""
+		Acceleration on massless test particles at target_pos caused by the objects (at positions `pos` if given)
+		The particles feel the objects' gravity but don't pull on them
+		"""
+		if pos is None:
+			pos = self.pos
+		sources = np.flatnonzero(self.active & (self.mass > 0))
+		if self.solver == "barnes_hut" and len(sources) >= BH_MIN_BODIES:
+			return barnes_hut.tree_accels(target_pos, pos[sources], self.mass[sources], theta=self.theta)
+		return gravity_accels(target_pos, pos[sources], self.mass[sources])
+
+	def update_pos(self, time, accels, frozen=None):
+		"""
+		Moves every object which isn't on rails after time `time` with constant accelerations `accels` (same maths as SpaceObject.update_pos)
+		Objects marked in `frozen` have their velocity nulled instead
+		"""
+		free = ~self.rails
+		if frozen is not None:
+			self.vel[frozen & free] = 0
+			free &= ~frozen
+		if kernels.enabled():
+			kernels.update_pos(self.pos, self.vel, accels, free, time)
+			return
+		# s = ut + 0.5at^2
+		# v = u + at
+		self.pos[free] += self.vel[free] * time + accels[free] * time**2 / 2
+		self.vel[free] += accels[free] * time
+
+
+def state_of(so_list):
+	"""
+	The SystemState shared by all of the objects in so_list, binding them to a new one if they don't already share one
+	"""
+	state = so_list[0].state if len(so_list) > 0 else None
+	if state is None or state.objects != list(so_list):
+		state = SystemState(so_list)
+	return state
@@ -0,0 +1,154 @@
+# Planetary ephemeris
+# Every body except the rocket follows (nearly) the same path every run, so integrate them once, store their states at fixed intervals in a
+# memory-mapped .npy file keyed by a hash of the initial conditions, and interpolate between the samples from then on.
+# Rocket-only studies then just look the planets up rather than working out the forces between all of them each step
+
+import hashlib
+import os
+import numpy as np
+from math import *
+from consts import *
+from utils import *
+from integrators import make_integrator
+
+
+EPHEMERIS_VERSION = 1 # Bump whenever the file contents or the physics change, so old caches get ignored
+
+
+class Ephemeris(object):
+	"""
+	States of all of the bodies sampled every `interval` seconds from `start` (simulated seconds)
+	samples has shape (n_samples, n_bodies, 4), with x, y, x_vel, y_vel in the last axis
+	"""
+	def __init__(self, samples, interval, start=0, moon_angle=0, earth_rot=0, path=None):
+		self.samples = samples.view(np.ndarray) # Still backed by the file if it's a memmap, but without the per-slice memmap overheads
+		self.interval = interval
+		self.start = start
+		self.moon_angle = moon_angle # Angles at `start`, the moon and the Earth's rotation just carry on at a constant rate from there
+		self.earth_rot = earth_rot
+		self.path = path
+
+	@property
+	def end(self):
+		return self.start + (len(self.samples) - 1) * self.interval
+
+	def state_at(self, t, index=slice(None)):
+		"""
+		Positions and velocities at time `t` (simulated seconds, may be an array) of the bodies picked out by `index`, by cubic Hermite
+		interpolation between the samples either side
+		"""
+		if np.ndim(t) == 0:
+			return self.state_at_scalar(float(t), index)
+		t = np.asarray(t, dtype=float)
+		if np.any(t < self.start) or np.any(t > self.end):
+			raise ValueError(f"Time outside of the ephemeris ({self.start} to {self.end} seconds)")
+		k = np.minimum(((t - self.start) // self.interval).astype(int), len(self.samples) - 2)
+		s = ((t - self.start) - k * self.interval) / self.interval
+		a = self.samples[k, index]
+		b = self.samples[k + 1, index]
+		return hermite(a, b, s.reshape(s.shape + (1,) * (a.ndim - s.ndim)), self.interval)
+
+	def state_at_scalar(self, t, index=slice(None)):
+		"""
+		state_at() for a single time, which is what the step-by-step users want. Avoids most of the array overheads
+		"""
+		if t < self.start or t > self.end:
+			raise ValueError(f"Time outside of the ephemeris ({self.start} to {self.end} seconds)")
+		k = min(int((t - self.start) // self.interval), len(self.samples) - 2)
+		s = ((t - self.start) - k * self.interval) / self.interval
+		return hermite(self.samples[k, index], self.samples[k + 1, index], s, self.interval)
+
+	def apply(self, state, t, rows):
+		"""
+		Sets the positions and velocities of `rows` of `state` to where they are at time `t`
+		"""
+		pos, vel = self.state_at(t)
+		state.pos[rows] = pos[rows]
+		state.vel[rows] = vel[rows]
+
+	def jump_to(self, simulation, t):
+		"""
+		Puts every body of `simulation` where it is at time `t` (with the rocket still on the ground)
+		"""
+		state = simulation.state
+		simulation.sim_time = t
+		self.apply(state, t, np.arange(len(state)) != simulation.rocket.index)
+		simulation.moon.angle_from_earth = self.moon_angle + (t - self.start) * 360 / (MOON_PERIOD_DAYS * SECS_IN_A_DAY)
+		simulation.earth.rot = (self.earth_rot + (t - self.start) / SECS_IN_A_DAY * 360) % 360
+		simulation.rocket.impacted_by_gravity = False
+		simulation.park_rocket()
+
+	def advance_rocket(self, simulation, time_passed, iterations=1, integrator=None):
+		"""
+		Same as Simulation.advance(), except only the rocket is integrated and everything else is looked up
+		"""
+		if integrator is None:
+			integrator = simulation.space_integrator
+		state = simulation.state
+		rocket = simulation.rocket
+		r = rocket.index
+		moon_i = simulation.moon.index
+		for iteration_num in range(iterations):
+			dt = time_passed / iterations
+			if rocket.impacted_by_gravity == True:
+				t0 = simulation.sim_time
+				if simulation.conics is None:
+					accel_fn = lambda pos, t, rows=None: simulation.rocket_accel(pos, self.state_at(t0 + t, moon_i)[0])
+				else:
+					accel_fn = lambda pos, t, rows=None: simulation.rocket_accels(pos, self.state_at(t0 + t)[0], t)
+				state.pos[r:r + 1], state.vel[r:r + 1], collided = integrator.step(state.pos[r:r + 1], state.vel[r:r + 1], dt, accel_fn, b"rocket")
+			simulation.sim_time += dt
+			rocket.update_mass(simulation.sim_time)
+			simulation.moon.angle_from_earth += dt * 360 / (MOON_PERIOD_DAYS * SECS_IN_A_DAY) # Each step's moon on rails starts from here
+			simulation.earth.rot += dt / SECS_IN_A_DAY * 360
+			simulation.earth.rot %= 360
+
+		self.apply(state, simulation.sim_time, np.arange(len(state)) != r)
+		if rocket.impacted_by_gravity == False:
+			simulation.park_rocket()
+
+
+def ephemeris_key(simulation, span, interval, substeps):
+	"""
+	Hash of the current state of `simulation` and of how the ephemeris would be built from it
+	"""
+	state = simulation.state
+	key = hashlib.sha1()
+	for arr in (state.pos, state.vel, state.mass, state.active, state.rails):
+		key.update(np.ascontiguousarray(arr).tobytes())
+	key.update(repr((EPHEMERIS_VERSION, [ so.name for so in simulation.space_objects ], simulation.moon.angle_from_earth, simulation.earth.rot, simulation.sim_time, span, interval, substeps, INTEGRATOR)).encode())
+	return key.hexdigest()
+
+def load_ephemeris(simulation, span_days=EPHEMERIS_SPAN_DAYS, interval=EPHEMERIS_INTERVAL, substeps=EPHEMERIS_SUBSTEPS, cache_dir=EPHEMERIS_DIR):
+	"""
+	Ephemeris starting from the current state of `simulation` and lasting `span_days`, loaded from the cache if it's been built before
+	Building it integrates everything with `substeps` steps per sample, then puts the simulation back how it was
+	"""
+	span = span_days * SECS_IN_A_DAY
+	path = os.path.join(cache_dir, f"ephemeris-{ephemeris_key(simulation, span, interval, substeps)}.npy")
+	start = simulation.sim_time
+	if not os.path.exists(path):
+		build_ephemeris(simulation, path, span, interval, substeps)
+	samples = np.load(path, mmap_mode="r")
+	return Ephemeris(samples, interval, start, simulation.moon.angle_from_earth, simulation.earth.rot, path)
+
+def build_ephemeris(simulation, path, span, interval, substeps):
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	saved = simulation.save_state()
+	state = simulation.state
+	integrator = make_integrator(INTEGRATOR)
+	num_samples = ceil(span / interval) + 1
+
+	tmp_path = f"{path}.{os.getpid()}.tmp"
+	samples = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float64, shape=(num_samples, len(state), 4))
+	samples[0, :, :2] = state.pos
+	samples[0, :, 2:] = state.vel
+	for k in range(1, num_samples):
+		simulation.step(interval, iterations=substeps, integrator=integrator)
+		samples[k, :, :2] = state.pos
+		samples[k, :, 2:] = state.vel
+	samples.flush()
+	del samples
+	os.replace(tmp_path, path) # Only appears once it's complete, so other processes never read half of one
+
+	simulation.restore_state(saved)
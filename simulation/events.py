@@ -0,0 +1,345 @@
+# Event detection
+# Watches for things happening part way through a step, like the rocket's closest approach to the moon, it hitting the moon, or it coming
+# into the moon's sphere of influence. Each event is a function of the state which crosses zero when it happens, so after every step the
+# detector looks for sign changes, pins down when they happened by root-finding on the integrator's dense output (see
+# Integrator.dense_output()) and hands them to the event's callbacks. Terminal events stop the simulation exactly at the event, rather than
+# somewhere in the step after it, so a sweep gets accurate encounter times and distances without needing tiny timesteps all the way through
+
+import copy
+from math import *
+from consts import *
+
+
+class Event(object):
+	"""
+	Something to watch for. value(t, pos, vel) is a number which crosses zero when it happens
+	direction is 1 to only count it going from negative to positive, -1 for only the other way, or 0 for both
+	Terminal events stop the simulation when they happen, and refined ones are reported with the state integrated right up to them rather
+	than interpolated
+	"""
+	kind = "event"
+
+	def __init__(self, name=None, direction=0, terminal=False, refine=False):
+		self.name = self.kind if name is None else name
+		self.direction = direction
+		self.terminal = terminal
+		self.refine = refine
+		self.callbacks = [] # Called with each EventHit, in the order they happen. One returning True stops the simulation there too
+
+	def bind(self, simulation):
+		"""
+		Works out whatever it needs from `simulation` before the detector starts watching
+		"""
+		pass
+
+	def value(self, t, pos, vel):
+		raise NotImplementedError
+
+	def describe(self, t, pos, vel, rising):
+		"""
+		Anything else worth knowing about it when it happens (as a dict). rising is whether value() was going up through zero
+		"""
+		return {}
+
+
+class BodyEvent(Event):
+	"""
+	An event about `body` relative to `other` (SpaceObjects, or their names)
+	"""
+	def __init__(self, body, other, name=None, direction=0, terminal=False, refine=False):
+		super().__init__(name, direction, terminal, refine)
+		self.body = body
+		self.other = other
+
+	def bind(self, simulation):
+		self.body, self.other = [ simulation.body(so) if isinstance(so, str) else so for so in ( self.body, self.other ) ]
+		if self.body is None or self.other is None:
+			raise KeyError(f"{self.name} is about a body that isn't in {simulation.scenario.name}")
+		self.i = self.body.index
+		self.j = self.other.index
+
+	def relative(self, pos, vel):
+		"""
+		Position and velocity of the body relative to the other, as (x, y, x_vel, y_vel)
+		"""
+		i, j = self.i, self.j
+		return pos[i, 0] - pos[j, 0], pos[i, 1] - pos[j, 1], vel[i, 0] - vel[j, 0], vel[i, 1] - vel[j, 1]
+
+	def describe(self, t, pos, vel, rising):
+		x, y, x_vel, y_vel = self.relative(pos, vel)
+		return { "distance": hypot(x, y), "speed": hypot(x_vel, y_vel) }
+
+
+class ClosestApproach(BodyEvent):
+	"""
+	The body getting as close to the other as it's going to for now (its periapsis, if it's orbiting the other)
+	The distance between them stops going down, which is when the relative position and velocity are at right angles
+	"""
+	kind = "closest_approach"
+
+	def __init__(self, body, other, name=None, terminal=False, refine=False):
+		super().__init__(body, other, name, 1, terminal, refine)
+
+	def value(self, t, pos, vel):
+		x, y, x_vel, y_vel = self.relative(pos, vel)
+		return x * x_vel + y * y_vel # Half how fast the distance squared is changing
+
+
+class DistanceThreshold(BodyEvent):
+	"""
+	The distance between the bodies crossing `distance` (meters): going out past it with direction 1, coming in with -1, or either with 0
+	"""
+	kind = "distance"
+
+	def __init__(self, body, other, distance, name=None, direction=0, terminal=False, refine=False):
+		super().__init__(body, other, name, direction, terminal, refine)
+		self.distance = distance
+
+	def value(self, t, pos, vel):
+		x, y, x_vel, y_vel = self.relative(pos, vel)
+		return hypot(x, y) - self.distance
+
+
+class Impact(DistanceThreshold):
+	"""
+	The body hitting the surface of the other (or coming within `radius` of its centre, if given). Stops the simulation by default
+	"""
+	kind = "impact"
+
+	def __init__(self, body, other, radius=None, name=None, terminal=True, refine=False):
+		super().__init__(body, other, radius, name, -1, terminal, refine)
+
+	def bind(self, simulation):
+		super().bind(simulation)
+		if self.distance is None:
+			self.distance = self.other.radius
+
+
+class SphereOfInfluence(BodyEvent):
+	"""
+	The body coming into (or leaving) the sphere of influence of the other, inside which the other's gravity matters more than that of
+	`centre`, the body the other orbits (its centre in the scenario if not given)
+	Its radius is a * (m / M)^(2/5), with a how far the other is from the centre at the time
+	"""
+	kind = "sphere_of_influence"
+
+	def __init__(self, body, other, centre=None, name=None, direction=0, terminal=False, refine=False):
+		super().__init__(body, other, name, direction, terminal, refine)
+		self.centre = centre
+
+	def bind(self, simulation):
+		super().bind(simulation)
+		if self.centre is None:
+			c = int(simulation.scenario.bodies["centre"][self.j])
+			if c < 0:
+				raise ValueError(f"{self.other.name} doesn't orbit anything, so {self.name} needs a centre")
+			self.centre = simulation.space_objects[c]
+		elif isinstance(self.centre, str):
+			self.centre = simulation.body(self.centre)
+		self.k = self.centre.index
+		self.mass_ratio = (self.other.mass / self.centre.mass)**0.4
+
+	def radius(self, pos):
+		j, k = self.j, self.k
+		return hypot(pos[j, 0] - pos[k, 0], pos[j, 1] - pos[k, 1]) * self.mass_ratio
+
+	def value(self, t, pos, vel):
+		x, y, x_vel, y_vel = self.relative(pos, vel)
+		return hypot(x, y) - self.radius(pos)
+
+	def describe(self, t, pos, vel, rising):
+		info = super().describe(t, pos, vel, rising)
+		info["entering"] = not rising
+		info["radius"] = self.radius(pos)
+		return info
+
+
+class Threshold(Event):
+	"""
+	fn(t, pos, vel) crossing `level`, for anything else worth watching for
+	"""
+	kind = "threshold"
+
+	def __init__(self, fn, level=0, name=None, direction=0, terminal=False, refine=False):
+		super().__init__(name, direction, terminal, refine)
+		self.fn = fn
+		self.level = level
+
+	def value(self, t, pos, vel):
+		return self.fn(t, pos, vel) - self.level
+
+
+class EventHit(object):
+	"""
+	One event happening: when (simulated seconds), the positions and velocities of everything then, and what the event had to say about it
+	"""
+	def __init__(self, event, t, pos, vel, info):
+		self.event = event
+		self.name = event.name
+		self.kind = event.kind
+		self.t = t
+		self.pos = pos
+		self.vel = vel
+		self.info = info
+
+	def __repr__(self):
+		return f"EventHit({self.name!r}, t={self.t!r}, {self.info!r})"
+
+
+def find_root(f, a, b, fa, fb, tol=EVENT_TIME_TOL, max_iter=EVENT_MAX_ITER):
+	"""
+	Where f crosses zero between a and b (fa and fb having different signs), by the Illinois version of false position
+	"""
+	side = 0
+	for _ in range(max_iter):
+		if b - a <= tol or fa == fb:
+			break
+		c = (a * fb - b * fa) / (fb - fa)
+		fc = f(c)
+		if fc == 0:
+			return c
+		if (fc > 0) == (fb > 0):
+			b, fb = c, fc
+			if side == -1: # Same end moved twice in a row, so stop the other one getting stuck
+				fa /= 2
+			side = -1
+		else:
+			a, fa = c, fc
+			if side == 1:
+				fb /= 2
+			side = 1
+	return b if fa == fb else (a * fb - b * fa) / (fb - fa)
+
+def step_simulation(simulation, dt, integrator):
+	simulation.step(dt, integrator=integrator)
+
+
+class EventDetector(object):
+	"""
+	Steps a Simulation, watching for events between the steps
+	`stepper(simulation, dt, integrator)` moves it on (Simulation.step() if not given, e.g. Ephemeris.advance_rocket() instead), and `rows`
+	are the rows of the state it has the integrator step, if that isn't all of them
+	"""
+	def __init__(self, simulation, events=(), integrator=None, stepper=None, tol=EVENT_TIME_TOL, max_iter=EVENT_MAX_ITER, rows=None):
+		self.simulation = simulation
+		self.integrator = simulation.space_integrator if integrator is None else integrator
+		self.stepper = step_simulation if stepper is None else stepper
+		self.rows = rows
+		self.tol = tol
+		self.max_iter = max_iter
+		self.events = []
+		self.hits = []      # Everything that's happened so far, in order
+		self.stopped = None # The hit that stopped the last step, if one did
+		self.fired = None   # (event, time) of that hit, so it isn't found again straight after
+		for event in events:
+			self.add(event)
+
+	def add(self, event, callback=None):
+		"""
+		Starts watching for `event`, calling `callback` (if given) with an EventHit whenever it happens. Returns the event
+		"""
+		event.bind(self.simulation)
+		if callback is not None:
+			event.callbacks.append(callback)
+		self.events.append(event)
+		return event
+
+	def integrate_to(self, saved, t, integrator):
+		"""
+		Puts the simulation back to `saved` and integrates it on to `t`
+		"""
+		self.simulation.restore_state(saved)
+		integrator.reset()
+		if t > saved["sim_time"]:
+			self.stepper(self.simulation, t - saved["sim_time"], integrator)
+
+	def step(self, dt):
+		"""
+		Moves the simulation on by `dt` seconds, returning the EventHits along the way in order
+		If one of them stops it, it's left exactly at that event (self.stopped) rather than at the end of the step
+		"""
+		simulation = self.simulation
+		state = simulation.state
+		saved = simulation.save_state()
+		t0 = saved["sim_time"]
+		before = [ event.value(t0, saved["pos"], saved["vel"]) for event in self.events ]
+		self.stepper(simulation, dt, self.integrator)
+		t1 = simulation.sim_time
+		after = [ event.value(t1, state.pos, state.vel) for event in self.events ]
+		self.stopped = None
+
+		# Look for crossings between the ends of the step and anywhere the integrator stopped along the way, then find when each one happened
+		# on the dense output
+		dense = None
+		samples = [ (0, before) ]
+		inner = self.integrator.inner_times(t1 - t0)
+		if inner:
+			dense = self.integrator.dense_output(saved["pos"], saved["vel"], state.pos.copy(), state.vel.copy(), t1 - t0, self.rows)
+			for s in inner:
+				pos, vel = dense(s)
+				samples.append((s, [ event.value(t0 + s, pos, vel) for event in self.events ]))
+		samples.append((t1 - t0, after))
+		found = []
+		for k, event in enumerate(self.events):
+			for (s0, g0), (s1, g1) in zip(samples, samples[1:]):
+				g0, g1 = g0[k], g1[k]
+				rising = g0 < 0 <= g1
+				if not (rising or g0 > 0 >= g1) or event.direction == (-1 if rising else 1):
+					continue
+				if dense is None:
+					dense = self.integrator.dense_output(saved["pos"], saved["vel"], state.pos.copy(), state.vel.copy(), t1 - t0, self.rows)
+				s = find_root(lambda s: event.value(t0 + s, *dense(s)), s0, s1, g0, g1, self.tol, self.max_iter)
+				if self.fired is not None and self.fired == (event, t0) and s <= 2 * self.tol:
+					continue # Where the step before stopped for it
+				found.append((s, rising, event))
+		self.fired = None
+		if not found:
+			return []
+
+		found.sort(key=lambda item: item[0])
+		end = None
+		hits = []
+		for s, rising, event in found:
+			t = t0 + s
+			if event.terminal or event.refine:
+				if end is None and not event.terminal:
+					end = simulation.save_state()
+				self.integrate_to(saved, t, self.integrator if event.terminal else self.refiner())
+				pos, vel = state.pos.copy(), state.vel.copy()
+			else:
+				pos, vel = dense(s)
+			hit = EventHit(event, t, pos, vel, event.describe(t, pos, vel, rising))
+			hits.append(hit)
+			stop = event.terminal
+			for callback in event.callbacks:
+				stop = bool(callback(hit)) or stop
+			if stop:
+				if not event.terminal:
+					self.integrate_to(saved, t, self.integrator)
+				self.stopped = hit
+				self.fired = (event, simulation.sim_time)
+				break
+		else:
+			if end is not None: # Back to the end of the step, after integrating up to the refined events
+				simulation.restore_state(end)
+		self.hits.extend(hits)
+		return hits
+
+	def refiner(self):
+		"""
+		Integrator with the same settings (tolerances etc.) as the detector's, for going back over a step without touching what that one
+		remembers
+		"""
+		return copy.copy(self.integrator) # integrate_to() resets it before it's used
+
+	def run(self, until, dt):
+		"""
+		Steps by `dt` until the simulated time reaches `until` (seconds) or an event stops it, returning the EventHits along the way
+		"""
+		hits = []
+		simulation = self.simulation
+		while simulation.sim_time < until:
+			hits.extend(self.step(min(dt, until - simulation.sim_time)))
+			if self.stopped is not None:
+				break
+		return hits
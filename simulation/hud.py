@@ -0,0 +1,40 @@
+# Text for the heads-up display
+# Rasterising text with a pygame font is one of the slower things done each frame, and the labels hardly ever change (the date only
+# changes once a simulated month), so rendered text is kept in a least-recently-used cache keyed by the font, text and colour
+
+from collections import OrderedDict
+from consts import *
+
+
+class TextCache(object):
+	def __init__(self, capacity=HUD_CACHE_SIZE):
+		self.capacity = capacity
+		self.surfaces = OrderedDict() # (font, text, colour) -> surface, least recently used first
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		return len(self.surfaces)
+
+	def render(self, font, text, colour):
+		"""
+		Same as font.render(text, True, colour), but only rendered the first time (until it's pushed out of the cache)
+		"""
+		key = (font, text, colour)
+		surface = self.surfaces.get(key)
+		if surface is not None:
+			self.surfaces.move_to_end(key)
+			self.hits += 1
+			return surface
+		self.misses += 1
+		surface = font.render(text, True, colour)
+		self.surfaces[key] = surface
+		if len(self.surfaces) > self.capacity:
+			self.surfaces.popitem(last=False)
+		return surface
+
+	def clear(self):
+		self.surfaces.clear()
+
+
+text_cache = TextCache() # Shared by all of the text drawn
@@ -0,0 +1,480 @@
+# Integrators for moving the SystemState arrays on in time
+# Each one takes positions, velocities, a timestep and an acceleration function accel_fn(pos, t) -> (accels, collided), where t is how far
+# into the step the positions are. Objects flagged as collided at any point in the step keep their position and have their velocity nulled
+# The block timestep integrator also passes the rows it needs the accelerations of, accel_fn(pos, t, rows), and ignores the rest
+
+import bisect
+import numpy as np
+from consts import *
+from utils import hermite
+import kernels
+
+
+def cache_state(integrator):
+	"""
+	get_state() of an integrator that remembers the accelerations at the end of its last step (in last_pos, last_key and last_accel)
+	"""
+	if integrator.last_pos is None:
+		return {}
+	accel, collided = integrator.last_accel
+	state = { "last_pos": integrator.last_pos.copy(), "last_accel": accel.copy(), "last_collided": collided.copy() }
+	if integrator.last_key is not None:
+		state["last_key"] = np.frombuffer(integrator.last_key, dtype=np.uint8).copy()
+	return state
+
+def set_cache_state(integrator, state):
+	integrator.reset()
+	if "last_pos" in state:
+		integrator.last_pos = np.array(state["last_pos"], dtype=float)
+		integrator.last_key = np.asarray(state["last_key"], dtype=np.uint8).tobytes() if "last_key" in state else None
+		integrator.last_accel = (np.array(state["last_accel"], dtype=float), np.array(state["last_collided"], dtype=bool))
+
+
+class Integrator(object):
+	name = "integrator"
+
+	def __init__(self):
+		self.evaluations = 0      # Number of times the forces have been worked out, which is what costs the time
+		self.body_evaluations = 0 # Number of accelerations of single bodies worked out over all of those
+
+	def reset(self):
+		"""
+		Forgets anything remembered from previous steps (call whenever the state is changed from outside)
+		"""
+		pass
+
+	def get_state(self):
+		"""
+		Anything remembered from previous steps, as a dict of arrays (e.g. for a snapshot, see snapshot.py), so that after set_state() it
+		carries on exactly as this one would
+		"""
+		return {}
+
+	def set_state(self, state):
+		self.reset()
+
+	def accel(self, accel_fn, pos, t, rows=None):
+		self.evaluations += 1
+		if rows is None:
+			self.body_evaluations += len(pos)
+			return accel_fn(pos, t)
+		self.body_evaluations += len(rows)
+		return accel_fn(pos, t, rows)
+
+	def step(self, pos, vel, dt, accel_fn, key=None):
+		"""
+		Returns the new (pos, vel, collided) after time dt
+		`key` identifies anything else the accelerations depend on (e.g. which objects are impacted by gravity)
+		"""
+		raise NotImplementedError
+
+	def sync(self, pos):
+		"""
+		Called after the caller moved objects whose positions don't affect any accelerations (e.g. ones on rails)
+		"""
+		pass
+
+	def dense_output(self, pos, vel, new_pos, new_vel, dt, rows=None):
+		"""
+		Function of s (seconds into a step of dt from pos, vel to new_pos, new_vel) giving the positions and velocities part way through it
+		A cubic Hermite through both ends, which is as good as any of these steps are anyway
+		`rows` are the rows of pos the step was actually taken with, if it was only some of them (e.g. just the rocket's)
+		"""
+		a = np.concatenate((pos, vel), axis=-1)
+		b = np.concatenate((new_pos, new_vel), axis=-1)
+		return lambda s: hermite(a, b, s / dt, dt)
+
+	def inner_times(self, dt):
+		"""
+		Times within the last step (of dt) the integrator stopped at along the way, where anything worth noticing could have come and gone
+		without showing at the ends
+		"""
+		return []
+
+	@staticmethod
+	def finish(pos, vel, new_pos, new_vel, collided):
+		new_pos[collided] = pos[collided]
+		new_vel[collided] = 0
+		return new_pos, new_vel, collided
+
+
+class Kinematic(Integrator):
+	"""
+	The original method: one constant-acceleration step (s = ut + 0.5at^2, v = u + at). First order
+	"""
+	name = "kinematic"
+
+	def step(self, pos, vel, dt, accel_fn, key=None):
+		a, collided = self.accel(accel_fn, pos, 0)
+		return self.finish(pos, vel, pos + vel * dt + a * dt**2 / 2, vel + a * dt, collided)
+
+
+class Leapfrog(Integrator):
+	"""
+	Velocity Verlet (kick-drift-kick). Second order and symplectic, so orbits don't drift in energy
+	The acceleration at the end of a step is reused at the start of the next, so it costs one force evaluation per step
+	"""
+	name = "leapfrog"
+
+	def __init__(self):
+		super().__init__()
+		self.reset()
+
+	def reset(self):
+		self.last_pos = None
+		self.last_key = None
+		self.last_accel = None
+
+	def sync(self, pos):
+		if self.last_pos is not None:
+			self.last_pos = pos.copy()
+
+	def get_state(self):
+		return cache_state(self)
+
+	def set_state(self, state):
+		set_cache_state(self, state)
+
+	def step(self, pos, vel, dt, accel_fn, key=None):
+		if self.last_pos is not None and self.last_key == key and self.last_pos.shape == pos.shape and np.array_equal(self.last_pos, pos):
+			a0, collided = self.last_accel
+		else:
+			a0, collided = self.accel(accel_fn, pos, 0)
+		if kernels.enabled():
+			half_vel, new_pos = kernels.kick_drift(pos, vel, a0, dt)
+		else:
+			half_vel = vel + a0 * dt / 2
+			new_pos = pos + half_vel * dt
+		a1, collided1 = self.accel(accel_fn, new_pos, dt)
+		new_vel = kernels.kick(half_vel, a1, dt) if kernels.enabled() else half_vel + a1 * dt / 2
+		collided = collided | collided1
+		new_pos, new_vel, collided = self.finish(pos, vel, new_pos, new_vel, collided)
+		self.last_pos = new_pos.copy()
+		self.last_key = key
+		self.last_accel = (a1, collided1)
+		return new_pos, new_vel, collided
+
+
+class RK4(Integrator):
+	"""
+	Classic fourth-order Runge-Kutta. Four force evaluations per step
+	"""
+	name = "rk4"
+
+	def step(self, pos, vel, dt, accel_fn, key=None):
+		a1, c1 = self.accel(accel_fn, pos, 0)
+		p2 = pos + vel * dt / 2
+		v2 = vel + a1 * dt / 2
+		a2, c2 = self.accel(accel_fn, p2, dt / 2)
+		p3 = pos + v2 * dt / 2
+		v3 = vel + a2 * dt / 2
+		a3, c3 = self.accel(accel_fn, p3, dt / 2)
+		p4 = pos + v3 * dt
+		v4 = vel + a3 * dt
+		a4, c4 = self.accel(accel_fn, p4, dt)
+		new_pos = pos + dt / 6 * (vel + 2 * v2 + 2 * v3 + v4)
+		new_vel = vel + dt / 6 * (a1 + 2 * a2 + 2 * a3 + a4)
+		return self.finish(pos, vel, new_pos, new_vel, c1 | c2 | c3 | c4)
+
+
+# Dormand-Prince 5(4) coefficients
+DOPRI_C = [ 0, 1/5, 3/10, 4/5, 8/9, 1, 1 ]
+DOPRI_A = [
+	[],
+	[ 1/5 ],
+	[ 3/40, 9/40 ],
+	[ 44/45, -56/15, 32/9 ],
+	[ 19372/6561, -25360/2187, 64448/6561, -212/729 ],
+	[ 9017/3168, -355/33, 46732/5247, 49/176, -5103/18656 ],
+	[ 35/384, 0, 500/1113, 125/192, -2187/6784, 11/84 ],
+]
+DOPRI_B = [ 35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0 ]                         # Fifth order solution
+DOPRI_E = [ 71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40 ]                # Fifth order minus fourth order
+
+
+class DormandPrince(Integrator):
+	"""
+	Adaptive Dormand-Prince 5(4). Each step of dt is split into as many substeps as are needed to keep the local error
+	within atol + rtol * |y|, so it only takes small steps where things change quickly (e.g. the rocket passing the moon)
+	"""
+	name = "dopri5"
+
+	def __init__(self, rtol=INTEGRATOR_RTOL, atol_pos=INTEGRATOR_ATOL_POS, atol_vel=INTEGRATOR_ATOL_VEL, max_substeps=INTEGRATOR_MAX_SUBSTEPS):
+		super().__init__()
+		self.rtol = rtol
+		self.atol_pos = atol_pos
+		self.atol_vel = atol_vel
+		self.max_substeps = max_substeps
+		self.substeps = 0
+		self.rejected = 0
+		self.reset()
+
+	def reset(self):
+		self.h = None # Size of the next substep to try
+		self.knots = [] # (time into the step, pos, vel) at the ends of the accepted substeps of the last step
+
+	def get_state(self):
+		return {} if self.h is None else { "h": np.array(self.h) }
+
+	def set_state(self, state):
+		self.reset()
+		if "h" in state:
+			self.h = float(state["h"])
+
+	def error_norm(self, pos, vel, new_pos, new_vel, err_pos, err_vel):
+		sc_pos = self.atol_pos + self.rtol * np.maximum(np.abs(pos), np.abs(new_pos))
+		sc_vel = self.atol_vel + self.rtol * np.maximum(np.abs(vel), np.abs(new_vel))
+		return max(np.max(np.abs(err_pos) / sc_pos, initial=0), np.max(np.abs(err_vel) / sc_vel, initial=0))
+
+	def substep(self, pos, vel, t, h, accel_fn):
+		k_pos = []
+		k_vel = []
+		collided = np.zeros(len(pos), dtype=bool)
+		for stage in range(7):
+			p = pos.copy()
+			v = vel.copy()
+			for j, coeff in enumerate(DOPRI_A[stage]):
+				if coeff != 0:
+					p += h * coeff * k_pos[j]
+					v += h * coeff * k_vel[j]
+			if stage == 6:
+				new_pos, new_vel = p, v # The last stage is evaluated at the fifth order solution
+			a, c = self.accel(accel_fn, p, t + DOPRI_C[stage] * h)
+			collided |= c
+			k_pos.append(v)
+			k_vel.append(a)
+		err_pos = h * sum(e * k for e, k in zip(DOPRI_E, k_pos) if e != 0)
+		err_vel = h * sum(e * k for e, k in zip(DOPRI_E, k_vel) if e != 0)
+		return new_pos, new_vel, collided, self.error_norm(pos, vel, new_pos, new_vel, err_pos, err_vel)
+
+	def step(self, pos, vel, dt, accel_fn, key=None):
+		start_pos = pos
+		start_vel = vel
+		collided = np.zeros(len(pos), dtype=bool)
+		t = 0
+		h = dt if self.h is None else min(self.h, dt)
+		substeps = 0
+		knots = [ (0, pos.copy(), vel.copy()) ] # The caller may write the result back over pos and vel
+		while t < dt:
+			clamped = h > dt - t # Cut short to land exactly on dt, so don't remember this as the natural step size
+			step_h = min(h, dt - t)
+			new_pos, new_vel, c, err = self.substep(pos, vel, t, step_h, accel_fn)
+			substeps += 1
+			accepted = err <= 1 or substeps >= self.max_substeps or step_h <= dt * 1e-12
+			if accepted:
+				t += step_h
+				pos, vel = new_pos, new_vel
+				collided |= c
+				self.substeps += 1
+				knots.append((t, pos, vel))
+			else:
+				self.rejected += 1
+			if not (accepted and clamped):
+				# Standard step size controller, not letting it change by too much at once
+				factor = 5 if err == 0 else min(5, max(0.2, 0.9 * err**-0.2))
+				h = step_h * factor
+		self.h = h
+		self.knots = knots
+		return self.finish(start_pos, start_vel, pos.copy(), vel.copy(), collided)
+
+
+	def inner_times(self, dt):
+		if len(self.knots) < 3 or self.knots[-1][0] != dt:
+			return []
+		return [ t for t, _, _ in self.knots[1:-1] ]
+
+	def dense_output(self, pos, vel, new_pos, new_vel, dt, rows=None):
+		"""
+		Hermite pieces between the substeps of the last step, which are short wherever things changed quickly
+		Rows the caller changed after the step (bodies on rails, collisions) or didn't step at all are just interpolated between the ends of
+		it instead
+		"""
+		whole = super().dense_output(pos, vel, new_pos, new_vel, dt)
+		knots = self.knots
+		stepped = np.arange(len(new_pos)) if rows is None else np.asarray(rows, dtype=int)
+		if len(knots) < 3 or knots[-1][0] != dt or knots[-1][1].shape != new_pos[stepped].shape:
+			return whole
+		exact = np.all(knots[-1][1] == new_pos[stepped], axis=-1) & np.all(knots[-1][2] == new_vel[stepped], axis=-1)
+		if not exact.any():
+			return whole
+		times = [ t for t, _, _ in knots ]
+		def at(s):
+			k = min(max(bisect.bisect_right(times, s) - 1, 0), len(knots) - 2)
+			(t_a, pos_a, vel_a), (t_b, pos_b, vel_b) = knots[k], knots[k + 1]
+			h = t_b - t_a
+			p, v = hermite(np.concatenate((pos_a, vel_a), axis=-1), np.concatenate((pos_b, vel_b), axis=-1), (s - t_a) / h, h)
+			if rows is None and exact.all():
+				return p, v
+			p_whole, v_whole = whole(s)
+			p_whole[stepped[exact]] = p[exact]
+			v_whole[stepped[exact]] = v[exact]
+			return p_whole, v_whole
+		return at
+
+
+class BlockTimestep(Integrator):
+	"""
+	Block individual timesteps. Each body steps at dt / 2^level, with its level fitted to how quickly its acceleration is changing
+	(steps of eta * |a| / |da/dt|), so an outer planet takes one step where the rocket passing the moon takes hundreds. At each point in
+	the step only the bodies due there have their accelerations worked out, from everyone else's positions extrapolated to then. Every
+	body's step is a velocity Verlet step (as in Leapfrog), and all of them line up again at the end of dt
+	Levels go down (smaller steps) straight away, but only up one at a time, when the bigger step lines up with the others
+	"""
+	name = "block"
+
+	def __init__(self, eta=BLOCK_ETA, max_level=BLOCK_MAX_LEVEL):
+		super().__init__()
+		self.eta = eta
+		self.max_level = max_level
+		self.reset()
+
+	def reset(self):
+		self.last_pos = None
+		self.last_key = None
+		self.last_accel = None
+		self.levels = None # Level of each body at the end of the last step
+		self.knots = None  # (row, time into the step, pos, vel) at every update of every body in the last step, and the step's dt
+
+	def sync(self, pos):
+		if self.last_pos is not None:
+			self.last_pos = pos.copy()
+
+	def get_state(self):
+		state = cache_state(self)
+		if self.levels is not None:
+			state["levels"] = self.levels.copy()
+		return state
+
+	def set_state(self, state):
+		set_cache_state(self, state)
+		if "levels" in state:
+			self.levels = np.array(state["levels"], dtype=int)
+
+	def levels_for(self, accel, old_accel, h, dt):
+		"""
+		Levels wanted by bodies whose accelerations went from old_accel to accel over steps of h
+		"""
+		with np.errstate(divide="ignore", invalid="ignore"):
+			timescale = np.hypot(accel[:, 0], accel[:, 1]) * h / np.hypot(accel[:, 0] - old_accel[:, 0], accel[:, 1] - old_accel[:, 1])
+			level = np.ceil(np.log2(dt / (self.eta * timescale))) # An unchanging acceleration (or none) gives -inf or nan, so the biggest step
+		return np.clip(np.where(np.isnan(level), 0, level), 0, self.max_level).astype(int)
+
+	def first_levels(self, pos, vel, accel, dt, accel_fn):
+		"""
+		Levels to start from when there's nothing cached: how quickly each acceleration changes is estimated from one more evaluation with
+		everything moved on by the smallest step. Bodies keep their levels from before (e.g. when the rocket launching changed what feels
+		gravity) if those were smaller steps
+		"""
+		h = dt / (1 << self.max_level)
+		moved, _ = self.accel(accel_fn, pos + vel * h + accel * h**2 / 2, h)
+		levels = self.levels_for(moved, accel, np.full(len(pos), h), dt)
+		if self.levels is not None and self.levels.shape == levels.shape:
+			levels = np.maximum(levels, self.levels)
+		return levels
+
+	def step(self, pos, vel, dt, accel_fn, key=None):
+		n = len(pos)
+		if self.last_pos is not None and self.last_key == key and self.last_pos.shape == pos.shape and np.array_equal(self.last_pos, pos):
+			accel, collided = self.last_accel
+			levels = self.levels.copy()
+		else:
+			accel, collided = self.accel(accel_fn, pos, 0)
+			levels = self.first_levels(pos, vel, accel, dt, accel_fn)
+		accel = accel.copy()
+		latest = collided.copy() # Collisions at each body's last update
+		collided = collided.copy()
+
+		# Time is counted in ticks of the smallest step there can be. Each body was last updated at tick last[i], with position x[i] etc.
+		ticks = 1 << self.max_level
+		h = dt / ticks
+		x = pos.copy()
+		v = vel.copy()
+		last = np.zeros(n, dtype=np.int64)
+		now = 0
+		knots = [ (np.arange(n), np.zeros(n), pos.copy(), vel.copy()) ]
+		while now < ticks:
+			stride = 1 << (self.max_level - levels)
+			now = int(np.min(last + stride))
+			due = np.flatnonzero(last + stride == now)
+			s = ((now - last) * h)[:, np.newaxis]
+			predicted = x + v * s + accel * s**2 / 2
+			a, c = self.accel(accel_fn, predicted, now * h, due)
+			step = s[due]
+			v[due] += (accel[due] + a[due]) * step / 2
+			x[due] = predicted[due]
+			collided[due] |= c[due]
+			latest[due] = c[due]
+			want = self.levels_for(a[due], accel[due], step[:, 0], dt)
+			accel[due] = a[due]
+			last[due] = now
+			knots.append((due, np.full(len(due), now * h), x[due], v[due]))
+			level = levels[due]
+			lines_up = now % (2 * stride[due]) == 0
+			levels[due] = np.where(want > level, want, np.where((want < level) & lines_up, level - 1, level))
+
+		new_pos, new_vel, collided = self.finish(pos, vel, x, v, collided)
+		self.last_pos = new_pos.copy()
+		self.last_key = key
+		self.last_accel = (accel, latest)
+		self.levels = levels
+		self.knots = tuple(np.concatenate(k) for k in zip(*knots)) + (dt,)
+		return new_pos, new_vel, collided
+
+	def inner_times(self, dt):
+		if self.knots is None or self.knots[-1] != dt:
+			return []
+		times = np.unique(self.knots[1])
+		return list(times[(times > 0) & (times < dt)])
+
+	def dense_output(self, pos, vel, new_pos, new_vel, dt, rows=None):
+		"""
+		Hermite pieces between each body's own updates in the last step, so the bodies on small steps are followed closely
+		Rows the caller changed after the step (bodies on rails, collisions) or didn't step at all are just interpolated between the ends of
+		it instead
+		"""
+		whole = super().dense_output(pos, vel, new_pos, new_vel, dt)
+		stepped = np.arange(len(new_pos)) if rows is None else np.asarray(rows, dtype=int)
+		if self.knots is None or self.knots[-1] != dt:
+			return whole
+		knot_rows, times, knot_pos, knot_vel, _ = self.knots
+		n = len(stepped)
+		if knot_rows.max() + 1 != n:
+			return whole
+		# Each body's knots together in time order, so body i's are order[first[i]:end[i]]
+		order = np.lexsort((times, knot_rows))
+		knot_rows, times, knot_pos, knot_vel = knot_rows[order], times[order], knot_pos[order], knot_vel[order]
+		first = np.searchsorted(knot_rows, np.arange(n))
+		end = np.searchsorted(knot_rows, np.arange(n), side="right")
+		exact = np.all(knot_pos[end - 1] == new_pos[stepped], axis=-1) & np.all(knot_vel[end - 1] == new_vel[stepped], axis=-1)
+		if not exact.any():
+			return whole
+		keys = knot_rows * 2 + times / dt # Sorted, with body i's between 2i and 2i + 1
+		def at(s):
+			b = np.clip(np.searchsorted(keys, np.arange(n) * 2 + s / dt, side="right"), first + 1, end - 1)
+			a = b - 1
+			h = (times[b] - times[a])[:, np.newaxis]
+			p, v = hermite(np.concatenate((knot_pos[a], knot_vel[a]), axis=-1), np.concatenate((knot_pos[b], knot_vel[b]), axis=-1), (s - times[a][:, np.newaxis]) / h, h)
+			if rows is None and exact.all():
+				return p, v
+			p_whole, v_whole = whole(s)
+			p_whole[stepped[exact]] = p[exact]
+			v_whole[stepped[exact]] = v[exact]
+			return p_whole, v_whole
+		return at
+
+
+INTEGRATORS = {
+	Kinematic.name: Kinematic,
+	Leapfrog.name: Leapfrog,
+	RK4.name: RK4,
+	DormandPrince.name: DormandPrince,
+	BlockTimestep.name: BlockTimestep,
+}
+
+def make_integrator(name=INTEGRATOR):
+	"""
+	Creates a new integrator by name (one of INTEGRATORS)
+	"""
+	if name not in INTEGRATORS:
+		raise ValueError(f"Unknown integrator {name!r}, expected one of {', '.join(INTEGRATORS)}")
+	return INTEGRATORS[name]()
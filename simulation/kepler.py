@@ -0,0 +1,250 @@
+# Closed-form (Keplerian) orbits
+# Bodies put on these rails aren't integrated at all: where they are at any time comes straight from their orbital elements, so a planet
+# is exactly where its orbit says at any epoch, asked for in any order, without working out a single force.
+# Each orbit is an ellipse (a circle when e = 0) around a centre body, which may itself be on rails (the moon around the Earth around the
+# sun). Anything on rails without a centre just carries on in a straight line at the velocity it started with.
+# Angles are in radians in here, and `direction` is +1 for anticlockwise orbits and -1 for clockwise ones
+
+import numpy as np
+from math import *
+from consts import *
+
+
+def solve_kepler(M, e, tol=KEPLER_TOL, max_iter=KEPLER_MAX_ITER):
+	"""
+	Eccentric anomaly E with E - e sin(E) = M, for arrays of mean anomalies M and eccentricities e (< 1), by Newton's method
+	"""
+	M = np.remainder(M, 2 * pi)
+	E = np.where(e < 0.8, M, pi) # Starting from pi always converges for very eccentric orbits
+	for _ in range(max_iter):
+		step = (E - e * np.sin(E) - M) / (1 - e * np.cos(E))
+		E = E - step
+		if np.all(np.abs(step) < tol):
+			break
+	return E
+
+def perifocal(a, e, E, n):
+	"""
+	Positions and velocities at eccentric anomaly E in the orbit's own frame (x towards periapsis, y along the direction of motion)
+	"""
+	cos_E = np.cos(E)
+	sin_E = np.sin(E)
+	root = np.sqrt(1 - e**2)
+	rate = n * a / (1 - e * cos_E) # a * dE/dt
+	pos = np.stack((a * (cos_E - e), a * root * sin_E), axis=-1)
+	vel = np.stack((-rate * sin_E, rate * root * cos_E), axis=-1)
+	return pos, vel
+
+def to_frame(vectors, periapsis, direction):
+	"""
+	Turns perifocal vectors into ones relative to the centre, for periapses at angle `periapsis` from the x axis
+	"""
+	x = vectors[..., 0]
+	y = vectors[..., 1] * direction
+	c = np.cos(periapsis)
+	s = np.sin(periapsis)
+	return np.stack((x * c - y * s, x * s + y * c), axis=-1)
+
+def elements_from_state(rel_pos, rel_vel, mu):
+	"""
+	Orbital elements (a, e, periapsis, mean_anomaly, direction) of bodies at rel_pos, rel_vel (n, 2) relative to centres with
+	gravitational parameters mu (G * mass)
+	"""
+	rel_pos = np.asarray(rel_pos, dtype=float).reshape(-1, 2)
+	rel_vel = np.asarray(rel_vel, dtype=float).reshape(-1, 2)
+	mu = np.asarray(mu, dtype=float)
+	r = np.hypot(rel_pos[:, 0], rel_pos[:, 1])
+	v_sq = rel_vel[:, 0]**2 + rel_vel[:, 1]**2
+	h = rel_pos[:, 0] * rel_vel[:, 1] - rel_pos[:, 1] * rel_vel[:, 0] # Angular momentum (per unit mass)
+	energy = v_sq / 2 - mu / r
+	if np.any(r == 0) or np.any(h == 0) or np.any(energy >= 0):
+		raise ValueError("Only bodies going around their centre on a closed orbit can be put on Kepler rails")
+	a = -mu / (2 * energy)
+	r_dot_v = np.einsum("ij,ij->i", rel_pos, rel_vel)
+	e_vec = ((v_sq - mu / r)[:, np.newaxis] * rel_pos - r_dot_v[:, np.newaxis] * rel_vel) / mu[:, np.newaxis]
+	e = np.hypot(e_vec[:, 0], e_vec[:, 1])
+	circular = e < KEPLER_TOL
+	e = np.where(circular, 0.0, e)
+	periapsis = np.where(circular, 0.0, np.arctan2(e_vec[:, 1], e_vec[:, 0])) # Circles have no periapsis, so measure from the x axis
+	direction = np.sign(h)
+	true_anomaly = direction * (np.arctan2(rel_pos[:, 1], rel_pos[:, 0]) - periapsis)
+	E = 2 * np.arctan2(np.sqrt(1 - e) * np.sin(true_anomaly / 2), np.sqrt(1 + e) * np.cos(true_anomaly / 2))
+	return a, e, periapsis, E - e * np.sin(E), direction
+
+def state_from_elements(a, e, periapsis, true_anomaly, mu, direction=1):
+	"""
+	Positions and velocities relative to the centre of bodies `true_anomaly` radians round their orbits from periapsis
+	"""
+	a, e, periapsis, true_anomaly, mu, direction = np.broadcast_arrays(*[ np.asarray(x, dtype=float) for x in (a, e, periapsis, true_anomaly, mu, direction) ])
+	E = 2 * np.arctan2(np.sqrt(1 - e) * np.sin(true_anomaly / 2), np.sqrt(1 + e) * np.cos(true_anomaly / 2))
+	pos, vel = perifocal(a, e, E, np.sqrt(mu / a**3))
+	return to_frame(pos, periapsis, direction), to_frame(vel, periapsis, direction)
+
+
+def as_index(rows):
+	"""
+	A slice instead of the array of rows if they're all next to each other (or all the same row), which NumPy indexes far quicker
+	"""
+	rows = np.asarray(rows, dtype=int)
+	if len(rows) > 0 and np.all(rows == rows[0]):
+		return slice(rows[0], rows[0] + 1) # Broadcasts to all of them
+	if len(rows) > 0 and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+		return slice(rows[0], rows[0] + len(rows))
+	return rows
+
+
+class KeplerOrbits(object):
+	"""
+	Rows of a SystemState on Kepler rails, and the elements they follow from time `epoch` (simulated seconds)
+	centres holds the row each one goes around (-1 for none)
+	"""
+	def __init__(self, rows, centres, a, e, periapsis, mean_anomaly, direction, mu, epoch, line_pos, line_vel):
+		self.rows = np.asarray(rows, dtype=int)
+		self.centres = np.asarray(centres, dtype=int)
+		self.a = np.asarray(a, dtype=float)
+		self.e = np.asarray(e, dtype=float)
+		self.periapsis = np.asarray(periapsis, dtype=float)
+		self.mean_anomaly = np.asarray(mean_anomaly, dtype=float)
+		self.direction = np.asarray(direction, dtype=float)
+		self.n = np.where(self.centres >= 0, np.sqrt(mu / np.where(self.centres >= 0, self.a, 1)**3), 0) # Mean motion (radians/sec)
+		self.epoch = epoch
+		self.line_pos = line_pos # Where the ones without a centre were at the epoch, and how fast they're going
+		self.line_vel = line_vel
+
+		# Work out the centres before the bodies going around them, a level of the hierarchy at a time
+		railed = { int(row): i for i, row in enumerate(self.rows) }
+		depth = np.zeros(len(self.rows), dtype=int)
+		for i in range(len(self.rows)):
+			seen = set()
+			j = i
+			while int(self.centres[j]) in railed:
+				if j in seen:
+					raise ValueError("Bodies on Kepler rails can't go around each other in a loop")
+				seen.add(j)
+				j = railed[int(self.centres[j])]
+				depth[i] += 1
+		slots = np.array([ railed.get(int(c), -1) for c in self.centres ], dtype=int) # Where each centre is in self.rows, if it's on rails
+		self.free_centres = np.unique(self.centres[(self.centres >= 0) & (slots < 0)]) # Centres that are integrated, so move unpredictably
+
+		# Everything each level needs gathered up front, since this gets evaluated every force calculation
+		self.levels = []
+		for d in range(depth.max() + 1 if len(depth) else 0):
+			level = np.flatnonzero(depth == d)
+			line = level[self.centres[level] < 0]
+			orbit = level[self.centres[level] >= 0]
+			self.levels.append({
+				"line": as_index(line) if len(line) else None,
+				"orbit": as_index(orbit) if len(orbit) else None,
+				"count": len(orbit),
+				"a": self.a[orbit],
+				"e": self.e[orbit],
+				"n": self.n[orbit],
+				"root": np.sqrt(1 - self.e[orbit]**2),
+				"mean_anomaly": self.mean_anomaly[orbit],
+				"cos_w": np.cos(self.periapsis[orbit]),
+				"sin_w": np.sin(self.periapsis[orbit]),
+				"direction": self.direction[orbit],
+				"circular": not self.e[orbit].any(),
+				"phase": self.periapsis[orbit] + self.direction[orbit] * self.mean_anomaly[orbit], # Angle from the centre at the epoch, for circles
+				"turn": self.direction[orbit] * self.n[orbit],                                     # How fast that goes round
+				"speed": self.a[orbit] * self.n[orbit] * self.direction[orbit],
+				"slots": as_index(slots[orbit]) if (slots[orbit] >= 0).all() else slots[orbit],
+				"railed_centre": slots[orbit] >= 0,
+				"centres": self.centres[orbit],
+			})
+		self.cached = None # (t, free centre positions, pos, vel) of the last evaluation
+
+	def __len__(self):
+		return len(self.rows)
+
+	@classmethod
+	def from_state(cls, state, rows, centres, epoch=0):
+		"""
+		Puts `rows` of a SystemState on rails along the orbits they're on now around `centres` (rows, -1 for none), treating each centre
+		as far heavier than what goes around it
+		"""
+		rows = np.asarray(rows, dtype=int)
+		centres = np.asarray(centres, dtype=int)
+		orbiting = centres >= 0
+		n = len(rows)
+		a, e, periapsis, mean_anomaly, direction = np.ones(n), np.zeros(n), np.zeros(n), np.zeros(n), np.ones(n)
+		mu = np.ones(n)
+		if orbiting.any():
+			c = centres[orbiting]
+			mu[orbiting] = G * state.mass[c]
+			a[orbiting], e[orbiting], periapsis[orbiting], mean_anomaly[orbiting], direction[orbiting] = elements_from_state(state.pos[rows[orbiting]] - state.pos[c], state.vel[rows[orbiting]] - state.vel[c], mu[orbiting])
+		return cls(rows, centres, a, e, periapsis, mean_anomaly, direction, mu, epoch, state.pos[rows].copy(), state.vel[rows].copy())
+
+	def state_at(self, t, pos=None, vel=None):
+		"""
+		Positions and velocities (a row each, in the order of self.rows) at simulated time `t`
+		Centres that aren't on rails are taken from `pos` and `vel` (e.g. the rows of the SystemState), so they're only needed then
+		"""
+		free = None
+		if len(self.free_centres):
+			free = np.concatenate((pos[self.free_centres], vel[self.free_centres]), axis=1)
+		cached = self.cached
+		if cached is not None and cached[0] == t and (free is None or np.array_equal(cached[1], free)):
+			return cached[2], cached[3]
+
+		out_pos = np.empty((len(self), 2))
+		out_vel = np.empty((len(self), 2))
+		for level in self.levels:
+			line = level["line"]
+			if line is not None:
+				out_pos[line] = self.line_pos[line] + self.line_vel[line] * (t - self.epoch)
+				out_vel[line] = self.line_vel[line]
+			orbit = level["orbit"]
+			if orbit is None:
+				continue
+			if level["circular"]: # Just going round at a steady rate, so no need for Kepler's equation
+				angle = level["phase"] + level["turn"] * (t - self.epoch)
+				cos_a = np.cos(angle)
+				sin_a = np.sin(angle)
+				rel_pos = np.empty((level["count"], 2))
+				rel_vel = np.empty((level["count"], 2))
+				np.multiply(level["a"], cos_a, out=rel_pos[:, 0])
+				np.multiply(level["a"], sin_a, out=rel_pos[:, 1])
+				np.multiply(level["speed"], sin_a, out=rel_vel[:, 0])
+				np.negative(rel_vel[:, 0], out=rel_vel[:, 0])
+				np.multiply(level["speed"], cos_a, out=rel_vel[:, 1])
+			else:
+				M = level["mean_anomaly"] + level["n"] * (t - self.epoch)
+				E = solve_kepler(M, level["e"])
+				a, e = level["a"], level["e"]
+				cos_E = np.cos(E)
+				sin_E = np.sin(E)
+				rate = level["n"] * a / (1 - e * cos_E) # a * dE/dt
+				# Perifocal (x towards periapsis, y along the direction of motion), then turned round to the periapsis
+				px, py = a * (cos_E - e), a * level["root"] * sin_E * level["direction"]
+				vx, vy = -rate * sin_E, rate * level["root"] * cos_E * level["direction"]
+				cos_w, sin_w = level["cos_w"], level["sin_w"]
+				rel_pos = np.stack((px * cos_w - py * sin_w, px * sin_w + py * cos_w), axis=-1)
+				rel_vel = np.stack((vx * cos_w - vy * sin_w, vx * sin_w + vy * cos_w), axis=-1)
+			railed = level["railed_centre"]
+			if railed.all():
+				slots = level["slots"]
+				out_pos[orbit] = out_pos[slots] + rel_pos
+				out_vel[orbit] = out_vel[slots] + rel_vel
+			else:
+				c_pos = np.empty((level["count"], 2))
+				c_vel = np.empty((level["count"], 2))
+				c_pos[railed] = out_pos[level["slots"][railed]]
+				c_vel[railed] = out_vel[level["slots"][railed]]
+				c_pos[~railed] = pos[level["centres"][~railed]]
+				c_vel[~railed] = vel[level["centres"][~railed]]
+				out_pos[orbit] = c_pos + rel_pos
+				out_vel[orbit] = c_vel + rel_vel
+		self.cached = (t, free, out_pos, out_vel)
+		return out_pos, out_vel
+
+	def apply(self, state, t, pos=None):
+		"""
+		Moves the rows of `state` (or just the positions `pos`, e.g. partway through a step) to where they are at time `t`
+		"""
+		if pos is None:
+			pos_at, vel_at = self.state_at(t, state.pos, state.vel)
+			state.pos[self.rows] = pos_at
+			state.vel[self.rows] = vel_at
+		else:
+			pos[self.rows] = self.state_at(t, pos, state.vel)[0]
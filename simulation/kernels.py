@@ -0,0 +1,158 @@
+# Compiled kernels
+# Optional Numba versions of the loops the physics spends its time in: the direct sum of gravity between every target and source, and the
+# updates of the positions and velocities the integrators make each step. They work straight on the flat SystemState arrays, one body
+# per loop iteration (spread across threads for big systems), without the temporary (targets x sources) arrays NumPy needs.
+# Compiled code is cached on disk (in KERNEL_CACHE_DIR), so later processes, like sweep workers, load it rather than compiling it again.
+# Numba is optional: without it (or with the backend set to "numpy") everything runs in NumPy exactly as before
+
+import os
+import numpy as np
+from consts import *
+
+os.environ.setdefault("NUMBA_CACHE_DIR", KERNEL_CACHE_DIR) # Has to be set before Numba is imported
+try:
+	import numba
+except ImportError:
+	numba = None
+
+BACKENDS = [ "auto", "numba", "numpy" ]
+backend = None # "numba" or "numpy", whichever is in use (see use_backend())
+
+
+def use_backend(name=KERNEL_BACKEND):
+	"""
+	Picks whether the kernels here ("numba") or plain NumPy ("numpy") do the work. "auto" uses Numba if it's installed
+	"""
+	global backend
+	if name not in BACKENDS:
+		raise ValueError(f"Unknown backend {name!r}, expected one of {', '.join(BACKENDS)}")
+	if name == "numba" and numba is None:
+		raise ValueError("The numba backend needs Numba installing (pip install numba)")
+	backend = ("numba" if numba is not None else "numpy") if name == "auto" else name
+	return backend
+
+def enabled():
+	return backend == "numba"
+
+
+def jit(fn, parallel=False):
+	"""
+	fn compiled by Numba (cached on disk), or just fn if Numba isn't installed
+	"""
+	if numba is None:
+		return fn
+	return numba.njit(parallel=parallel, cache=True)(fn)
+
+prange = range if numba is None else numba.prange # Iterations of a parallel kernel's loop are split across threads
+
+
+def direct_accels_loop(target_pos, source_pos, source_mass, target_ids, source_ids, use_ids, accels, collided):
+	# Same maths as engine.gravity_accels(), one target at a time
+	threshold_sq = DIST_THRESHOLD**2
+	for i in prange(len(target_pos)):
+		ax = 0.0
+		ay = 0.0
+		hit = False
+		for j in range(len(source_pos)):
+			if use_ids and target_ids[i] == source_ids[j]:
+				continue
+			dx = source_pos[j, 0] - target_pos[i, 0]
+			dy = source_pos[j, 1] - target_pos[i, 1]
+			dist_sq = dx * dx + dy * dy
+			if dist_sq == 0:
+				hit = True
+			if dist_sq < threshold_sq:
+				continue
+			f = 1 / (dist_sq * np.sqrt(dist_sq)) * source_mass[j]
+			ax += f * dx
+			ay += f * dy
+		accels[i, 0] = G * ax
+		accels[i, 1] = G * ay
+		collided[i] = hit
+
+def update_pos_loop(pos, vel, accels, free, time):
+	# s = ut + 0.5at^2, v = u + at for the free rows (same maths as SystemState.update_pos())
+	for i in prange(len(pos)):
+		if free[i]:
+			for k in range(2):
+				pos[i, k] += vel[i, k] * time + accels[i, k] * time**2 / 2
+				vel[i, k] += accels[i, k] * time
+
+def kick_drift_loop(pos, vel, accels, dt, half_vel, new_pos):
+	# First half of a leapfrog step: half a kick, then a whole drift (same maths as Leapfrog.step())
+	for i in prange(len(pos)):
+		for k in range(2):
+			half_vel[i, k] = vel[i, k] + accels[i, k] * dt / 2
+			new_pos[i, k] = pos[i, k] + half_vel[i, k] * dt
+
+def kick_loop(half_vel, accels, dt, new_vel):
+	# The other half kick, at the end of the step
+	for i in prange(len(half_vel)):
+		for k in range(2):
+			new_vel[i, k] = half_vel[i, k] + accels[i, k] * dt / 2
+
+# Threads only pay for themselves with plenty of bodies, so each kernel comes as a serial version and a parallel one
+direct_accels_serial, direct_accels_parallel = jit(direct_accels_loop), jit(direct_accels_loop, True)
+update_pos_serial, update_pos_parallel = jit(update_pos_loop), jit(update_pos_loop, True)
+kick_drift_serial, kick_drift_parallel = jit(kick_drift_loop), jit(kick_drift_loop, True)
+kick_serial, kick_parallel = jit(kick_loop), jit(kick_loop, True)
+
+
+def pick(serial, parallel, work):
+	return parallel if work >= KERNEL_PARALLEL_MIN else serial
+
+def gravity_accels(target_pos, source_pos, source_mass, target_ids=None, source_ids=None):
+	"""
+	engine.gravity_accels() as a compiled loop over the targets
+	"""
+	n = len(target_pos)
+	accels = np.zeros((n, 2))
+	collided = np.zeros(n, dtype=bool)
+	use_ids = target_ids is not None
+	ids = np.zeros(0, dtype=np.int64)
+	target_ids = ids if target_ids is None else np.ascontiguousarray(target_ids, dtype=np.int64)
+	source_ids = ids if source_ids is None else np.ascontiguousarray(source_ids, dtype=np.int64)
+	kernel = pick(direct_accels_serial, direct_accels_parallel, n * len(source_pos))
+	kernel(np.ascontiguousarray(target_pos, dtype=float), np.ascontiguousarray(source_pos, dtype=float), np.ascontiguousarray(source_mass, dtype=float), target_ids, source_ids, use_ids, accels, collided)
+	return accels, collided
+
+def update_pos(pos, vel, accels, free, time):
+	"""
+	Moves the `free` rows of pos and vel (in place) on by `time` with constant accelerations
+	"""
+	pick(update_pos_serial, update_pos_parallel, len(pos))(pos, vel, np.ascontiguousarray(accels, dtype=float), free, float(time))
+
+def kick_drift(pos, vel, accels, dt):
+	"""
+	Velocities half a leapfrog step on (with accels) and positions a whole step on, as new arrays
+	"""
+	half_vel = np.empty_like(vel)
+	new_pos = np.empty_like(pos)
+	pick(kick_drift_serial, kick_drift_parallel, len(pos))(pos, vel, accels, float(dt), half_vel, new_pos)
+	return half_vel, new_pos
+
+def kick(half_vel, accels, dt):
+	"""
+	Velocities at the end of a leapfrog step, as a new array
+	"""
+	new_vel = np.empty_like(half_vel)
+	pick(kick_serial, kick_parallel, len(half_vel))(half_vel, accels, float(dt), new_vel)
+	return new_vel
+
+
+def warm_up():
+	"""
+	Makes sure every kernel is compiled (or loaded from the cache), e.g. before forking workers so none of them have to
+	"""
+	if not enabled():
+		return
+	pos = np.zeros((1, 2))
+	ids = np.zeros(1, dtype=np.int64)
+	for parallel in ( False, True ):
+		(direct_accels_parallel if parallel else direct_accels_serial)(pos, pos, np.ones(1), ids, ids, True, pos.copy(), np.zeros(1, dtype=bool))
+		(update_pos_parallel if parallel else update_pos_serial)(pos.copy(), pos.copy(), pos, np.ones(1, dtype=bool), 1.0)
+		(kick_drift_parallel if parallel else kick_drift_serial)(pos, pos, pos, 1.0, pos.copy(), pos.copy())
+		(kick_parallel if parallel else kick_serial)(pos, pos, 1.0, pos.copy())
+
+
+use_backend()
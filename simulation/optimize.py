@@ -0,0 +1,329 @@
+# Launch optimizer
+# Rather than hand-tuning the launch speed and when it goes, this searches launch epoch, direction and delta-v for the launch that gains the
+# most speed from the slingshot (or comes closest to passing a target body at a chosen distance) with CMA-ES, which only needs to know how
+# good whole flights were, not any derivatives. Each generation of candidate launches is flown as one batch: the rockets are rows of the
+# same arrays, integrated together against planets looked up in a shared ephemeris (see ephemeris.py), and each one drops out of the batch
+# as soon as how it went is settled (it hit something, escaped, or is past the target and not coming back)
+# python optimize.py --objective speed_gain --epochs 0 30 --seed 1
+
+import argparse
+import numpy as np
+from math import *
+from consts import *
+import simulation as sim
+from engine import gravity_accels
+from integrators import make_integrator
+from ephemeris import load_ephemeris
+from events import find_root
+
+
+OBJECTIVES = [ "speed_gain", "closest_approach" ]
+FLIGHT_COLUMNS = [ "epoch_days", "direction", "delta_v", "speed_scale", "closest_approach", "closest_approach_time", "closest_approach_speed", "speed_gain", "escaped", "impacted", "crashed", "duration" ]
+
+
+class BatchRollouts(object):
+	"""
+	Flies batches of launches from the Earth of `simulation` (which should be at the start, as it's where the ephemeris starts from) at once
+	Launches are the same as sweep.py's: the rocket is parked and launched with Simulation.launch_rocket() at each epoch, then followed for
+	up to `duration` seconds with `integrator` steps of `dt`, watching for its closest approach to `target` (the moon if not given)
+	With stop_past_target, flights also stop once they're heading away from the target, more than pass_dist from it and too fast for it to
+	pull them back. Their closest approach can't change after that, though their speed still can
+	"""
+	def __init__(self, simulation=None, max_epoch_days=OPTIMIZE_EPOCHS[1], target=None, duration=SWEEP_DURATION, dt=OPTIMIZE_DT, escape_dist=SWEEP_ESCAPE_DIST, pass_dist=OPTIMIZE_PASS_DIST, stop_past_target=False, integrator=OPTIMIZE_INTEGRATOR, boost=ROCKET_GRAVITY_BOOST, ephemeris=None):
+		self.simulation = sim.Simulation() if simulation is None else simulation
+		simulation = self.simulation
+		if simulation.rocket is None or simulation.earth is None or simulation.moon is None:
+			raise ValueError(f"Launches need an Earth, a moon and a rocket, which {simulation.scenario.name} doesn't have")
+		self.target = simulation.moon if target is None else simulation.body(target) if isinstance(target, str) else target
+		if self.target is None:
+			raise KeyError(f"No body called {target} in {simulation.scenario.name}")
+		self.duration = duration
+		self.dt = dt
+		self.escape_dist = escape_dist
+		self.pass_dist = pass_dist
+		self.stop_past_target = stop_past_target
+		self.integrator = integrator
+		self.boost = boost
+		self.ephemeris = load_ephemeris(simulation, ceil(max_epoch_days + duration / SECS_IN_A_DAY) + 1) if ephemeris is None else ephemeris
+		self.evaluations = 0 # Flights flown so far
+
+		# The target's pull on the rocket, for telling whether it's coming back. Only the moon is boosted
+		self.target_mu = G * self.target.mass
+		if simulation.conics is None and self.target is simulation.moon:
+			self.target_mu *= boost
+
+	def launch(self, epoch_days, directions, delta_vs):
+		"""
+		Launch times (simulated seconds), rocket positions and velocities, speed scales and speeds relative to the Earth of launches at
+		`epoch_days` (days from the start), `directions` (degrees away from the moon) and `delta_vs` (meters/sec), all arrays of the same length
+		"""
+		simulation = self.simulation
+		rocket, earth, moon = simulation.rocket, simulation.earth, simulation.moon
+		saved = simulation.save_state()
+		n = len(epoch_days)
+		times = np.asarray(epoch_days, dtype=float) * SECS_IN_A_DAY
+		pos = np.zeros((n, 2))
+		vel = np.zeros((n, 2))
+		speed_scales = np.zeros(n)
+		for i in range(n):
+			self.ephemeris.jump_to(simulation, times[i])
+			speed_scales[i] = delta_vs[i] / np.hypot(*(moon.pos - earth.pos)) # Launches go at this times the Earth-moon distance
+			rocket.gravity_boost = self.boost
+			simulation.launch_rocket(speed_scales[i], directions[i])
+			pos[i] = rocket.pos
+			vel[i] = rocket.vel
+		simulation.restore_state(saved)
+		earth_vel = self.ephemeris.state_at(times, earth.index)[1]
+		return times, pos, vel, speed_scales, np.hypot(*(vel - earth_vel).T)
+
+	def accels(self, rocket_pos, t):
+		"""
+		Accelerations of rockets at rocket_pos (n, 2) at simulated times `t` (one each), under the simulation's rocket_gravity model
+		"""
+		simulation = self.simulation
+		if simulation.conics is None:
+			# Only the (boosted) moon pulls, so this is rocket_accel() with every rocket's moon moved to the origin
+			moon_pos = self.ephemeris.state_at(t, simulation.moon.index)[0]
+			accels, collided = gravity_accels(rocket_pos - moon_pos, np.zeros((1, 2)), np.array([ simulation.moon.mass ]))
+			return accels * self.boost, collided
+		return simulation.conics.batch_accels(rocket_pos, self.ephemeris.state_at(t)[0]) # Every rocket is at a different time, so has its own bodies
+
+	def relative(self, rocket_pos, rocket_vel, t, body):
+		"""
+		Positions and velocities (n, 2) of rockets relative to `body` at simulated times `t`
+		"""
+		pos, vel = self.ephemeris.state_at(t, body.index)
+		return rocket_pos - pos, rocket_vel - vel
+
+	def fly(self, epoch_days, directions, delta_vs):
+		"""
+		Flies a launch for each epoch, direction and delta-v (arrays of the same length) all at once
+		Returns a dict of arrays with FLIGHT_COLUMNS: the closest approach to the target (meters), how long after launch it was and the speed
+		relative to the target then, speed gained relative to the Earth by the end of the flight, whether it escaped, hit the target or crashed
+		back into the Earth, and how long it was followed for
+		"""
+		target, earth = self.target, self.simulation.earth
+		n = len(epoch_days)
+		launch_times, pos, vel, speed_scales, launch_speeds = self.launch(epoch_days, directions, delta_vs)
+		rel_pos, rel_vel = self.relative(pos, vel, launch_times, target)
+		closest = np.hypot(*rel_pos.T) # The start counts too, in case it never gets any closer
+		closest_time = np.zeros(n)
+		closest_speed = np.hypot(*rel_vel.T)
+		speed_gain = np.zeros(n)
+		escaped = np.zeros(n, dtype=bool)
+		impacted = np.zeros(n, dtype=bool)
+		crashed = np.zeros(n, dtype=bool)
+		flown = np.full(n, float(self.duration))
+		self.evaluations += n
+
+		live = np.arange(n) # Rows still flying
+		integrator = make_integrator(self.integrator)
+		elapsed = 0.0
+		while len(live):
+			dt = min(self.dt, self.duration - elapsed)
+			t0 = launch_times[live] + elapsed
+			new_pos, new_vel, _ = integrator.step(pos, vel, dt, lambda p, t, rows=None: self.accels(p, t0 + t))
+
+			# Closest approaches within the step: the distance stopping going down, found on the dense output between wherever the integrator
+			# stopped along the way (as in events.py)
+			dense = integrator.dense_output(pos, vel, new_pos, new_vel, dt)
+			def approach(s):
+				p, v = (pos, vel) if s == 0 else (new_pos, new_vel) if s == dt else dense(s)
+				rel_p, rel_v = self.relative(p, v, t0 + s, target)
+				return np.einsum("ij,ij->i", rel_p, rel_v), rel_p, rel_v
+			samples = [ 0 ] + integrator.inner_times(dt) + [ dt ]
+			g = [ approach(s)[0] for s in samples ]
+			for (s0, g0), (s1, g1) in zip(zip(samples, g), zip(samples[1:], g[1:])):
+				for k in np.flatnonzero((g0 < 0) & (g1 >= 0)):
+					s = find_root(lambda s: approach(s)[0][k], s0, s1, g0[k], g1[k])
+					_, rel_p, rel_v = approach(s)
+					row = live[k]
+					d = hypot(*rel_p[k])
+					if d < closest[row]:
+						closest[row], closest_time[row], closest_speed[row] = d, elapsed + s, hypot(*rel_v[k])
+			pos, vel = new_pos, new_vel
+			elapsed += dt
+
+			# Drop the ones that are done
+			rel_p, rel_v = self.relative(pos, vel, t0 + dt, target)
+			d = np.hypot(*rel_p.T)
+			nearer = d < closest[live] # The end counts too, in case it's still getting closer
+			closest[live[nearer]] = d[nearer]
+			closest_time[live[nearer]] = elapsed
+			closest_speed[live[nearer]] = np.hypot(*rel_v[nearer].T)
+			earth_p, earth_v = self.relative(pos, vel, t0 + dt, earth)
+			earth_d = np.hypot(*earth_p.T)
+			hit = closest[live] < target.radius
+			crash = earth_d < earth.radius
+			away = earth_d > self.escape_dist
+			done = hit | crash | away | (elapsed >= self.duration)
+			if self.stop_past_target:
+				receding = np.einsum("ij,ij->i", rel_p, rel_v) > 0
+				done |= receding & (np.einsum("ij,ij->i", rel_v, rel_v) / 2 > self.target_mu / d) & (d > self.pass_dist)
+			rows = live[done]
+			speed_gain[rows] = np.hypot(*earth_v[done].T) - launch_speeds[rows]
+			escaped[rows] = away[done]
+			impacted[rows] = hit[done]
+			crashed[rows] = crash[done]
+			flown[rows] = elapsed
+			live = live[~done]
+			pos, vel = pos[~done], vel[~done]
+
+		return {
+			"epoch_days": np.asarray(epoch_days, dtype=float),
+			"direction": np.asarray(directions, dtype=float),
+			"delta_v": np.asarray(delta_vs, dtype=float),
+			"speed_scale": speed_scales,
+			"closest_approach": closest,
+			"closest_approach_time": closest_time,
+			"closest_approach_speed": closest_speed,
+			"speed_gain": speed_gain,
+			"escaped": escaped,
+			"impacted": impacted,
+			"crashed": crashed,
+			"duration": flown,
+		}
+
+
+def flight_costs(flights, objective="speed_gain", target_distance=0):
+	"""
+	How bad each of a batch of flights (from BatchRollouts.fly()) is, lower being better: the speed it didn't gain, or how far its closest
+	approach was from target_distance. Crashing back into the Earth is as bad as it gets, and so is hitting the target when after speed
+	"""
+	if objective == "speed_gain":
+		costs = -flights["speed_gain"]
+		costs[flights["impacted"]] = inf
+	elif objective == "closest_approach":
+		costs = np.abs(flights["closest_approach"] - target_distance)
+	else:
+		raise ValueError(f"Unknown objective {objective!r}, expected one of {', '.join(OBJECTIVES)}")
+	costs[flights["crashed"]] = inf
+	return costs
+
+
+def cma_es(costs_fn, mean, sigma=OPTIMIZE_SIGMA, population=OPTIMIZE_POPULATION, generations=OPTIMIZE_GENERATIONS, tol=OPTIMIZE_TOL, rng=None):
+	"""
+	Minimises costs_fn with the covariance matrix adaptation evolution strategy, starting from around `mean` with spread `sigma`
+	costs_fn takes a whole generation of points (population, dimensions) at once and returns their costs
+	Returns the best point found, its cost and how many generations it took
+	"""
+	rng = np.random.default_rng(rng)
+	mean = np.array(mean, dtype=float)
+	n = len(mean)
+	mu = population // 2 # How many of the best are kept each generation, weighted towards the very best
+	weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+	weights /= weights.sum()
+	mu_eff = 1 / np.sum(weights**2)
+
+	# Learning rates (the usual defaults)
+	c_c = (4 + mu_eff / n) / (n + 4 + 2 * mu_eff / n)
+	c_s = (mu_eff + 2) / (n + mu_eff + 5)
+	c_1 = 2 / ((n + 1.3)**2 + mu_eff)
+	c_mu = min(1 - c_1, 2 * (mu_eff - 2 + 1 / mu_eff) / ((n + 2)**2 + mu_eff))
+	damping = 1 + 2 * max(0, sqrt((mu_eff - 1) / (n + 1)) - 1) + c_s
+	chi_n = sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n**2)) # Expected length of a standard normal vector
+
+	cov = np.eye(n)
+	path_c = np.zeros(n)
+	path_s = np.zeros(n)
+	best, best_cost = mean.copy(), inf
+	for generation in range(1, generations + 1):
+		eigvals, basis = np.linalg.eigh(cov)
+		scales = np.sqrt(np.maximum(eigvals, 1e-20))
+		steps = (rng.standard_normal((population, n)) * scales) @ basis.T
+		points = mean + sigma * steps
+		costs = np.asarray(costs_fn(points), dtype=float)
+		order = np.argsort(costs, kind="stable")
+		if costs[order[0]] < best_cost:
+			best, best_cost = points[order[0]].copy(), costs[order[0]]
+
+		chosen = steps[order[:mu]]
+		step = weights @ chosen
+		mean = mean + sigma * step
+		path_s = (1 - c_s) * path_s + sqrt(c_s * (2 - c_s) * mu_eff) * (basis @ ((basis.T @ step) / scales))
+		stalled = np.linalg.norm(path_s) / sqrt(1 - (1 - c_s)**(2 * generation)) / chi_n >= 1.4 + 2 / (n + 1)
+		path_c = (1 - c_c) * path_c + (0 if stalled else sqrt(c_c * (2 - c_c) * mu_eff)) * step
+		cov = (1 - c_1 - c_mu) * cov + c_1 * (np.outer(path_c, path_c) + stalled * c_c * (2 - c_c) * cov) + c_mu * (chosen.T * weights) @ chosen
+		sigma *= exp(c_s / damping * (np.linalg.norm(path_s) / chi_n - 1))
+		if sigma * np.sqrt(np.max(eigvals)) < tol:
+			break
+	return best, best_cost, generation
+
+
+class LaunchPlan(object):
+	"""
+	The best launch an optimize_launch() found: when (days from the start), which way (degrees away from the moon) and how fast (delta_v in
+	meters/sec, or speed_scale times the Earth-moon distance per second, as Simulation.launch_rocket() takes it), and how its flight went
+	"""
+	def __init__(self, flight, cost, evaluations, generations):
+		self.epoch_days = flight["epoch_days"]
+		self.direction = flight["direction"]
+		self.delta_v = flight["delta_v"]
+		self.speed_scale = flight["speed_scale"]
+		self.flight = flight           # Its row of BatchRollouts.fly()
+		self.cost = cost
+		self.evaluations = evaluations # Flights flown to find it
+		self.generations = generations
+
+	def __repr__(self):
+		return f"LaunchPlan(epoch_days={self.epoch_days!r}, direction={self.direction!r}, delta_v={self.delta_v!r}, cost={self.cost!r})"
+
+
+def optimize_launch(simulation=None, objective="speed_gain", target=None, target_distance=None, epochs=OPTIMIZE_EPOCHS, directions=OPTIMIZE_DIRECTIONS, delta_vs=OPTIMIZE_DELTA_V, population=OPTIMIZE_POPULATION, generations=OPTIMIZE_GENERATIONS, sigma=OPTIMIZE_SIGMA, tol=OPTIMIZE_TOL, seed=None, **rollout_args):
+	"""
+	Searches launch epochs, directions and delta-vs within the (low, high) ranges given for the best launch by `objective` (one of
+	OBJECTIVES), flying each generation as one batch. For "closest_approach", target_distance is how far from the target's centre to pass
+	(OPTIMIZE_TARGET_ALTITUDE above its surface if not given)
+	Anything else is passed on to BatchRollouts (e.g. the integrator). Returns a LaunchPlan
+	"""
+	if objective not in OBJECTIVES:
+		raise ValueError(f"Unknown objective {objective!r}, expected one of {', '.join(OBJECTIVES)}")
+	rollout_args.setdefault("stop_past_target", objective == "closest_approach") # Speed is still being gained (or lost) after the target
+	rollouts = BatchRollouts(simulation, epochs[1], target, **rollout_args)
+	if target_distance is None:
+		target_distance = rollouts.target.radius + OPTIMIZE_TARGET_ALTITUDE
+	low = np.array([ epochs[0], directions[0], delta_vs[0] ], dtype=float)
+	high = np.array([ epochs[1], directions[1], delta_vs[1] ], dtype=float)
+
+	def launches(points):
+		# The search runs in the unit cube, with anything outside it reflected back in so every launch flown is within the ranges
+		folded = np.remainder(points, 2)
+		return low + (high - low) * np.where(folded > 1, 2 - folded, folded)
+	def costs(points):
+		flights = rollouts.fly(*launches(points).T)
+		return flight_costs(flights, objective, target_distance)
+
+	best, cost, generations = cma_es(costs, np.full(3, 0.5), sigma, population, generations, tol, seed)
+	flight = { col: values[0] for col, values in rollouts.fly(*launches(best[np.newaxis]).T).items() }
+	return LaunchPlan(flight, cost, rollouts.evaluations, generations)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Search for the best slingshot launch")
+	parser.add_argument("--objective", choices=OBJECTIVES, default="speed_gain", help="Gain as much speed as possible, or pass the target at --target-distance")
+	parser.add_argument("--target", default=None, help="Body to fly past (defaults to the moon)")
+	parser.add_argument("--target-distance", type=float, default=None, help="Distance from the target's centre to pass at (meters)")
+	parser.add_argument("--epochs", type=float, nargs=2, default=list(OPTIMIZE_EPOCHS), help="Range of launch epochs (days from the start)")
+	parser.add_argument("--directions", type=float, nargs=2, default=list(OPTIMIZE_DIRECTIONS), help="Range of launch directions (degrees away from the moon)")
+	parser.add_argument("--delta-v", type=float, nargs=2, default=list(OPTIMIZE_DELTA_V), help="Range of launch speeds (meters/sec)")
+	parser.add_argument("--population", type=int, default=OPTIMIZE_POPULATION, help="Launches flown together in each generation")
+	parser.add_argument("--generations", type=int, default=OPTIMIZE_GENERATIONS, help="Most generations to run")
+	parser.add_argument("--seed", type=int, default=None, help="Random seed, for repeatable searches")
+	parser.add_argument("--boost", type=float, default=ROCKET_GRAVITY_BOOST, help="Gravity boost factor")
+	parser.add_argument("--duration", type=float, default=SWEEP_DURATION, help="Most seconds to follow each flight for")
+	parser.add_argument("--dt", type=float, default=OPTIMIZE_DT, help="Timestep of the flights (seconds)")
+	parser.add_argument("--integrator", default=OPTIMIZE_INTEGRATOR, help="Integrator for the flights (see integrators.py)")
+	parser.add_argument("--rocket-gravity", choices=[ "moon", "soi" ], default=ROCKET_GRAVITY, help="Rocket feels just the boosted moon, or the body whose sphere of influence it's in (see conics.py)")
+	parser.add_argument("--perturbers", nargs="*", default=list(ROCKET_PERTURBERS), help="Bodies (or all) adding their perturbations to the sphere of influence model")
+	args = parser.parse_args(argv)
+	perturbers = "all" if args.perturbers == [ "all" ] else args.perturbers
+
+	simulation = sim.Simulation(rocket_gravity=args.rocket_gravity, perturbers=perturbers)
+	plan = optimize_launch(simulation, args.objective, args.target, args.target_distance, args.epochs, args.directions, args.delta_v, args.population, args.generations, seed=args.seed, duration=args.duration, dt=args.dt, integrator=args.integrator, boost=args.boost)
+	print(f"Best launch after {plan.evaluations} flights ({plan.generations} generations):")
+	for col in FLIGHT_COLUMNS:
+		print(f"  {col}: {plan.flight[col]}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,82 @@
+# Massless test particles (dust, asteroid belts, clouds of possible rocket starts, ...)
+# Stored as struct-of-arrays rather than one SpaceObject each, so 100k of them is a few MB and they all move in a handful of NumPy operations.
+# They feel the gravity of the SpaceObjects but don't pull on anything
+
+import numpy as np
+from math import *
+from consts import *
+from utils import *
+
+
+class ParticleSwarm(object):
+	def __init__(self, pos, vel, colour=0xaaaaaa, name="Particles"):
+		self.pos = np.array(pos, dtype=float).reshape(-1, 2) # In meters
+		self.vel = np.array(vel, dtype=float).reshape(-1, 2) # In meters/sec
+		assert self.pos.shape == self.vel.shape
+		self.colour = colour
+		self.name = name
+		self.reset()
+
+	def __len__(self):
+		return len(self.pos)
+
+	@classmethod
+	def ring(cls, n, centre, r_min, r_max, colour=0xaaaaaa, name="Belt", seed=None):
+		"""
+		`n` particles on circular orbits around SpaceObject `centre`, spread between r_min and r_max meters from it (e.g. an asteroid belt)
+		"""
+		rng = np.random.default_rng(seed)
+		r = np.sqrt(rng.uniform(r_min**2, r_max**2, n)) # Evenly spread over the area
+		angle = rng.uniform(0, 2 * pi, n)
+		v = np.sqrt(G * centre.mass / r) # From both F_g = G(m1m2/r^2) and a = v^2/r
+		pos = np.stack((centre.pos[0] + r * np.cos(angle), centre.pos[1] + r * np.sin(angle)), axis=1)
+		vel = np.stack((centre.vel[0] - v * np.sin(angle), centre.vel[1] + v * np.cos(angle)), axis=1)
+		return cls(pos, vel, colour, name)
+
+	@classmethod
+	def cloud(cls, n, pos, vel, pos_spread, vel_spread, colour=0xff8888, name="Cloud", seed=None):
+		"""
+		`n` particles normally distributed around position `pos` and velocity `vel` (e.g. a Monte Carlo cloud of rocket starts)
+		"""
+		rng = np.random.default_rng(seed)
+		return cls(np.asarray(pos) + rng.normal(0, pos_spread, (n, 2)), np.asarray(vel) + rng.normal(0, vel_spread, (n, 2)), colour, name)
+
+	def reset(self):
+		"""
+		Forgets the remembered acceleration. Not needed after changing pos directly, since that's checked for
+		"""
+		self.last = None
+
+	def accel(self, state, source_pos):
+		return state.accels_on(self.pos, source_pos)
+
+	def step(self, time, state, source_pos_before, source_pos_after):
+		"""
+		Moves the particles on by `time` seconds while the objects of `state` move from source_pos_before to source_pos_after
+		Kick-drift-kick (leapfrog), with the acceleration at the end reused at the start of the next step when nothing has changed
+		"""
+		if len(self) == 0:
+			return
+		sources = state.active & (state.mass > 0) # Only these pull on the particles, so moving anything else doesn't matter
+		if self.last is not None and np.array_equal(self.last[0], source_pos_before[sources]) and np.array_equal(self.last[1], self.pos):
+			a0, collided = self.last[2]
+		else:
+			a0, collided = self.accel(state, source_pos_before)
+		self.vel += a0 * time / 2
+		old_pos = self.pos.copy()
+		self.pos += self.vel * time
+		a1, collided1 = self.accel(state, source_pos_after)
+		self.vel += a1 * time / 2
+
+		# Particles which end up right on top of something stop there, like SpaceObjects do
+		stuck = collided | collided1
+		self.pos[stuck] = old_pos[stuck]
+		self.vel[stuck] = 0
+		self.last = (source_pos_after[sources], self.pos.copy(), (a1, collided1))
+
+	# Pygame related functions
+	def draw(self, renderer):
+		"""
+		Draws every particle on screen as a single pixel, in one go rather than a pg.draw call each (see render.Renderer)
+		"""
+		renderer.draw_pixels(self.pos, self.colour)
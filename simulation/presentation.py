@@ -0,0 +1,365 @@
+# PyGame presentation of the simulation. The physics itself lives in simulation.py
+
+import pygame as pg
+import numpy as np
+from math import *
+from consts import *
+from utils import *
+import simulation as sim
+from simulation import Camera
+from render import Renderer
+from trail import Trail
+from trajectory import TrajectoryReader
+from worker import PhysicsWorker
+from profiling import profiler
+from hud import text_cache
+
+
+
+# The orbit rings
+class Orbit(object):
+	def __init__(self, name="UFO orbit", au_mag=0, colour=0xffff00, centre=None, cam=None):
+		assert centre is not None
+		assert cam is not None
+		self.centre = centre
+		self.cam = cam
+		self.name = name
+		self.radius = au_mag * AU
+		self.colour = darken(colour, ORBIT_DARKEN)
+
+	@property
+	def pos_on_screen(self):
+		"""
+		Shifts position of the SpaceObject to somewhere on (or off) the screen
+		"""
+		w, h = pg.display.get_surface().get_size()
+		factor = min(w, h) * self.cam.zoom / (AU * MAX_AU)
+		x_diff = self.centre.pos[0] - self.cam.pos[0]
+		y_diff = self.centre.pos[1] - self.cam.pos[1]
+		ret = (x_diff * cos(radians(self.cam.angle)) - y_diff * sin(radians(self.cam.angle)), x_diff * sin(radians(self.cam.angle)) + y_diff * cos(radians(self.cam.angle)))
+		x_val = (factor * ret[0] + w) // 2
+		y_val = (factor * ret[1] + h) // 2
+		return (x_val, y_val)
+
+	# Pygame related functions
+	@property
+	def on_screen(self):
+		"""
+		return self.name == "Moon orbit" or self.name == "Earth orbit"
+		"""
+		w, h = pg.display.get_surface().get_size()
+		x, y = self.pos_on_screen
+		size = self.size_on_screen
+		return orbit_on_screen(x, y, w, h, size)
+
+			
+	@property
+	def size_on_screen(self):
+		w, h = pg.display.get_surface().get_size()
+		factor = min(w, h) * self.cam.zoom / (AU * MAX_AU)
+		return ceil(self.radius * factor / 2)
+
+	def draw(self):
+		"""
+		Draws the orbit line to the PyGame screen
+		"""
+		if self.on_screen:
+			pg.draw.circle(pg.display.get_surface(), self.colour, self.pos_on_screen, self.size_on_screen, width=ORBIT_WIDTH)
+
+
+# Text object for drawing text
+class Text(object):
+	def __init__(self, text="Text", window=None, font=None, pos=[ 20, 20 ], colour=0xffffff):
+		assert window is not None
+		assert font is not None
+		self.window = window
+		self.font = font
+		self.text = text
+		self.pos = pos
+		self.colour = hex_to_rgb(colour)
+	def draw(self):
+		img = text_cache.render(self.font, self.text, self.colour)
+		# Negative positions are from the right/bottom edge, worked out each time so they follow the window being resized
+		x, y = self.pos
+		w, h = pg.display.get_surface().get_size()
+		if x < 0:
+			x += w
+		if y < 0:
+			y += h
+		self.window.blit(img, (x, y))
+
+
+# Init functions
+def init_objects(cam, win, font, scenario=None, on_rails=None, rocket_gravity=ROCKET_GRAVITY, perturbers=ROCKET_PERTURBERS):
+	global draw_objects
+	sim.init_space_objects(cam, scenario, on_rails, rocket_gravity, perturbers)
+	if sim.earth is None or sim.rocket is None:
+		raise ValueError(f"The presentation follows the Earth and launches the rocket, which {sim.loaded_scenario.name} doesn't have")
+	init_orbit_objects(cam)
+	init_text_objects(win, font)
+	draw_objects = [ orbit_objects, sim.space_objects, text_objects ]
+
+def init_orbit_objects(cam):
+	"""
+	Orbit rings for the bodies of the scenario which ask for one (orbit_ring = true)
+	"""
+	global orbit_objects
+	bodies = sim.loaded_scenario.bodies
+	orbit_objects = []
+	for i in np.flatnonzero((bodies["orbit_au"] > 0) & (bodies["centre"] >= 0)):
+		so = sim.space_objects[i]
+		orbit_objects.append(Orbit(f"{so.name} orbit", float(bodies["orbit_au"][i]), so.colour, sim.space_objects[bodies["centre"][i]], cam))
+
+def init_text_objects(win, font):
+	global text_objects, year_and_month_text, fps_text
+	year_and_month_text = Text("Year Month", win, font, [ -100, 20 ], 0xdddddd)
+	fps_text = Text("FPS", win, font, [-40, -20 ], 0xdddddd)
+
+	text_objects = [ year_and_month_text, fps_text ]
+
+
+def run_presentation(scenario=None, on_rails=None, rocket_gravity=ROCKET_GRAVITY, perturbers=ROCKET_PERTURBERS):
+	global DAYS_PER_SEC
+	pg.init()
+	font = pg.font.SysFont(None, 24)
+
+	camera = Camera()
+	window = pg.display.set_mode((INIT_WIN_WIDTH, INIT_WIN_HEIGHT), pg.RESIZABLE)
+	pg.display.set_caption("Slingshot Simulation")
+	clock = pg.time.Clock()
+
+	init_objects(camera, window, font, scenario, on_rails, rocket_gravity, perturbers)
+	renderer = Renderer(camera)
+	earth_row = sim.earth.index
+	rocket_row = sim.rocket.index
+
+	# The physics steps on its own fixed timestep in the background, and each frame shows it interpolated to the time it's up to
+	worker = PhysicsWorker()
+	worker.start()
+	shown_time = sim.sim_time # Simulated time being shown
+
+	### ANIMATION THINGS ###
+	zoom_speed = 1.005
+	vel_changed = False
+	### ################ ###
+
+	# Tracing path of rocket (relative to the Earth)
+	trail = Trail()
+
+	# Time spent in each phase of the frame, shown with F3
+	profiler.enabled = True
+	show_profile = False
+
+	running = True
+	while running:
+		with profiler.phase("waiting"):
+			clock.tick(FPS)
+		profiler.frame()
+		window.fill(BLACK)
+
+		delta_t_ms = clock.get_time()
+		total_ms = pg.time.get_ticks()
+		years_passed = total_ms / 1000 * DAYS_PER_SEC / 365
+
+		with profiler.phase("interpolation"):
+			shown_time += delta_t_ms / 1000 * SECS_IN_A_DAY * DAYS_PER_SEC
+			worker.run_to(shown_time + worker.dt) # Keep a step ahead so there's a state either side to interpolate between
+			_, pos, _ = worker.state_at(shown_time)
+
+		camera.goto(pos[earth_row])
+
+		year_and_month_text.text = f"{get_year(years_passed)} {get_month(years_passed)}"
+		fps_text.text = str(round(1000 / delta_t_ms))
+
+		renderer.begin(pos) # Camera transform worked out once for everything drawn this frame
+		with profiler.phase("particles drawing"):
+			renderer.draw_swarms(sim.swarms)
+		with profiler.phase("trail drawing"):
+			renderer.draw_trail(trail, pos[earth_row], hex_to_rgb(0xff0000))
+		with profiler.phase("orbit drawing"):
+			renderer.draw_orbits(orbit_objects)
+		with profiler.phase("body drawing"):
+			renderer.draw_space_objects(sim.space_objects)
+		with profiler.phase("text drawing"):
+			for text in text_objects:
+				text.draw()
+		if show_profile:
+			with profiler.phase("profile overlay"):
+				draw_profile(font)
+
+		### ANIMATION THINGS ###
+		if total_ms < 8000:
+			pass
+		elif camera.zoom < 10000: # Zoom in initially
+			zoom_speed += 0.0001
+			camera.zoom_by(zoom_speed)
+			if DAYS_PER_SEC > 0.001:
+				DAYS_PER_SEC -= 0.001 # And slow down; we slow down the simulation to make it easier to visually demonstrate how slingshotting works
+		elif DAYS_PER_SEC > 0.001:
+			DAYS_PER_SEC -= 0.01
+		elif DAYS_PER_SEC < 0.001:
+			DAYS_PER_SEC = 0.001
+		elif total_ms < LAUNCH_MS:
+			pass
+		elif vel_changed == False:
+			worker.call(worker.sim.launch_rocket, at=shown_time + worker.dt) # Where the physics has been let run up to, so not past yet
+			vel_changed = True
+		else:
+			trail.add(pos[rocket_row] - pos[earth_row])
+		### ################ ###
+
+		with profiler.phase("display update"):
+			pg.display.update()
+
+		for event in pg.event.get():
+			if event.type == pg.QUIT:
+				running = False
+			elif event.type == pg.KEYDOWN and event.key == pg.K_F3:
+				show_profile = not show_profile
+	worker.stop()
+	quit()
+
+
+def draw_profile(font):
+	"""
+	Overlay of how long each phase has taken per frame lately, slowest first, with a bar for how much of a frame's time it is
+	The physics runs on its own thread, so its phases (forces, integrate, rails, ...) are time spent alongside the others
+	"""
+	surface = pg.display.get_surface()
+	frame_secs = 1 / FPS
+	x, y = 20, 20
+	surface.blit(text_cache.render(font, "ms per frame (F3 to hide)", (221, 221, 221)), (x, y))
+	for name, secs in profiler.rolling():
+		y += 20
+		pg.draw.rect(surface, 0x444444, (x + 200, y + 4, 100, 10))
+		pg.draw.rect(surface, 0xd64f0c if secs > frame_secs / 4 else 0x46b1db, (x + 200, y + 4, min(round(100 * secs / frame_secs), 100), 10))
+		surface.blit(text_cache.render(font, name, (221, 221, 221)), (x, y))
+		surface.blit(text_cache.render(font, f"{secs * 1e3:.2f}", (221, 221, 221)), (x + 310, y))
+
+
+# Timeline along the bottom of the replay, which can be clicked or dragged on to scrub
+def timeline_rect():
+	w, h = pg.display.get_surface().get_size()
+	return pg.Rect(20, h - 50, max(w - 40, 1), 4)
+
+def draw_timeline(fraction):
+	rect = timeline_rect()
+	surface = pg.display.get_surface()
+	pg.draw.rect(surface, 0x555555, rect)
+	pg.draw.rect(surface, 0xdddddd, (rect.x, rect.y, round(rect.w * fraction), rect.h))
+	pg.draw.circle(surface, 0xdddddd, (rect.x + round(rect.w * fraction), rect.centery), 6)
+
+def on_timeline(pos):
+	return timeline_rect().inflate(0, 20).collidepoint(pos)
+
+def timeline_fraction(x):
+	rect = timeline_rect()
+	return min(max((x - rect.x) / rect.w, 0), 1)
+
+
+def run_replay(path, scenario=None):
+	"""
+	Plays back a recording (see trajectory.py) rather than working out the physics, interpolating between the samples at whatever rate
+	the screen is drawn at
+	Space pauses, left/right skip back/forward (ten times as far with shift), up/down double/halve the speed, home/end jump to the
+	start/end, the mouse wheel zooms, and the timeline along the bottom can be clicked or dragged on
+	"""
+	reader = TrajectoryReader(path)
+	if len(reader) == 0:
+		raise ValueError(f"Recording {path} is empty")
+	pg.init()
+	font = pg.font.SysFont(None, 24)
+
+	camera = Camera()
+	window = pg.display.set_mode((INIT_WIN_WIDTH, INIT_WIN_HEIGHT), pg.RESIZABLE)
+	pg.display.set_caption(f"Slingshot Simulation - {path}")
+	clock = pg.time.Clock()
+
+	init_objects(camera, window, font, scenario)
+	renderer = Renderer(camera)
+	state = sim.state
+	missing = [ so.name for so in sim.space_objects if so.name not in reader.names ]
+	if missing:
+		raise ValueError(f"Recording {path} doesn't have {', '.join(missing)}")
+	rows = [ reader.names.index(so.name) for so in sim.space_objects ] # Row of the recording for each SpaceObject
+
+	days_per_sec = DAYS_PER_SEC
+	replay_time = reader.start
+	paused = False
+	scrubbing = False
+	trail = Trail()
+
+	running = True
+	while running:
+		clock.tick(FPS)
+		window.fill(BLACK)
+		delta_t_ms = clock.get_time()
+		jumped = scrubbing
+
+		for event in pg.event.get():
+			if event.type == pg.QUIT:
+				running = False
+			elif event.type == pg.KEYDOWN:
+				skip = REPLAY_SKIP_DAYS * SECS_IN_A_DAY * (10 if event.mod & pg.KMOD_SHIFT else 1)
+				if event.key == pg.K_SPACE:
+					paused = not paused
+				elif event.key == pg.K_LEFT:
+					replay_time -= skip
+					jumped = True
+				elif event.key == pg.K_RIGHT:
+					replay_time += skip
+					jumped = True
+				elif event.key == pg.K_UP:
+					days_per_sec *= REPLAY_SPEED_STEP
+				elif event.key == pg.K_DOWN:
+					days_per_sec /= REPLAY_SPEED_STEP
+				elif event.key == pg.K_HOME:
+					replay_time = reader.start
+					jumped = True
+				elif event.key == pg.K_END:
+					replay_time = reader.end
+					jumped = True
+			elif event.type == pg.MOUSEBUTTONDOWN and event.button == 1 and on_timeline(event.pos):
+				scrubbing = True
+				jumped = True
+			elif event.type == pg.MOUSEBUTTONUP and event.button == 1:
+				scrubbing = False
+			elif event.type == pg.MOUSEWHEEL:
+				camera.zoom_by(1.1 ** event.y)
+
+		if scrubbing:
+			replay_time = reader.start + timeline_fraction(pg.mouse.get_pos()[0]) * (reader.end - reader.start)
+		elif not paused:
+			replay_time += delta_t_ms / 1000 * days_per_sec * SECS_IN_A_DAY
+		replay_time = min(max(replay_time, reader.start), reader.end)
+
+		# Just look up where everything is, no forces worked out
+		pos, vel, mass = reader.state_at(replay_time)
+		state.pos[:] = pos[rows]
+		state.vel[:] = vel[rows]
+		state.mass[:] = mass[rows]
+
+		if jumped:
+			trail.clear() # The old trail no longer leads up to the rocket
+		if sim.rocket.dist_to(sim.earth) > sim.earth.radius * 4.1: # Launched, rather than parked 4 Earth radii out (see park_rocket())
+			trail.add(sim.rocket.pos - sim.earth.pos)
+
+		camera.goto(sim.earth.pos)
+		years_passed = replay_time / SECS_IN_A_DAY / 365
+		year_and_month_text.text = f"{get_year(years_passed)} {get_month(years_passed)}"
+		fps_text.text = str(round(1000 / max(delta_t_ms, 1)))
+
+		renderer.begin()
+		renderer.draw_trail(trail, sim.earth.pos, hex_to_rgb(0xff0000))
+		renderer.draw_orbits(orbit_objects)
+		renderer.draw_space_objects(sim.space_objects)
+		for text in text_objects:
+			text.draw()
+		draw_timeline((replay_time - reader.start) / max(reader.end - reader.start, 1e-9))
+
+		pg.display.update()
+	quit()
+
+
+if __name__ == "__main__":
+	run_presentation()
@@ -0,0 +1,138 @@
+# Per-phase timing
+# Wrap each phase of the work in `with profiler.phase("name"):` and the time spent in it is added up, along with a histogram of how long
+# each run of it took. Phases can be nested: each one is only charged for its own time, not that of the phases inside it, so the phases of
+# a frame add up to the frame. Each thread keeps its own nesting, so the physics worker's phases don't get mixed up with the presentation's.
+# When the profiler is disabled phase() hands back a shared do-nothing context manager, so the hooks can stay in the code for good
+
+import bisect
+import contextlib
+import csv
+import json
+import threading
+import time as timer
+from collections import deque
+from math import *
+from consts import *
+
+
+HISTOGRAM_EDGES = [ float(f"{1e-6 * 10 ** (k / 4):.4g}") for k in range(29) ] # 1 microsecond to 10 seconds, four bins a decade
+NULL_PHASE = contextlib.nullcontext()
+
+
+class PhaseStats(object):
+	def __init__(self, name, window=PROFILE_WINDOW):
+		self.name = name
+		self.count = 0
+		self.total = 0.0
+		self.min = inf
+		self.max = 0.0
+		self.histogram = [ 0 ] * (len(HISTOGRAM_EDGES) + 1) # Counts below the first edge, between each pair, then above the last
+		self.frame_total = 0.0                              # Time spent in it so far this frame
+		self.recent = deque(maxlen=window)                  # Time spent in it in each of the last few frames
+
+	def add(self, secs):
+		self.count += 1
+		self.total += secs
+		self.min = min(self.min, secs)
+		self.max = max(self.max, secs)
+		self.histogram[bisect.bisect_right(HISTOGRAM_EDGES, secs)] += 1
+		self.frame_total += secs
+
+	def to_dict(self):
+		return {
+			"count": self.count,
+			"total": self.total,
+			"mean": self.total / self.count if self.count else 0.0,
+			"min": self.min if self.count else 0.0,
+			"max": self.max,
+			"histogram": self.histogram,
+		}
+
+
+class PhaseTimer(object):
+	"""
+	Context manager timing one phase. The start times live on the calling thread's stack, so one PhaseTimer can be used by every thread
+	"""
+	def __init__(self, profiler, stats):
+		self.profiler = profiler
+		self.stats = stats
+
+	def __enter__(self):
+		self.profiler.stack().append([ timer.perf_counter(), 0.0 ]) # Start, time spent in phases inside this one
+		return self
+
+	def __exit__(self, *exc):
+		stack = self.profiler.stack()
+		start, children = stack.pop()
+		elapsed = timer.perf_counter() - start
+		if stack:
+			stack[-1][1] += elapsed
+		self.stats.add(elapsed - children)
+
+
+class Profiler(object):
+	def __init__(self, enabled=PROFILE, window=PROFILE_WINDOW):
+		self.enabled = enabled
+		self.window = window
+		self.local = threading.local()
+		self.reset()
+
+	def reset(self):
+		self.stats = {}  # Name -> PhaseStats, in the order they were first seen
+		self.timers = {} # Name -> PhaseTimer
+		self.frames = 0
+
+	def stack(self):
+		stack = getattr(self.local, "stack", None)
+		if stack is None:
+			stack = self.local.stack = []
+		return stack
+
+	def phase(self, name):
+		if not self.enabled:
+			return NULL_PHASE
+		phase_timer = self.timers.get(name)
+		if phase_timer is None:
+			self.stats[name] = PhaseStats(name, self.window)
+			phase_timer = self.timers[name] = PhaseTimer(self, self.stats[name])
+		return phase_timer
+
+	def frame(self):
+		"""
+		Marks the end of a frame, for the rolling per-frame breakdown
+		"""
+		for stats in list(self.stats.values()):
+			stats.recent.append(stats.frame_total)
+			stats.frame_total = 0.0
+		self.frames += 1
+
+	def rolling(self):
+		"""
+		Average seconds per frame spent in each phase over the last few frames, as (name, seconds), slowest first
+		"""
+		averages = [ (stats.name, sum(stats.recent) / len(stats.recent)) for stats in list(self.stats.values()) if stats.recent ]
+		return sorted(averages, key=lambda item: -item[1])
+
+	def to_dict(self):
+		return {
+			"frames": self.frames,
+			"histogram_edges": HISTOGRAM_EDGES,
+			"phases": { name: stats.to_dict() for name, stats in list(self.stats.items()) },
+		}
+
+	def export(self, path):
+		"""
+		Saves the counters and histograms of every phase, as JSON or (if `path` ends with .csv) one CSV row per phase
+		"""
+		if path.endswith(".csv"):
+			with open(path, "w", newline="") as f:
+				writer = csv.writer(f)
+				writer.writerow([ "phase", "count", "total", "mean", "min", "max" ] + [ f"<{edge:.3g}" for edge in HISTOGRAM_EDGES ] + [ f">={HISTOGRAM_EDGES[-1]:.3g}" ])
+				for name, stats in self.to_dict()["phases"].items():
+					writer.writerow([ name, stats["count"], stats["total"], stats["mean"], stats["min"], stats["max"] ] + stats["histogram"])
+		else:
+			with open(path, "w") as f:
+				json.dump(self.to_dict(), f, indent=1)
+
+
+profiler = Profiler() # Shared by everything, turned on by whatever wants the numbers
@@ -0,0 +1,145 @@
+# Batched renderer for the presentation
+# Works out the camera transform once per frame, projects every position in one NumPy operation, culls everything off screen in bulk,
+# and only then calls pygame for what's left. Replaces calling draw() on each object, which looked up the screen size and redid the
+# trigonometry several times over for every object every frame
+
+import pygame as pg
+import numpy as np
+from math import *
+from consts import *
+from utils import *
+from engine import state_of
+
+
+class Renderer(object):
+	def __init__(self, cam, surface=None):
+		self.cam = cam
+		self.surface = surface
+		self.cache = {} # Per-list arrays that don't change between frames (radii, colours)
+		self.pos = None
+		self.trail_layers = {} # Off-screen surface for each trail, which only gets new segments drawn on while the view stays the same
+
+	def begin(self, pos=None):
+		"""
+		Works out the camera transform for this frame. Call once per frame before drawing anything
+		SpaceObjects are drawn where `pos` (rows of their SystemState, e.g. a snapshot from another thread) says if given
+		"""
+		self.pos = pos
+		surface = self.surface if self.surface is not None else pg.display.get_surface()
+		self.target = surface
+		self.w, self.h = surface.get_size()
+		self.factor = min(self.w, self.h) * self.cam.zoom / (AU * MAX_AU)
+		angle = radians(self.cam.angle)
+		# Rotation and scaling in one matrix (screen = (pos - cam) @ matrix), halved like pos_on_screen does
+		self.matrix = np.array([ [ cos(angle), sin(angle) ], [ -sin(angle), cos(angle) ] ]) * self.factor / 2
+		self.offset = np.array([ self.w / 2, self.h / 2 ])
+		self.cam_pos = np.array(self.cam.pos, dtype=float)
+
+	def project(self, pos):
+		"""
+		Screen positions of an (n, 2) array of positions (meters)
+		"""
+		return np.floor((pos - self.cam_pos) @ self.matrix + self.offset)
+
+	def constants(self, objects, attr):
+		"""
+		Array of an attribute of every object of a list, only worked out the first time the list is seen
+		"""
+		key = (id(objects), attr)
+		entry = self.cache.get(key)
+		if entry is None or entry[0] is not objects or entry[1] != len(objects):
+			entry = (objects, len(objects), np.array([ getattr(obj, attr) for obj in objects ]))
+			self.cache[key] = entry
+		return entry[2]
+
+	def positions(self, objects):
+		"""
+		Positions of the SpaceObjects of a list (all from the same SystemState) this frame
+		"""
+		if self.pos is None:
+			return np.array([ obj.pos for obj in objects ])
+		return self.pos[[ obj.index for obj in objects ]]
+
+	def visible(self, screen, size):
+		return (screen[:, 0] - size <= self.w) & (screen[:, 0] + size >= 0) & (screen[:, 1] - size <= self.h) & (screen[:, 1] + size >= 0)
+
+	def draw_space_objects(self, objects):
+		if len(objects) == 0:
+			return
+		screen = self.project(state_of(objects).pos if self.pos is None else self.pos)
+		radius = self.constants(objects, "radius")
+		colour = self.constants(objects, "colour")
+		size = np.maximum(5, (self.cam.zoom * radius)**(1/4) // 20) # Same flimsy calculation as SpaceObject.size_on_screen
+		for i in np.flatnonzero(self.visible(screen, size)):
+			pg.draw.circle(self.target, int(colour[i]), screen[i], size[i])
+
+	def draw_orbits(self, orbits):
+		if len(orbits) == 0:
+			return
+		centres = self.project(self.positions([ orbit.centre for orbit in orbits ]))
+		radius = self.constants(orbits, "radius")
+		colour = self.constants(orbits, "colour")
+		size = np.ceil(radius * self.factor / 2)
+
+		# A ring is visible if the screen reaches out to it (nearest point of the screen is inside it) but isn't all inside it (farthest corner is outside)
+		x = centres[:, 0]
+		y = centres[:, 1]
+		nearest_sq = (np.clip(x, 0, self.w) - x)**2 + (np.clip(y, 0, self.h) - y)**2
+		farthest_sq = np.maximum(x**2, (x - self.w)**2) + np.maximum(y**2, (y - self.h)**2)
+		on = (nearest_sq <= size**2) & (farthest_sq >= size**2)
+		for i in np.flatnonzero(on):
+			pg.draw.circle(self.target, int(colour[i]), centres[i], size[i], width=ORBIT_WIDTH)
+
+	def draw_points(self, pos, colour, size=2):
+		"""
+		Draws an (n, 2) array of positions as dots
+		"""
+		if len(pos) == 0:
+			return
+		screen = self.project(pos)
+		for point in screen[self.visible(screen, size)]:
+			pg.draw.circle(self.target, colour, point, size)
+
+	def draw_pixels(self, pos, colour):
+		"""
+		Draws an (n, 2) array of positions as single pixels, written straight into the surface
+		"""
+		if len(pos) == 0:
+			return
+		screen = self.project(pos)
+		on = (screen[:, 0] >= 0) & (screen[:, 0] < self.w) & (screen[:, 1] >= 0) & (screen[:, 1] < self.h)
+		pixels = pg.surfarray.pixels2d(self.target)
+		pixels[screen[on, 0].astype(int), screen[on, 1].astype(int)] = self.target.map_rgb(hex_to_rgb(colour))
+		del pixels # Unlocks the surface
+
+	def draw_swarms(self, swarms):
+		for swarm in swarms:
+			swarm.draw(self)
+
+	def draw_trail(self, trail, origin, colour, width=TRAIL_WIDTH):
+		"""
+		Draws a Trail (positions relative to `origin`) as a single polyline
+		It's kept on its own surface, and as long as the view of it doesn't change only the newly added segments get drawn
+		"""
+		if len(trail) == 0:
+			return
+		origin = np.asarray(origin, dtype=float)
+		key = (self.w, self.h, self.matrix.tobytes(), (origin - self.cam_pos).tobytes(), trail.dropped, colour, width)
+		layer = self.trail_layers.get(id(trail))
+		if layer is None or layer["trail"] is not trail or layer["key"] != key or trail.added < layer["added"]:
+			# Something moved (or old points fell off the end), so draw the whole thing again
+			surface = pg.Surface((self.w, self.h), pg.SRCALPHA)
+			self.draw_polyline(surface, trail.points() + origin, colour, width)
+			layer = { "trail": trail, "key": key, "surface": surface, "added": trail.added }
+			self.trail_layers[id(trail)] = layer
+		elif trail.added > layer["added"]:
+			self.draw_polyline(layer["surface"], trail.points(trail.added - layer["added"] + 1) + origin, colour, width)
+			layer["added"] = trail.added
+		self.target.blit(layer["surface"], (0, 0))
+
+	def draw_polyline(self, surface, pos, colour, width):
+		screen = np.clip(self.project(pos), -TRAIL_MAX_PIXELS, TRAIL_MAX_PIXELS) # pygame can't take coordinates too far off screen
+		if len(screen) == 1:
+			pg.draw.circle(surface, colour, screen[0], width)
+		else:
+			pg.draw.lines(surface, colour, False, screen, width)
@@ -0,0 +1,403 @@
+# Scenarios
+# The system being simulated, read from a TOML or JSON file (see scenarios/solar_system.toml for the format) or a CSV table of bodies,
+# rather than set up by hand in init_space_objects(). Big catalogues of bodies or test particles are read from CSV files straight into
+# arrays, without going through a Python object per row.
+# Parsing and checking a 100k-row catalogue takes a while, so the parsed scenario is saved to a binary (.npz) cache keyed by a hash of the
+# files it was read from, and loaded from there next time without being parsed or checked again
+#
+# Catalogue CSV files have a header row. Every row needs either x, y (meters, with x_vel, y_vel in meters/sec, 0 if missing) or au_mag and
+# angle (degrees, on a circular orbit around the catalogue's centre). mass and radius are optional for particles, and name is optional
+
+import hashlib
+import json
+import os
+import numpy as np
+from math import *
+from consts import *
+from utils import *
+from kepler import state_from_elements
+
+try:
+	import tomllib # Python 3.11+
+except ImportError:
+	try:
+		import tomli as tomllib
+	except ImportError:
+		tomllib = None
+
+
+SCENARIO_VERSION = 3 # Bump whenever the parsing or the cache's contents change, so old caches get ignored
+DEFAULT_SCENARIO = os.path.join(PACKAGE_DIR, "scenarios", "solar_system.toml")
+ROLES = ( "sun", "earth", "moon", "rocket" )
+
+# Per-body arrays of a Scenario, and what they hold when a body doesn't say
+BODY_COLUMNS = {
+	"name": "",
+	"role": "",            # One of ROLES, or "" for nothing special
+	"pos": 0.0,            # (n, 2) meters
+	"vel": 0.0,            # (n, 2) meters/sec
+	"mass": 0.0,
+	"radius": 1e3,
+	"colour": 0xffffff,
+	"active": True,        # impacted_by_gravity
+	"on_rails": False,
+	"centre": -1,          # Index of the body it orbits (-1 for none)
+	"orbit_au": 0.0,       # Radius of its orbit ring (0 for none)
+	"angle": 0.0,          # Degrees around its centre it started at
+	"period_days": 0.0,
+}
+
+
+class Scenario(object):
+	"""
+	A parsed and checked system: per-body arrays (see BODY_COLUMNS) plus swarms of test particles
+	"""
+	def __init__(self, name, bodies, swarms=(), path=None):
+		self.name = name
+		self.bodies = bodies        # Column name -> array with a row per body
+		self.swarms = list(swarms)  # Dicts of name, colour, pos, vel
+		self.path = path
+
+	def __len__(self):
+		return len(self.bodies["name"])
+
+	def index_of(self, name):
+		matches = np.flatnonzero(self.bodies["name"] == name)
+		if len(matches) == 0:
+			raise KeyError(f"No body called {name} in {self.name}")
+		return int(matches[0])
+
+	def with_role(self, role):
+		"""
+		Index of the body with `role`, or None
+		"""
+		matches = np.flatnonzero(self.bodies["role"] == role)
+		return int(matches[0]) if len(matches) > 0 else None
+
+
+def read_table(path):
+	"""
+	Columns of a CSV file with a header row as a dict of arrays (numbers as floats, anything else as strings)
+	"""
+	data = np.genfromtxt(path, delimiter=",", names=True, dtype=None, encoding="utf-8", autostrip=True)
+	data = np.atleast_1d(data)
+	columns = {}
+	for column in data.dtype.names:
+		values = data[column]
+		columns[column] = values.astype(float) if values.dtype.kind in "iuf" else values.astype(str)
+	return columns
+
+def parse_colour(colour, where):
+	if isinstance(colour, str):
+		try:
+			return int(colour.lstrip("#").removeprefix("0x"), 16)
+		except ValueError:
+			raise ValueError(f"{where}: colour {colour!r} isn't a hex colour")
+	if isinstance(colour, bool) or not isinstance(colour, int) or not 0 <= colour <= 0xffffff:
+		raise ValueError(f"{where}: colour {colour!r} isn't a hex colour")
+	return colour
+
+def parse_angle(angle, where):
+	if isinstance(angle, (list, tuple)):
+		if len(angle) != 3:
+			raise ValueError(f"{where}: angle should be a number or [ degrees, hours, minutes ]")
+		return angle_from_dhm(*angle)
+	return number(angle, where, "angle")
+
+def number(value, where, field, minimum=None):
+	if isinstance(value, bool) or not isinstance(value, (int, float)) or not isfinite(value):
+		raise ValueError(f"{where}: {field} should be a number, not {value!r}")
+	if minimum is not None and value < minimum:
+		raise ValueError(f"{where}: {field} can't be less than {minimum}")
+	return float(value)
+
+def circular_orbits(centre_pos, centre_vel, centre_mass, r, angle, moving):
+	"""
+	Positions and velocities of bodies `r` meters from their centres at `angle` degrees, on circular orbits where `moving`
+	(Same maths as SpaceObject with an au_mag and period_days, around any centre)
+	"""
+	rad = np.radians(angle)
+	pos = centre_pos + np.stack((r * np.cos(rad), r * np.sin(rad)), axis=-1)
+	v = np.where(moving, np.sqrt(G * centre_mass / np.where(r > 0, r, 1)), 0) # From both F_g = G(m1m2/r^2) and a = v^2/r
+	perp = np.radians((angle + 90) % 360)
+	vel = centre_vel + np.stack((v * np.cos(perp), v * np.sin(perp)), axis=-1)
+	return pos, vel
+
+
+def parse_bodies(entries, where):
+	"""
+	Per-body arrays from the [[bodies]] tables of a scenario, checking everything on the way
+	"""
+	rows = { column: [] for column in BODY_COLUMNS }
+	index = {}
+	for i, entry in enumerate(entries):
+		here = f"{where}, body {i + 1}"
+		if not isinstance(entry, dict) or not isinstance(entry.get("name"), str) or entry["name"] == "":
+			raise ValueError(f"{here}: every body needs a name")
+		name = entry["name"]
+		here = f"{where}, {name}"
+		if name in index:
+			raise ValueError(f"{here}: there's already a body called {name}")
+		unknown = set(entry) - { "name", "role", "mass", "radius", "colour", "x", "y", "x_vel", "y_vel", "au_mag", "orbit_radius", "angle", "centre", "period_days", "eccentricity", "periapsis", "orbit_ring", "impacted_by_gravity", "on_rails" }
+		if unknown:
+			raise ValueError(f"{here}: unknown field(s) {', '.join(sorted(unknown))}")
+		role = entry.get("role", "")
+		if role not in ROLES + ( "", ):
+			raise ValueError(f"{here}: role should be one of {', '.join(ROLES)}")
+		if role and role in rows["role"]:
+			raise ValueError(f"{here}: there's already a {role}")
+
+		if role == "rocket":
+			mass = number(entry.get("mass", ROCKET_MASS + INIT_FUEL_MASS), here, "mass", 0)
+			radius = number(entry.get("radius", ROCKET_HEIGHT // 2), here, "radius", 0) # Since the rocket isn't spherical, will just have to approximate
+		else:
+			if "mass" not in entry or "radius" not in entry:
+				raise ValueError(f"{here}: needs a mass and a radius")
+			mass = number(entry["mass"], here, "mass", 0)
+			radius = number(entry["radius"], here, "radius", 0)
+
+		centre = -1
+		if "centre" in entry:
+			if entry["centre"] not in index:
+				raise ValueError(f"{here}: centre {entry['centre']!r} should be a body listed before it")
+			centre = index[entry["centre"]]
+		elif "sun" in rows["role"]:
+			centre = rows["role"].index("sun")
+
+		angle = parse_angle(entry.get("angle", 0), here)
+		period_days = number(entry.get("period_days", 0), here, "period_days", 0)
+		eccentricity = number(entry.get("eccentricity", 0), here, "eccentricity", 0)
+		if eccentricity >= 1:
+			raise ValueError(f"{here}: eccentricity should be less than 1 (a closed orbit)")
+		if eccentricity > 0 and "au_mag" not in entry and "orbit_radius" not in entry:
+			raise ValueError(f"{here}: eccentricity needs an orbit (au_mag or orbit_radius)")
+		if "au_mag" in entry or "orbit_radius" in entry:
+			if "x" in entry or "y" in entry:
+				raise ValueError(f"{here}: give either a position or an orbit, not both")
+			if centre < 0:
+				raise ValueError(f"{here}: an orbit needs a centre (or a body with role sun)")
+			au = number(entry["au_mag"], here, "au_mag", 0) if "au_mag" in entry else number(entry["orbit_radius"], here, "orbit_radius", 0) / AU
+			c_pos = np.array(rows["pos"][centre])
+			c_vel = np.array(rows["vel"][centre])
+			if eccentricity > 0: # au_mag is the semi-major axis, with the periapsis `periapsis` degrees round
+				periapsis = parse_angle(entry.get("periapsis", 0), here)
+				rel_pos, rel_vel = state_from_elements(au * AU, eccentricity, radians(periapsis), radians(angle - periapsis), G * rows["mass"][centre])
+				pos = c_pos + rel_pos
+				vel = c_vel + rel_vel if period_days > 0 else c_vel
+			else:
+				pos, vel = circular_orbits(c_pos, c_vel, rows["mass"][centre], au * AU, angle, period_days > 0)
+			pos, vel = list(pos), list(vel)
+		else:
+			au = 0.0
+			pos = [ number(entry.get("x", 0), here, "x"), number(entry.get("y", 0), here, "y") ]
+			vel = [ number(entry.get("x_vel", 0), here, "x_vel"), number(entry.get("y_vel", 0), here, "y_vel") ]
+
+		on_rails = entry.get("on_rails", role == "moon")
+		active = entry.get("impacted_by_gravity", role not in ( "moon", "rocket" ))
+		if not isinstance(on_rails, bool) or not isinstance(active, bool) or not isinstance(entry.get("orbit_ring", False), bool):
+			raise ValueError(f"{here}: on_rails, impacted_by_gravity and orbit_ring should be true or false")
+		if on_rails and role == "rocket":
+			raise ValueError(f"{here}: the rocket can't be on rails")
+
+		index[name] = len(rows["name"])
+		rows["name"].append(name)
+		rows["role"].append(role)
+		rows["pos"].append(pos)
+		rows["vel"].append(vel)
+		rows["mass"].append(mass)
+		rows["radius"].append(radius)
+		rows["colour"].append(parse_colour(entry.get("colour", BODY_COLUMNS["colour"]), here))
+		rows["active"].append(active)
+		rows["on_rails"].append(on_rails)
+		rows["centre"].append(centre)
+		rows["orbit_au"].append(au if entry.get("orbit_ring", False) else 0.0)
+		rows["angle"].append(angle)
+		rows["period_days"].append(period_days)
+
+	if "rocket" in rows["role"] and not { "earth", "moon" } <= set(rows["role"]):
+		raise ValueError(f"{where}: the rocket needs an earth to launch from and a moon to aim at")
+	if "moon" in rows["role"] and rows["on_rails"][rows["role"].index("moon")] and "earth" not in rows["role"]:
+		raise ValueError(f"{where}: a moon on rails needs an earth to go around")
+	return columns_to_arrays(rows)
+
+def columns_to_arrays(rows):
+	n = len(rows["name"])
+	return {
+		"name": np.array(rows["name"], dtype=str),
+		"role": np.array(rows["role"], dtype=str),
+		"pos": np.array(rows["pos"], dtype=float).reshape(n, 2),
+		"vel": np.array(rows["vel"], dtype=float).reshape(n, 2),
+		"mass": np.array(rows["mass"], dtype=float),
+		"radius": np.array(rows["radius"], dtype=float),
+		"colour": np.array(rows["colour"], dtype=np.int64),
+		"active": np.array(rows["active"], dtype=bool),
+		"on_rails": np.array(rows["on_rails"], dtype=bool),
+		"centre": np.array(rows["centre"], dtype=np.int64),
+		"orbit_au": np.array(rows["orbit_au"], dtype=float),
+		"angle": np.array(rows["angle"], dtype=float),
+		"period_days": np.array(rows["period_days"], dtype=float),
+	}
+
+def parse_catalogue(path, entry, bodies, where):
+	"""
+	Positions, velocities and the other columns of a catalogue CSV file, all worked out on whole columns at once
+	"""
+	table = read_table(path)
+	n = len(next(iter(table.values()))) if table else 0
+	here = f"{where}, catalogue {os.path.basename(path)}"
+	for column, values in table.items():
+		if column != "name" and values.dtype.kind != "f":
+			raise ValueError(f"{here}: column {column} should only have numbers")
+		if column != "name" and not np.all(np.isfinite(values)):
+			raise ValueError(f"{here}: row {int(np.flatnonzero(~np.isfinite(values))[0]) + 2} has a missing or invalid {column}")
+
+	centres = np.full(n, -1)
+	if "x" in table and "y" in table:
+		pos = np.stack((table["x"], table["y"]), axis=1)
+		vel = np.stack((table.get("x_vel", np.zeros(n)), table.get("y_vel", np.zeros(n))), axis=1)
+	elif "au_mag" in table and "angle" in table:
+		centre = entry.get("centre")
+		if centre is None:
+			centre = next((str(name) for name, role in zip(bodies["name"], bodies["role"]) if role == "sun"), None)
+		if centre not in set(bodies["name"]):
+			raise ValueError(f"{here}: orbits need a centre which is one of the bodies")
+		c = int(np.flatnonzero(bodies["name"] == centre)[0])
+		if np.any(table["au_mag"] <= 0):
+			raise ValueError(f"{here}: au_mag should be more than 0")
+		pos, vel = circular_orbits(bodies["pos"][c], bodies["vel"][c], bodies["mass"][c], table["au_mag"] * AU, table["angle"], True)
+		centres[:] = c
+	else:
+		raise ValueError(f"{here}: needs x and y columns (and x_vel, y_vel), or au_mag and angle columns")
+
+	mass = table.get("mass", np.zeros(n))
+	radius = table.get("radius", np.full(n, float(entry.get("radius", BODY_COLUMNS["radius"]))))
+	if np.any(mass < 0) or np.any(radius < 0):
+		raise ValueError(f"{here}: mass and radius can't be negative")
+	name = entry.get("name", os.path.splitext(os.path.basename(path))[0])
+	names = table["name"] if "name" in table else np.array([ f"{name} {i + 1}" for i in range(n) ])
+	return { "name": names, "pos": pos, "vel": vel, "mass": mass, "radius": radius, "centre": centres }
+
+
+def source_files(path):
+	"""
+	The scenario file and every catalogue it reads, and the scenario's parsed contents
+	"""
+	if path.endswith(".csv"):
+		return [ path ], None
+	with open(path, "rb") as f:
+		raw = f.read()
+	if path.endswith(".toml"):
+		if tomllib is None:
+			raise ValueError(f"{path}: reading TOML needs Python 3.11+ or the tomli package (or use JSON)")
+		data = tomllib.loads(raw.decode("utf-8"))
+	elif path.endswith(".json"):
+		data = json.loads(raw)
+	else:
+		raise ValueError(f"{path}: scenarios should be .toml, .json or .csv")
+	catalogues = data.get("catalogues", [])
+	if not isinstance(catalogues, list) or not all(isinstance(c, dict) and isinstance(c.get("file"), str) for c in catalogues):
+		raise ValueError(f"{path}: every [[catalogues]] entry needs a file")
+	base = os.path.dirname(path)
+	return [ path ] + [ os.path.join(base, c["file"]) for c in catalogues ], data
+
+def parse_scenario(path, data):
+	"""
+	Scenario from the contents of a scenario file (or a CSV table of bodies if `data` is None), checking everything
+	"""
+	if data is None: # A CSV file of bodies on their own
+		table = parse_catalogue(path, {}, columns_to_arrays({ column: [] for column in BODY_COLUMNS }), path)
+		n = len(table["name"])
+		bodies = { column: np.full(n, default) for column, default in BODY_COLUMNS.items() if column not in ( "pos", "vel" ) }
+		bodies.update(table)
+		bodies["name"] = bodies["name"].astype(str)
+		bodies["role"] = np.full(n, "", dtype=str)
+		return Scenario(os.path.splitext(os.path.basename(path))[0], bodies, path=path)
+
+	if not isinstance(data.get("bodies"), list) or len(data["bodies"]) == 0:
+		raise ValueError(f"{path}: needs at least one [[bodies]] entry")
+	bodies = parse_bodies(data["bodies"], path)
+	swarms = []
+	base = os.path.dirname(path)
+	for entry in data.get("catalogues", []):
+		unknown = set(entry) - { "file", "name", "as", "colour", "centre", "radius" }
+		if unknown:
+			raise ValueError(f"{path}, catalogue {entry['file']}: unknown field(s) {', '.join(sorted(unknown))}")
+		kind = entry.get("as", "particles")
+		colour = parse_colour(entry.get("colour", 0xaaaaaa), f"{path}, catalogue {entry['file']}")
+		table = parse_catalogue(os.path.join(base, entry["file"]), entry, bodies, path)
+		n = len(table["name"])
+		if kind == "particles":
+			swarms.append({ "name": entry.get("name", os.path.splitext(os.path.basename(entry["file"]))[0]), "colour": colour, "pos": table["pos"], "vel": table["vel"] })
+		elif kind == "bodies":
+			extra = { column: np.full(n, default) for column, default in BODY_COLUMNS.items() }
+			extra.update(table)
+			extra["colour"] = np.full(n, colour, dtype=np.int64)
+			clash = set(extra["name"]) & set(bodies["name"])
+			if clash or len(set(extra["name"])) < n:
+				raise ValueError(f"{path}, catalogue {entry['file']}: names should be unique (e.g. {next(iter(clash), 'a repeated name')})")
+			bodies = { column: np.concatenate((bodies[column], extra[column].astype(bodies[column].dtype) if column not in ( "name", "role" ) else extra[column].astype(str))) for column in BODY_COLUMNS }
+		else:
+			raise ValueError(f"{path}, catalogue {entry['file']}: `as` should be particles or bodies")
+	name = data.get("name", os.path.splitext(os.path.basename(path))[0])
+	return Scenario(str(name), bodies, swarms, path)
+
+
+def scenario_key(files):
+	key = hashlib.sha1(repr(SCENARIO_VERSION).encode())
+	for filename in files:
+		key.update(os.path.basename(filename).encode())
+		with open(filename, "rb") as f:
+			for chunk in iter(lambda: f.read(1 << 20), b""):
+				key.update(chunk)
+	return key.hexdigest()
+
+def scenario_arrays(scenario):
+	"""
+	Everything in a Scenario as a dict of arrays (for np.savez), with the odds and ends in a JSON "meta" string
+	"""
+	arrays = { f"body_{column}": values for column, values in scenario.bodies.items() }
+	arrays["swarm_pos"] = np.concatenate([ s["pos"] for s in scenario.swarms ]) if scenario.swarms else np.zeros((0, 2))
+	arrays["swarm_vel"] = np.concatenate([ s["vel"] for s in scenario.swarms ]) if scenario.swarms else np.zeros((0, 2))
+	arrays["swarm_sizes"] = np.array([ len(s["pos"]) for s in scenario.swarms ], dtype=np.int64)
+	arrays["meta"] = np.array(json.dumps({ "name": scenario.name, "swarms": [ { "name": s["name"], "colour": s["colour"] } for s in scenario.swarms ] }))
+	return arrays
+
+def scenario_from_arrays(data, path, prefix=""):
+	"""
+	Scenario back from the arrays of scenario_arrays() (under `prefix`, if they were stored alongside others)
+	"""
+	bodies = { column: data[f"{prefix}body_{column}"] for column in BODY_COLUMNS }
+	meta = json.loads(str(data[f"{prefix}meta"]))
+	offsets = np.concatenate(([ 0 ], np.cumsum(data[f"{prefix}swarm_sizes"])))
+	swarm_pos = data[f"{prefix}swarm_pos"]
+	swarm_vel = data[f"{prefix}swarm_vel"]
+	swarms = [ dict(info, pos=swarm_pos[offsets[i]:offsets[i + 1]], vel=swarm_vel[offsets[i]:offsets[i + 1]]) for i, info in enumerate(meta["swarms"]) ]
+	return Scenario(meta["name"], bodies, swarms, path)
+
+def save_cache(cache_path, scenario):
+	os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+	tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+	with open(tmp_path, "wb") as f:
+		np.savez(f, **scenario_arrays(scenario))
+	os.replace(tmp_path, cache_path) # Only appears once it's complete, so other processes never read half of one
+
+def load_cache(cache_path, path):
+	with np.load(cache_path, allow_pickle=False) as data:
+		return scenario_from_arrays(data, path)
+
+def load_scenario(path=None, cache_dir=SCENARIO_CACHE_DIR):
+	"""
+	Scenario from a .toml, .json or .csv file (the solar system if None), from the cache if it's been parsed before
+	With cache_dir None it's always parsed from scratch
+	"""
+	if path is None:
+		path = DEFAULT_SCENARIO
+	files, data = source_files(path)
+	if cache_dir is None:
+		return parse_scenario(path, data)
+	cache_path = os.path.join(cache_dir, f"scenario-{scenario_key(files)}.npz")
+	if os.path.exists(cache_path):
+		return load_cache(cache_path, path)
+	scenario = parse_scenario(path, data)
+	save_cache(cache_path, scenario)
+	return scenario
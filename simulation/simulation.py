@@ -3,68 +3,42 @@
 # There's no other objects in solar system which may impact gravitational fields
 # Relativity doesn't exist
 
-import pygame as pg
+# Physics of the simulation. Nothing in here imports pygame (only the drawing functions do, lazily), so it can run headless
+# python simulation.py              runs the presentation (see presentation.py)
+# python simulation.py --headless   runs the physics as fast as possible, see run_simulation()
+# python simulation.py --replay DIR plays back a recording made with --headless --record DIR
+# Any of them take --scenario FILE to simulate something other than the solar system (see scenario.py)
+
+import argparse
+import time as timer
+import numpy as np
 from math import *
 from consts import *
 from utils import *
-
-
-
-# The orbit rings
-class Orbit(object):
-	def __init__(self, name="UFO orbit", au_mag=0, colour=0xffff00, centre=None, cam=None):
-		assert centre is not None
-		assert cam is not None
-		self.centre = centre
-		self.cam = cam
-		self.name = name
-		self.radius = au_mag * AU
-		self.colour = darken(colour, ORBIT_DARKEN)
-
-	@property
-	def pos_on_screen(self):
-		"""
-		Shifts position of the SpaceObject to somewhere on (or off) the screen
-		"""
-		w, h = pg.display.get_surface().get_size()
-		factor = min(w, h) * self.cam.zoom / (AU * MAX_AU)
-		x_diff = self.centre.pos[0] - self.cam.pos[0]
-		y_diff = self.centre.pos[1] - self.cam.pos[1]
-		ret = (x_diff * cos(radians(self.cam.angle)) - y_diff * sin(radians(self.cam.angle)), x_diff * sin(radians(self.cam.angle)) + y_diff * cos(radians(self.cam.angle)))
-		x_val = (factor * ret[0] + w) // 2
-		y_val = (factor * ret[1] + h) // 2
-		return (x_val, y_val)
-
-	# Pygame related functions
-	@property
-	def on_screen(self):
-		"""
-		return self.name == "Moon orbit" or self.name == "Earth orbit"
-		"""
-		w, h = pg.display.get_surface().get_size()
-		x, y = self.pos_on_screen
-		size = self.size_on_screen
-		return orbit_on_screen(x, y, w, h, size)
-
-			
-	@property
-	def size_on_screen(self):
-		w, h = pg.display.get_surface().get_size()
-		factor = min(w, h) * self.cam.zoom / (AU * MAX_AU)
-		return ceil(self.radius * factor / 2)
-
-	def draw(self):
-		"""
-		Draws the orbit line to the PyGame screen
-		"""
-		if self.on_screen:
-			pg.draw.circle(pg.display.get_surface(), self.colour, self.pos_on_screen, self.size_on_screen, width=ORBIT_WIDTH)
+from engine import SystemState, state_of, gravity_accels
+from integrators import make_integrator
+from particles import ParticleSwarm
+from trajectory import TrajectoryWriter
+from profiling import profiler
+from scenario import load_scenario
+from kepler import KeplerOrbits
+from conics import PatchedConics
+import kernels
 
 
 # Any object we'll be considering in the physics simulation
 class SpaceObject(object):
 	def __init__(self, name="UFO", x_pos=0, y_pos=0, x_vel=0, y_vel=0, mass=1e24, radius=1e7, colour=0xffff00, cam=None, au_mag=0, angle=0, period_days=0, impacted_by_gravity=True):
 		assert cam is not None
+		# Until the object is bound to a SystemState it keeps its own little arrays
+		self.state = None
+		self.index = 0
+		self._pos = np.zeros(2)
+		self._vel = np.zeros(2)
+		self._mass = np.zeros(1)
+		self._active = np.ones(1, dtype=bool)
+		self._rails = np.zeros(1, dtype=bool)
+
 		self.cam = cam
 		self.name = name
 		self.vel = [ x_vel, y_vel ]     # In meters/sec
@@ -72,6 +46,7 @@ class SpaceObject(object):
 		self.radius = radius            # In meters
 		self.colour = colour
 		self.impacted_by_gravity = impacted_by_gravity
+		self.on_rails = False           # Whether the object is moved along its orbit (see Simulation) rather than being integrated
 
 		if au_mag != 0:
 			r = au_mag * AU
@@ -89,6 +64,65 @@ class SpaceObject(object):
 				v = sqrt(G * SUN_M / r) # From both F_g = G(m1m2/r^2) and a = v^2/r
 			self.vel = [ v * cos(radians((angle + 90) % 360)), v * sin(radians((angle + 90) % 360)) ]
 
+	@classmethod
+	def unbound(cls, name, radius, colour, cam):
+		"""
+		Object with just its own attributes set, for when its state is about to come from arrays (see SystemState.from_arrays())
+		Much quicker than going through __init__ for big catalogues
+		"""
+		so = cls.__new__(cls)
+		so.state = None
+		so.index = 0
+		so.cam = cam
+		so.name = name
+		so.radius = radius
+		so.colour = colour
+		return so
+
+	def bind(self, state, index):
+		"""
+		Makes the object a view onto row `index` of the SystemState `state`
+		"""
+		self.state = state
+		self.index = index
+		self._pos = state.pos[index]
+		self._vel = state.vel[index]
+		self._mass = state.mass[index:index + 1]
+		self._active = state.active[index:index + 1]
+		self._rails = state.rails[index:index + 1]
+
+	# State stored in the arrays
+	@property
+	def pos(self):
+		return self._pos
+	@pos.setter
+	def pos(self, pos):
+		self._pos[:] = pos
+	@property
+	def vel(self):
+		return self._vel
+	@vel.setter
+	def vel(self, vel):
+		self._vel[:] = vel
+	@property
+	def mass(self):
+		return float(self._mass[0])
+	@mass.setter
+	def mass(self, mass):
+		self._mass[0] = mass
+	@property
+	def impacted_by_gravity(self):
+		return bool(self._active[0])
+	@impacted_by_gravity.setter
+	def impacted_by_gravity(self, impacted_by_gravity):
+		self._active[0] = impacted_by_gravity
+	@property
+	def on_rails(self):
+		return bool(self._rails[0])
+	@on_rails.setter
+	def on_rails(self, on_rails):
+		self._rails[0] = on_rails
+
 	@property
 	def coords(self):
 		return self.pos
@@ -131,7 +165,7 @@ class SpaceObject(object):
 		Distance from self to some other SpaceObject
 		"""
 		#assert type(self) == type(object2)
-		return sqrt(self.coords_rel_to(object2)[0]**2 + self.coords_rel_to(object2)[1]**2)
+		return hypot(object2.pos[0] - self.pos[0], object2.pos[1] - self.pos[1])
 
 	def pull_to(self, object2):
 		"""
@@ -181,12 +215,13 @@ class SpaceObject(object):
 		return a
 
 
-	# Pygame related functions
+	# Pygame related functions (pygame is only imported when something is actually drawn)
 	@property
 	def pos_on_screen(self):
 		"""
 		Shifts position of the SpaceObject to somewhere on (or off) the screen
 		"""
+		import pygame as pg
 		w, h = pg.display.get_surface().get_size()
 		factor = min(w, h) * self.cam.zoom / (AU * MAX_AU)
 		x_diff = self.pos[0] - self.cam.pos[0]
@@ -198,6 +233,7 @@ class SpaceObject(object):
 
 	@property
 	def on_screen(self):
+		import pygame as pg
 		w, h = pg.display.get_surface().get_size()
 		return self.pos_on_screen[0] - self.size_on_screen <= w and self.pos_on_screen[0] + self.size_on_screen >= 0 and self.pos_on_screen[1] - self.size_on_screen <= h and self.pos_on_screen[1] + self.size_on_screen >= 0
 	@property
@@ -208,6 +244,7 @@ class SpaceObject(object):
 		"""
 		Draws the SpaceObject to the PyGame screen
 		"""
+		import pygame as pg
 		if self.on_screen:
 			pg.draw.circle(pg.display.get_surface(), self.colour, self.pos_on_screen, self.size_on_screen)
 
@@ -218,6 +255,7 @@ class Rocket(SpaceObject):
 	def __init__(self, *args):
 		super().__init__(*args)
 		self.accel_angle = 0
+		self.gravity_boost = ROCKET_GRAVITY_BOOST # How much stronger the moon's pull on the rocket is made
 		
 	"""
 	def fuel_mass(self, time):
@@ -266,256 +304,463 @@ class Camera(object):
 		self.zoom *= zoom_factor
 
 
-# White dot for showing path of rocket
-class Dot(object):
-	def __init__(self, x, y, cam=None):
-		assert cam is not None
-		self.pos = [ x, y ] # Position relative to the Earth
-		self.cam = cam
-
-	@property
-	def pos_on_screen(self):
-		"""
-		Shifts position of the SpaceObject to somewhere on (or off) the screen
-		"""
-		w, h = pg.display.get_surface().get_size()
-		factor = min(w, h) * self.cam.zoom / (AU * MAX_AU)
-		x_diff = self.pos[0] + earth.pos[0] - self.cam.pos[0]
-		y_diff = self.pos[1] + earth.pos[1] - self.cam.pos[1]
-		ret = (x_diff * cos(radians(self.cam.angle)) - y_diff * sin(radians(self.cam.angle)), x_diff * sin(radians(self.cam.angle)) + y_diff * cos(radians(self.cam.angle)))
-		x_val = (factor * ret[0] + w) // 2
-		y_val = (factor * ret[1] + h) // 2
-		return (x_val, y_val)
-
-	@property
-	def on_screen(self):
-		w, h = pg.display.get_surface().get_size()
-		return self.pos_on_screen[0] - self.size_on_screen <= w and self.pos_on_screen[0] + self.size_on_screen >= 0 and self.pos_on_screen[1] - self.size_on_screen <= h and self.pos_on_screen[1] + self.size_on_screen >= 0
-	@property
-	def size_on_screen(self):
-		return 2
-
-	def draw(self):
-		"""
-		Draws the dot to the PyGame screen
-		"""
-		if self.on_screen:
-			pg.draw.circle(pg.display.get_surface(), 0xff0000, self.pos_on_screen, self.size_on_screen)
-		
-
+def moon_offset(angle):
+	"""
+	Position of the moon relative to the Earth when it's `angle` degrees around its orbit
+	"""
+	r = MOON_ORBIT_RADIUS
+	return [ r * cos(radians(angle)), r * sin(radians(angle)) ] # Meters from Earth to moon
 
-# Text object for drawing text
-class Text(object):
-	def __init__(self, text="Text", window=None, font=None, pos=[ 20, 20 ], colour=0xffffff):
-		assert window is not None
-		assert font is not None
-		self.window = window
-		self.font = font
-		self.text = text
-		self.pos = pos
-		self.colour = hex_to_rgb(colour)
-	def draw(self):
-		img = self.font.render(self.text, True, self.colour)
-		pos = self.pos
-		w, h = pg.display.get_surface().get_size()
-		if self.pos[0] < 0:
-			self.pos[0] += w
-		if self.pos[1] < 0:
-			self.pos[1] += h
-		self.window.blit(img, pos)
-
-
-def moon_update_pos(time, accel=[ 0, 0 ]):
-	moon.angle_from_earth += time * 360 / (27.3 * SECS_IN_A_DAY)
-	r = 384400e3 # 384400 km
-	v = sqrt(G * earth.mass / r) # From both F_g = G(m1m2/r^2) and a = v^2/r
-	moon.pos = [ earth.pos[0] + r * cos(radians(moon.angle_from_earth)), earth.pos[1] + r * sin(radians(moon.angle_from_earth)) ] # Meters from Earth to moon
-	moon.vel = [ v * cos(radians((moon.angle_from_earth + 90) % 360)), v * sin(radians((moon.angle_from_earth + 90) % 360)) ]
-
-
-# Init functions
-def init_objects(cam, win, font):
-	global draw_objects
-	init_space_objects(cam)
-	init_orbit_objects(cam)
-	init_text_objects(win, font)
-	draw_objects = [ orbit_objects, space_objects, text_objects ]
-
-def init_space_objects(cam):
-	global space_objects, sun, mercury, venus, earth, moon, mars, jupiter, saturn, uranus, neptune, rocket
-	#                      name      x_pos, y_pos, x_vel, y_vel, mass,    radius, colour,        au_mag,  angle,                        period_days
-	sun =     SpaceObject("Sun",     0,     0,     0,     0,     SUN_M,   6.96e8, 0xffdd59, cam)
-	mercury = SpaceObject("Mercury", 0,     0,     0,     0,     3.30e23, 2.44e6, 0xad8866, cam, 0.309,  angle_from_dhm(129, 15, 25.9), 87.97)
-	venus =   SpaceObject("Venus",   0,     0,     0,     0,     4.87e24, 6.05e6, 0xd88200, cam, 0.728,  angle_from_dhm(23, 19, 30.1),  224.70)
-	earth =   SpaceObject("Earth",   0,     0,     0,     0,     5.97e24, 6.37e6, 0x46b1db, cam, 0.983,  angle_from_dhm(0, 0, 0),       365.25)
-	mars =    SpaceObject("Mars",    0,     0,     0,     0,     6.42e23, 3.40e6, 0xd64f0c, cam, 1.564,  angle_from_dhm(18, 47, 52.7),  686.98)
-	jupiter = SpaceObject("Jupiter", 0,     0,     0,     0,     1.90e27, 7.15e7, 0xe8bfa7, cam, 4.951,  angle_from_dhm(11, 19, 21.1),  4332.82)
-	saturn =  SpaceObject("Saturn",  0,     0,     0,     0,     5.68e26, 6.03e7, 0xe5c97e, cam, 9.836,  angle_from_dhm(3, 52, 37.2),   10755.70)
-	uranus =  SpaceObject("Uranus",  0,     0,     0,     0,     8.68e25, 2.56e7, 0x5d94e2, cam, 19.670, angle_from_dhm(2, 20, 17.0),   30687.15)
-	neptune = SpaceObject("Neptune", 0,     0,     0,     0,     1.02e26, 2.48e7, 0x3768d3, cam, 29.912, angle_from_dhm(1, 48, 6.7),    60190.03)
-	moon =    SpaceObject("Moon",    0,     0,     0,     0,     7.35e22, 1.74e6, 0xd7d7d7, cam, 0,      0,                             27.3) # Earth's moon, positioned a bit differently
-
-	earth.rot = 0
-
-	# Manually do moon position
-	if False: # FIXME
-		angle = 0
-		r = 384400e3 # 384400 km
-		v = sqrt(G * earth.mass / r) # From both F_g = G(m1m2/r^2) and a = v^2/r
-		moon.pos = [ earth.pos[0] + r * cos(radians(angle)), earth.pos[1] + r * sin(radians(angle)) ] # Meters from Earth to moon
-		moon.vel = [ v * cos(radians((angle + 90) % 360)), v * sin(radians((angle + 90) % 360)) ]
-		moon.impacted_by_gravity = True
-	else:
-		moon.impacted_by_gravity = False # Simplify the model by just making the moon rotate the Earth circularly
-		moon.angle_from_earth = 0
-		moon.update_pos = moon_update_pos
-
-	rocket = Rocket("Rocket", 0, 0, 0, 0, ROCKET_MASS + INIT_FUEL_MASS, ROCKET_HEIGHT // 2, 0x999999, cam) # Since the rocket isn't spherical, will just have to approximate the effect of gravity
-	rocket.impacted_by_gravity = False
-	space_objects = [ sun, jupiter, saturn, uranus, neptune, earth, venus, mars, mercury, moon, rocket ] # All objects we'll consider which will/may have some impact on gravitational forces acting on the rocket
-
-def init_orbit_objects(cam):
-	global orbit_objects, mercury_orbit, venus_orbit, earth_orbit, moon_orbit, mars_orbit, jupiter_orbit, saturn_orbit, uranus_orbit, neptune_orbit
-	#                      name,           au_mag, colour,   centre
-	mercury_orbit = Orbit("Mercury orbit", 0.309,  0xad8866, sun,   cam)
-	venus_orbit   = Orbit("Venus orbit",   0.728,  0xd88200, sun,   cam)
-	earth_orbit   = Orbit("Earth orbit",   0.983,  0x46b1db, sun,   cam)
-	moon_orbit    = Orbit("Moon orbit",    384400e3 / AU,      0xd7d7d7, earth, cam) # TODO
-	mars_orbit    = Orbit("Mars orbit",    1.564,  0xd64f0c, sun,   cam)
-	jupiter_orbit = Orbit("Jupiter orbit", 4.951,  0xe8bfa7, sun,   cam)
-	saturn_orbit  = Orbit("Saturn orbit",  9.836,  0xe5c97e, sun,   cam)
-	uranus_orbit  = Orbit("Uranus orbit",  19.670, 0x5d94e2, sun,   cam)
-	neptune_orbit = Orbit("Neptune orbit", 29.912, 0x3768d3, sun,   cam)
-
-	orbit_objects = [ mercury_orbit, venus_orbit, earth_orbit, moon_orbit, mars_orbit, jupiter_orbit, saturn_orbit, uranus_orbit, neptune_orbit ]
-
-def init_text_objects(win, font):
-	global text_objects, year_and_month_text, fps_text
-	year_and_month_text = Text("Year Month", win, font, [ -100, 20 ], 0xdddddd)
-	fps_text = Text("FPS", win, font, [-40, -20 ], 0xdddddd)
-
-	text_objects = [ year_and_month_text, fps_text ]
-
-
-# Simulation
-def simulate(delta_t_ms, total_ms, so_list, cam):
+def objects_from_scenario(scenario, cam):
 	"""
-	Make all of the objects accelerate each other
+	SpaceObjects for the bodies of a Scenario (see scenario.py), bound to a new SystemState straight from its arrays
 	"""
-	num_objs = len(so_list)
-	time_passed = delta_t_ms / 1000 * SECS_IN_A_DAY * DAYS_PER_SEC # (Real-world) time which will pass in this one frame
-	secs_passed = total_ms / 1000 * SECS_IN_A_DAY * DAYS_PER_SEC   # Total (real-world) seconds which have passed since the start of the program
-	years_passed = secs_passed / SECS_IN_A_DAY / 365               # Total (real-world) years which have passed since the start of the program
-
-	accelerations = [ [ 0, 0 ] ] * num_objs
-
-	# Rather than doing time_passed = delta_t_ms / 1000 * SECS_IN_A_DAY, execute it second-by-second so it's more accurate
-	for iteration_num in range(ITERATIONS_PER_FRAME):
-		for i in range(num_objs):
-			if so_list[i].name == "Rocket":
-				if rocket.impacted_by_gravity == True:
-					moon.impacted_by_gravity = True
-					accelerations[i] = rocket.net_accel_from([ moon ]) # Since the equation we used assumes there's no external forces, we have to simplify the simulation a little by making the rocket only affected by the gravity: an unavoidable assumption without using like rocket science
-					accelerations[i][0] *= 300000 # Make the effect of gravity stronger to better demonstrate slingshotting
-					accelerations[i][1] *= 300000 # Have to use a large number since the simulation has been slowed down a lot
-					moon.impacted_by_gravity = False
-			else:
-				accelerations[i] = so_list[i].net_accel_from(so_list)
-				#accelerations[i] = so_list[i].net_accel_from([ sun ])
+	bodies = scenario.bodies
+	objects = []
+	for i in range(len(scenario)):
+		if bodies["role"][i] == "rocket":
+			objects.append(Rocket(str(bodies["name"][i]), 0, 0, 0, 0, bodies["mass"][i], float(bodies["radius"][i]), int(bodies["colour"][i]), cam))
+		else:
+			objects.append(SpaceObject.unbound(str(bodies["name"][i]), float(bodies["radius"][i]), int(bodies["colour"][i]), cam))
+	SystemState.from_arrays(objects, bodies["pos"], bodies["vel"], bodies["mass"], bodies["active"], bodies["on_rails"])
+	return objects
+
+
+# A whole simulated system: its bodies, clock, integrator and the special cases of the moon and the rocket
+# Everything lives on the instance, so any number of them can be stepped side by side (in threads, or handed to worker processes)
+class Simulation(object):
+	def __init__(self, scenario=None, cam=None, integrator=INTEGRATOR, on_rails=None, rocket_gravity=ROCKET_GRAVITY, perturbers=ROCKET_PERTURBERS):
+		"""
+		Sets up the system of a Scenario (or scenario file), the solar system if not given
+		The camera is only for drawing the bodies; nothing in the physics looks at it
+		on_rails names more bodies to put on Kepler rails (see kepler.py) on top of the ones the scenario does, or is "all" for everything
+		but the rocket, leaving it the only thing integrated
+		rocket_gravity is how the rocket feels gravity: "moon" for just the (boosted) moon, or "soi" for whichever body's sphere of influence
+		it's in (see conics.py), with the bodies named in `perturbers` (or "all") adding their perturbations
+		"""
+		if rocket_gravity not in ( "moon", "soi" ):
+			raise ValueError(f"Unknown rocket gravity {rocket_gravity!r}, expected moon or soi")
+		if scenario is None or isinstance(scenario, str):
+			scenario = load_scenario(scenario)
+		self.scenario = scenario
+		self.cam = Camera() if cam is None else cam
+		self.options = { "integrator": integrator, "on_rails": on_rails, "rocket_gravity": rocket_gravity, "perturbers": perturbers } # To set up the same again (see fork())
+		self.space_objects = objects_from_scenario(scenario, self.cam) # All objects we'll consider which will/may have some impact on gravitational forces acting on the rocket
+		self.state = state_of(self.space_objects)
+		self.named = { so.name: so for so in self.space_objects }
+		self.sun, self.earth, self.moon, self.rocket = [ None if scenario.with_role(role) is None else self.space_objects[scenario.with_role(role)] for role in ( "sun", "earth", "moon", "rocket" ) ]
+
+		if self.earth is not None:
+			self.earth.rot = 0
+		if self.moon is not None:
+			self.moon.angle_from_earth = float(scenario.bodies["angle"][self.moon.index])
+		self.moon_rails = self.moon is not None and self.moon.on_rails # The moon on its own circular rails around the Earth (see move_moon())
+
+		self.space_integrator = make_integrator(integrator)
+		self.sim_time = 0 # Simulated seconds since the start
+		self.step_start = 0 # Simulated time at the start of the step being worked out
+
+		# Everything else on rails follows the orbit it starts on in closed form
+		if on_rails == "all":
+			on_rails = [ so.name for so in self.space_objects if so is not self.rocket ]
+		for name in on_rails or []:
+			if name not in self.named:
+				raise KeyError(f"No body called {name} in {scenario.name}")
+			self.named[name].on_rails = True
+		railed = [ so.index for so in self.space_objects if so.on_rails and not (self.moon_rails and so is self.moon) ]
+		self.kepler = KeplerOrbits.from_state(self.state, railed, scenario.bodies["centre"][railed], self.sim_time) if railed else None
+		self.swarms = [ ParticleSwarm(swarm["pos"], swarm["vel"], swarm["colour"], swarm["name"]) for swarm in scenario.swarms ] # Moved along with the space objects (see particles.py)
+		if self.moon_rails:
+			self.move_moon(0) # Put the moon in its place around the Earth
+		if self.rocket is not None:
+			self.park_rocket()
+
+		self.rocket_gravity = rocket_gravity
+		self.conics = None
+		if rocket_gravity == "soi" and self.rocket is not None:
+			if perturbers == "all":
+				perturbers = [ so.name for so in self.space_objects ]
+			for name in perturbers:
+				if name not in self.named:
+					raise KeyError(f"No body called {name} in {scenario.name}")
+			self.conics = PatchedConics.from_state(self.state, scenario.bodies["centre"], [ self.rocket.index ], [ self.named[name].index for name in perturbers ])
 
-		# Update positions
-		for i in range(num_objs):
-			if accelerations[i] == [ None, None ]: # Attempt to make it not slingshot if it gets too close
-				so_list[i].vel = [ 0, 0 ] # Null velocity
+	@property
+	def loaded_scenario(self):
+		return self.scenario
+
+	def body(self, name):
+		"""
+		The SpaceObject called `name`, or None
+		"""
+		return self.named.get(name)
+
+	def rails_state_at(self, t):
+		"""
+		Rows, positions and velocities of the bodies on Kepler rails at simulated time `t`, which can be any time at all
+		Any of them going around something that isn't on rails are placed relative to where it is now
+		"""
+		if self.kepler is None:
+			return np.zeros(0, dtype=int), np.zeros((0, 2)), np.zeros((0, 2))
+		pos, vel = self.kepler.state_at(t, self.state.pos, self.state.vel)
+		return self.kepler.rows.copy(), pos.copy(), vel.copy()
+
+	def move_moon(self, time):
+		"""
+		Simplifies the model by just making the moon go around the Earth circularly, `time` seconds further on
+		"""
+		moon = self.moon
+		earth = self.earth
+		moon.angle_from_earth += time * 360 / (MOON_PERIOD_DAYS * SECS_IN_A_DAY)
+		r = MOON_ORBIT_RADIUS
+		v = 2 * pi * r / (MOON_PERIOD_DAYS * SECS_IN_A_DAY) # How fast it actually goes around on its rails
+		offset = moon_offset(moon.angle_from_earth)
+		moon.pos = [ earth.pos[0] + offset[0], earth.pos[1] + offset[1] ]
+		moon.vel = [ earth.vel[0] + v * cos(radians((moon.angle_from_earth + 90) % 360)), earth.vel[1] + v * sin(radians((moon.angle_from_earth + 90) % 360)) ] # Carried along with the Earth
+
+	# Simulation
+	def step(self, dt, iterations=1, integrator=None):
+		"""
+		Moves the simulation on by `dt` simulated seconds
+		"""
+		self.advance(dt, self.sim_time + dt, iterations, integrator)
+
+	def run(self, until, dt=SECS_IN_A_DAY / 24, integrator=None):
+		"""
+		Steps by `dt` until the simulated time reaches `until` (seconds), with the last step cut short to land on it exactly
+		"""
+		while self.sim_time < until:
+			self.step(min(dt, until - self.sim_time), integrator=integrator)
+		return self.sim_time
+
+	def simulate(self, delta_t_ms, total_ms, days_per_sec=DAYS_PER_SEC):
+		"""
+		Make all of the objects accelerate each other, for a frame lasting delta_t_ms milliseconds of animation
+		"""
+		time_passed = delta_t_ms / 1000 * SECS_IN_A_DAY * days_per_sec # (Real-world) time which will pass in this one frame
+		secs_passed = total_ms / 1000 * SECS_IN_A_DAY * days_per_sec   # Total (real-world) seconds which have passed since the start of the program
+		self.advance(time_passed, secs_passed)
+
+	def save_state(self):
+		"""
+		Copy of everything needed to put the simulation back to how it is now
+		"""
+		state = self.state
+		return {
+			"pos": state.pos.copy(),
+			"vel": state.vel.copy(),
+			"mass": state.mass.copy(),
+			"active": state.active.copy(),
+			"rails": state.rails.copy(),
+			"swarms": [ (swarm.pos.copy(), swarm.vel.copy()) for swarm in self.swarms ],
+			"moon_angle": self.moon.angle_from_earth if self.moon is not None else None,
+			"earth_rot": self.earth.rot if self.earth is not None else None,
+			"boost": self.rocket.gravity_boost if self.rocket is not None else None,
+			"accel_angle": self.rocket.accel_angle if self.rocket is not None else None,
+			"sim_time": self.sim_time,
+			"step_start": self.step_start,
+			"integrator": (self.space_integrator.name, self.space_integrator.get_state()), # What it remembers from the last step, if anything
+		}
+
+	def restore_state(self, saved):
+		"""
+		Puts the simulation back to a state from save_state() (of this Simulation or another of the same scenario)
+		"""
+		state = self.state
+		state.pos[:] = saved["pos"]
+		state.vel[:] = saved["vel"]
+		state.mass[:] = saved["mass"]
+		state.active[:] = saved["active"]
+		state.rails[:] = saved["rails"]
+		if len(saved["swarms"]) != len(self.swarms):
+			raise ValueError(f"Saved state has {len(saved['swarms'])} particle swarms, not {len(self.swarms)}")
+		for swarm, (pos, vel) in zip(self.swarms, saved["swarms"]):
+			swarm.pos = pos.copy()
+			swarm.vel = vel.copy()
+			swarm.reset()
+		if self.moon is not None:
+			self.moon.angle_from_earth = saved["moon_angle"]
+		if self.earth is not None:
+			self.earth.rot = saved["earth_rot"]
+		if self.rocket is not None:
+			self.rocket.gravity_boost = saved["boost"]
+			self.rocket.accel_angle = saved["accel_angle"]
+		self.sim_time = saved["sim_time"]
+		self.step_start = saved["step_start"]
+		name, integrator_state = saved["integrator"]
+		if name == self.space_integrator.name:
+			self.space_integrator.set_state(integrator_state)
+		else:
+			self.space_integrator.reset()
+
+	def fork(self):
+		"""
+		A new Simulation of the same scenario, set up the same way and starting from exactly where this one is now, which then carries on
+		independently of it. Only the set up is done again (which takes no time compared to simulating), so what-ifs from the same point
+		don't each have to simulate their way there
+		"""
+		forked = Simulation(self.scenario, self.cam, **self.options)
+		forked.swarms = [ ParticleSwarm(swarm.pos, swarm.vel, swarm.colour, swarm.name) for swarm in self.swarms ]
+		forked.restore_state(self.save_state())
+		return forked
+
+	def park_rocket(self):
+		"""
+		Puts the (not yet launched) rocket on the surface of the Earth, turning with it
+		"""
+		earth = self.earth
+		self.rocket.pos = [ earth.pos[0] + (earth.radius * 4) * cos(radians(-earth.rot)), earth.pos[1] + (earth.radius * 4) * sin(radians(-earth.rot)) ] # Use earth.radius * 4 just to make the rocket seem less close to the Earth in the simulation presentation
+
+	def launch_rocket(self, speed_scale=LAUNCH_SPEED_SCALE, direction=0):
+		"""
+		Launches the rocket towards the moon (turned `direction` degrees), at `speed_scale` times the Earth-moon distance per second
+		"""
+		v = (self.moon.pos - self.earth.pos) * speed_scale
+		cos_d, sin_d = cos(radians(direction)), sin(radians(direction))
+		self.rocket.vel = [ v[0] * cos_d - v[1] * sin_d, v[0] * sin_d + v[1] * cos_d ]
+		if self.conics is not None: # With real gravity the Earth's own speed matters, so it leaves along with it
+			self.rocket.vel += self.earth.vel
+		self.rocket.impacted_by_gravity = True
+
+	def rocket_accel(self, rocket_pos, moon_pos):
+		"""
+		Acceleration of the rocket at rocket_pos (shape (n, 2), so several rockets can be done at once) when the moon is at moon_pos
+		Since the equation we used assumes there's no external forces, we have to simplify the simulation a little by making the rocket only affected by the gravity of the moon: an unavoidable assumption without using like rocket science
+		"""
+		accel, collided = gravity_accels(rocket_pos, np.asarray(moon_pos, dtype=float)[np.newaxis], np.array([ self.moon.mass ]))
+		return accel * self.rocket.gravity_boost, collided # collided attempts to make it not slingshot if it gets too close
+
+	def rocket_accels(self, rocket_pos, pos, t=0):
+		"""
+		Acceleration of the rocket at rocket_pos (shape (n, 2)) with the bodies at `pos`, `t` seconds into the current step, under the
+		rocket_gravity model
+		"""
+		moon = self.moon
+		if self.moon_rails: # Work out where it is around the Earth at this point of the step
+			moon_pos = pos[self.earth.index] + moon_offset(moon.angle_from_earth + t * 360 / (MOON_PERIOD_DAYS * SECS_IN_A_DAY))
+		elif moon is not None:
+			moon_pos = pos[moon.index]
+		if self.conics is None:
+			return self.rocket_accel(rocket_pos, moon_pos)
+		if self.moon_rails:
+			pos = pos.copy()
+			pos[moon.index] = moon_pos
+		return self.conics.accels(rocket_pos, pos)
+
+	def system_accels(self, pos, t, rows=None):
+		"""
+		Acceleration of every object if they were at positions `pos`, `t` seconds into the current step
+		With `rows`, only those objects' accelerations are needed (see integrators.BlockTimestep), and the rest come back as zeros
+		"""
+		rocket = self.rocket
+		moon = self.moon
+		state = self.state
+		special = rocket is not None and (moon is not None or self.conics is not None) # The rocket only feels what rocket_accels() says
+		with profiler.phase("forces"):
+			if self.kepler is not None: # Bodies on rails are wherever their orbits put them at this point of the step
+				pos = pos.copy()
+				self.kepler.apply(state, self.step_start + t, pos)
+				feels = state.active & ~state.rails
+				if special:
+					feels[rocket.index] = False
+				if rows is not None:
+					wanted = np.zeros(len(state), dtype=bool)
+					wanted[rows] = True
+					feels &= wanted
+				if not feels.any(): # With everything else on rails there's nothing to work out between the bodies at all
+					accelerations, collided = np.zeros((len(state), 2)), np.zeros(len(state), dtype=bool)
+				else:
+					accelerations, collided = state.net_accels(pos, rows)
 			else:
-				so_list[i].update_pos(time_passed / ITERATIONS_PER_FRAME, accelerations[i])
-
-		rocket.update_mass(secs_passed / ITERATIONS_PER_FRAME) # Update rocket's fuel
-	
-	earth.rot += (delta_t_ms / 1000) * 360 * DAYS_PER_SEC
-	earth.rot %= 360
-	if rocket.impacted_by_gravity == False:
-		rocket.pos = [ earth.pos[0] + (earth.radius * 4) * cos(radians(-earth.rot)), earth.pos[1] + (earth.radius * 4) * sin(radians(-earth.rot)) ] # Use earth.radius * 4 just to make the rocket seem less close to the Earth in the simulation presentation
-
-
-def run_presentation():
-	global DAYS_PER_SEC
-	pg.init()
-	font = pg.font.SysFont(None, 24)
-
-	camera = Camera()
-	window = pg.display.set_mode((INIT_WIN_WIDTH, INIT_WIN_HEIGHT), pg.RESIZABLE)
-	pg.display.set_caption("Slingshot Simulation")
-	clock = pg.time.Clock()
-
-	init_objects(camera, window, font)
-
-	### ANIMATION THINGS ###
-	zoom_speed = 1.005
-	vel_changed = False
-	### ################ ###
-
-	# Tracing path of rocket
-	dots = []
-
-	running = True
-	while running:
-		clock.tick(FPS)
-		window.fill(BLACK)
-
-		delta_t_ms = clock.get_time()
-		total_ms = pg.time.get_ticks()
-		years_passed = total_ms / 1000 * DAYS_PER_SEC / 365
-
-		simulate(delta_t_ms, total_ms, space_objects, camera)
-
-		camera.goto(earth.pos)
-
-		year_and_month_text.text = f"{get_year(years_passed)} {get_month(years_passed)}"
-		fps_text.text = str(round(1000 / delta_t_ms))
-
-		for dot in dots:
-			dot.draw()
-		for obj_list in draw_objects:
-			for elem in obj_list:
-				elem.draw()
-
-		### ANIMATION THINGS ###
-		if total_ms < 8000:
-			pass
-		elif camera.zoom < 10000: # Zoom in initially
-			zoom_speed += 0.0001
-			camera.zoom_by(zoom_speed)
-			if DAYS_PER_SEC > 0.001:
-				DAYS_PER_SEC -= 0.001 # And slow down; we slow down the simulation to make it easier to visually demonstrate how slingshotting works
-		elif DAYS_PER_SEC > 0.001:
-			DAYS_PER_SEC -= 0.01
-		elif DAYS_PER_SEC < 0.001:
-			DAYS_PER_SEC = 0.001
-		elif total_ms < 17000:
+				accelerations, collided = state.net_accels(pos, rows) # Every pair in one batched pass
+			if not special:
+				return accelerations, collided
+			rocket_i = rocket.index
+			accelerations[rocket_i] = 0
+			collided[rocket_i] = False
+			if rocket.impacted_by_gravity == True and (rows is None or rocket_i in rows):
+				accelerations[rocket_i:rocket_i + 1], collided[rocket_i:rocket_i + 1] = self.rocket_accels(pos[rocket_i:rocket_i + 1], pos, t)
+			return accelerations, collided
+
+	def advance(self, time_passed, secs_passed, iterations=ITERATIONS_PER_FRAME, integrator=None):
+		"""
+		Moves the simulation on by `time_passed` (real-world) seconds, split into `iterations` steps of `integrator`
+		"""
+		if integrator is None:
+			integrator = self.space_integrator
+		state = self.state
+		accel_fn = self.system_accels
+
+		# Rather than doing the whole of time_passed at once, execute it bit-by-bit so it's more accurate
+		for iteration_num in range(iterations):
+			self.step_start = self.sim_time + iteration_num * time_passed / iterations
+			pos_before = state.pos.copy() if self.swarms else None
+			with profiler.phase("integrate"): # Not counting the forces, which are their own phase
+				state.pos[:], state.vel[:], collided = integrator.step(state.pos, state.vel, time_passed / iterations, accel_fn, state.active.tobytes())
+			with profiler.phase("rails"):
+				if self.kepler is not None:
+					self.kepler.apply(state, self.step_start + time_passed / iterations)
+				if self.moon_rails:
+					self.move_moon(time_passed / iterations)
+			with profiler.phase("particles"):
+				for swarm in self.swarms:
+					swarm.step(time_passed / iterations, state, pos_before, state.pos)
+
+			if self.rocket is not None:
+				self.rocket.update_mass(secs_passed / iterations) # Update rocket's fuel
+		self.sim_time += time_passed
+
+		with profiler.phase("rails"):
+			if self.earth is not None:
+				self.earth.rot += time_passed / SECS_IN_A_DAY * 360 # One rotation a day
+				self.earth.rot %= 360
+			if self.rocket is not None and self.rocket.impacted_by_gravity == False:
+				self.park_rocket()
+			integrator.sync(state.pos) # The moon and a parked rocket don't pull on anything, so moving them doesn't change any accelerations
+
+	def add_asteroid_belt(self, n, seed=None):
+		"""
+		Adds a swarm of `n` massless asteroids orbiting the sun between Mars and Jupiter
+		"""
+		belt = ParticleSwarm.ring(n, self.sun, BELT_MIN_AU * AU, BELT_MAX_AU * AU, 0x8c8c8c, "Asteroid belt", seed)
+		self.swarms.append(belt)
+		return belt
+
+
+# The simulation the presentation shows. The module stands in for it, so sim.earth, sim.sim_time, sim.launch_rocket() etc. are its
+current = None
+
+def init_space_objects(cam, scenario=None, on_rails=None, rocket_gravity=ROCKET_GRAVITY, perturbers=ROCKET_PERTURBERS):
+	"""
+	Sets up the simulation the module stands in for (see Simulation)
+	"""
+	global current
+	current = Simulation(scenario, cam, on_rails=on_rails, rocket_gravity=rocket_gravity, perturbers=perturbers)
+	return current
+
+def __getattr__(name):
+	if current is not None and not name.startswith("__"):
+		try:
+			return getattr(current, name)
+		except AttributeError:
 			pass
-		elif vel_changed == False:
-			rocket.vel[0] = (moon.pos[0] - earth.pos[0]) * 0.003
-			rocket.vel[1] = (moon.pos[1] - earth.pos[1]) * 0.003
-			rocket.impacted_by_gravity = True
-			vel_changed = True
-		else:
-			dots.append(Dot(rocket.pos[0] - earth.pos[0], rocket.pos[1] - earth.pos[1], camera))
-		### ################ ###
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-		pg.display.update()
 
-		for event in pg.event.get():
-			if event.type == pg.QUIT:
-				running = False
-	quit()
-
-def run_simulation():
-	pass # TODO
+def run_simulation(dt=SECS_IN_A_DAY / 24, days=365, output=None, sample_every=24, particles=0, record=None, profile=None, scenario=None, on_rails=None, snapshot=None, snapshot_every=SNAPSHOT_EVERY_DAYS, resume=None, rocket_gravity=ROCKET_GRAVITY, perturbers=ROCKET_PERTURBERS):
+	"""
+	Runs the physics headless with a fixed timestep `dt` (seconds) for `days` simulated days, as fast as the CPU allows
+	Every `sample_every` steps the state of all SpaceObjects is recorded, and saved to `output` (.npz) if given
+	With `record` (a directory), the samples are streamed to a trajectory recording instead of being kept in memory (see trajectory.py), and
+	just the final state goes to `output`
+	`particles` massless asteroids are also moved along if asked for
+	With `profile` (a .json or .csv file), the time spent in each phase of the steps is saved to it (see profiling.py)
+	`scenario` is the system to simulate, with the bodies named in `on_rails` (or "all" but the rocket) on Kepler rails, and the rocket feeling
+	gravity as rocket_gravity and perturbers say (see Simulation)
+	With `snapshot` (a .npz file), the whole state is saved to it every `snapshot_every` simulated days and at the end, and with `resume` the
+	run carries on for `days` more from a snapshot instead of starting from the scenario (see snapshot.py), which then also decides the system,
+rails, particles and rocket gravity
+	"""
+	from snapshot import save_snapshot, load_snapshot
+	if profile is not None:
+		profiler.enabled = True
+		profiler.reset()
+	if resume is not None:
+		simulation = load_snapshot(resume)
+	else:
+		simulation = Simulation(scenario, on_rails=on_rails, rocket_gravity=rocket_gravity, perturbers=perturbers)
+		if particles > 0:
+			simulation.add_asteroid_belt(particles)
+	state = simulation.state
+
+	num_steps = ceil(days * SECS_IN_A_DAY / dt)
+	num_samples = num_steps // sample_every + 1 if record is None else 1
+	times = np.zeros(num_samples)
+	positions = np.zeros((num_samples, len(state), 2))
+	velocities = np.zeros((num_samples, len(state), 2))
+	times[0] = simulation.sim_time
+	positions[0] = state.pos
+	velocities[0] = state.vel
+	writer = None
+	if record is not None:
+		writer = TrajectoryWriter(record, [ so.name for so in simulation.space_objects ])
+		if simulation.sim_time > writer.last_t: # Resuming into a recording that already goes up to the snapshot
+			writer.record(state, simulation.sim_time)
+
+	start = timer.perf_counter()
+	start_time = simulation.sim_time
+	secs_passed = start_time
+	next_snapshot = start_time + snapshot_every * SECS_IN_A_DAY
+	for step in range(1, num_steps + 1):
+		secs_passed += dt
+		simulation.advance(dt, secs_passed, iterations=1)
+		if step % sample_every == 0:
+			with profiler.phase("recording"):
+				if writer is not None:
+					writer.record(state, simulation.sim_time)
+				else:
+					sample = step // sample_every
+					times[sample] = secs_passed
+					positions[sample] = state.pos
+					velocities[sample] = state.vel
+		if snapshot is not None and simulation.sim_time >= next_snapshot:
+			with profiler.phase("recording"):
+				save_snapshot(simulation, snapshot)
+			next_snapshot += snapshot_every * SECS_IN_A_DAY
+		profiler.frame()
+	wall_secs = timer.perf_counter() - start
+	if writer is not None:
+		writer.close()
+		times[0] = simulation.sim_time
+		positions[0] = state.pos
+		velocities[0] = state.vel
+	if snapshot is not None:
+		save_snapshot(simulation, snapshot)
+	if profile is not None:
+		profiler.export(profile)
+
+	days_simulated = (secs_passed - start_time) / SECS_IN_A_DAY
+	print(f"Simulated {days_simulated:.1f} days in {num_steps} steps in {wall_secs:.3f}s ({days_simulated / max(wall_secs, 1e-9):.1f} simulated days per second)")
+	if output is not None:
+		np.savez(output, t=times, names=np.array([ so.name for so in simulation.space_objects ]), mass=state.mass, pos=positions, vel=velocities)
+	return times, positions, velocities
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Slingshot simulation")
+	parser.add_argument("--headless", action="store_true", help="Run the physics without pygame instead of the presentation")
+	parser.add_argument("--dt", type=float, default=SECS_IN_A_DAY / 24, help="Fixed timestep in seconds (headless)")
+	parser.add_argument("--days", type=float, default=365, help="Number of days to simulate (headless)")
+	parser.add_argument("--sample-every", type=int, default=24, help="Record the state every this many steps (headless)")
+	parser.add_argument("--particles", type=int, default=0, help="Number of asteroid belt test particles to add (headless)")
+	parser.add_argument("-o", "--output", default=None, help="Where to save the recorded states (.npz, headless)")
+	parser.add_argument("--record", default=None, help="Directory to stream the recorded states to, for long runs (headless, see trajectory.py)")
+	parser.add_argument("--profile", default=None, help="Save how long each phase of the steps took to this .json or .csv file (headless)")
+	parser.add_argument("--snapshot", default=None, help="Save the whole state to this .npz file as the run goes and at the end, to carry on from later (headless, see snapshot.py)")
+	parser.add_argument("--snapshot-every", type=float, default=SNAPSHOT_EVERY_DAYS, help="Simulated days between snapshots (headless)")
+	parser.add_argument("--resume", default=None, help="Carry on for --days more from a snapshot instead of starting from the scenario, with the system and force model saved in it (headless)")
+	parser.add_argument("--replay", default=None, help="Play back a recording directory in the presentation instead of working out the physics")
+	parser.add_argument("--scenario", default=None, help="Scenario file (.toml, .json or .csv) to simulate instead of the solar system (see scenario.py)")
+	parser.add_argument("--rocket-gravity", choices=[ "moon", "soi" ], default=ROCKET_GRAVITY, help="Rocket feels just the boosted moon, or the body whose sphere of influence it's in (see conics.py)")
+	parser.add_argument("--perturbers", nargs="*", default=list(ROCKET_PERTURBERS), help="Bodies (or all) adding their perturbations to the sphere of influence model")
+	parser.add_argument("--kepler", action="store_true", help="Put every body but the rocket on rails along its orbit instead of integrating it (see kepler.py)")
+	parser.add_argument("--backend", choices=kernels.BACKENDS, default=KERNEL_BACKEND, help="Run the physics' inner loops as compiled Numba kernels, or in NumPy (see kernels.py)")
+	args = parser.parse_args(argv)
+	if args.resume is not None and (args.particles or args.scenario is not None or args.kepler):
+		parser.error("--particles, --scenario and --kepler come from the snapshot with --resume")
+	kernels.use_backend(args.backend)
+	on_rails = "all" if args.kepler else None
+	perturbers = "all" if args.perturbers == [ "all" ] else args.perturbers
+
+	if args.headless:
+		run_simulation(args.dt, args.days, args.output, args.sample_every, args.particles, args.record, args.profile, args.scenario, on_rails, args.snapshot, args.snapshot_every, args.resume, args.rocket_gravity, perturbers)
+	elif args.replay is not None:
+		from presentation import run_replay
+		run_replay(args.replay, args.scenario)
+	else:
+		from presentation import run_presentation # Only the presentation needs pygame
+		run_presentation(args.scenario, on_rails, args.rocket_gravity, perturbers)
 
 
 if __name__ == "__main__":
-	if True:
-		run_presentation()
-	else:
-		run_simulation()
+	main()
@@ -0,0 +1,89 @@
+# Snapshots
+# The whole state of a Simulation saved to one binary .npz file: the bodies' arrays, the simulated clock, the Earth's rotation, the moon's
+# angle on its rails, whether the rocket has launched (it feels gravity once it has), the rocket's boost, any particle swarms and whatever the
+# integrator remembers from its last step (e.g. the block timestep integrator's levels), so carrying on gives exactly the same run. The
+# scenario it was set up from and how it was set up go in too, so a snapshot can be loaded on its own even if the scenario file has changed
+# since. A long run can be stopped and carried on later (or after a crash), or branched into what-ifs without simulating up to that point
+# again. Saving and loading are just writing and reading the arrays; nothing is worked out again
+# For branching in memory there's Simulation.fork(), which doesn't need a file at all
+#
+# snapshot.npz
+#   meta                                   JSON: format version, the Simulation's options, the clock and the other single values, swarm names
+#   pos, vel                               (bodies, 2)
+#   mass                                   (bodies,)
+#   active, rails                          (bodies,)
+#   swarm_pos, swarm_vel, swarm_sizes      particle swarms, one after another
+#   integrator_*                           the integrator's state (see Integrator.get_state())
+#   scenario_*                             the scenario (see scenario.scenario_arrays())
+
+import json
+import os
+import numpy as np
+from consts import *
+from scenario import scenario_arrays, scenario_from_arrays
+from particles import ParticleSwarm
+import simulation as sim
+
+
+SNAPSHOT_VERSION = 1
+STATE_ARRAYS = ( "pos", "vel", "mass", "active", "rails" )
+STATE_VALUES = ( "moon_angle", "earth_rot", "boost", "accel_angle", "sim_time", "step_start" )
+
+
+def save_snapshot(simulation, path):
+	"""
+	Saves the current state of `simulation` to `path` (.npz). It only appears once it's complete, so a crash while saving leaves the
+	previous snapshot there
+	"""
+	saved = simulation.save_state()
+	options = dict(simulation.options)
+	for name in ( "on_rails", "perturbers" ):
+		if options[name] is not None and options[name] != "all":
+			options[name] = list(options[name])
+	meta = {
+		"version": SNAPSHOT_VERSION,
+		"options": options,
+		"values": { name: None if saved[name] is None else float(saved[name]) for name in STATE_VALUES },
+		"swarms": [ { "name": swarm.name, "colour": swarm.colour } for swarm in simulation.swarms ],
+		"integrator": saved["integrator"][0],
+	}
+	arrays = { name: saved[name] for name in STATE_ARRAYS }
+	arrays["swarm_pos"] = np.concatenate([ pos for pos, _ in saved["swarms"] ]) if saved["swarms"] else np.zeros((0, 2))
+	arrays["swarm_vel"] = np.concatenate([ vel for _, vel in saved["swarms"] ]) if saved["swarms"] else np.zeros((0, 2))
+	arrays["swarm_sizes"] = np.array([ len(pos) for pos, _ in saved["swarms"] ], dtype=np.int64)
+	arrays.update({ f"integrator_{name}": values for name, values in saved["integrator"][1].items() })
+	arrays["meta"] = np.array(json.dumps(meta))
+	arrays.update({ f"scenario_{name}": values for name, values in scenario_arrays(simulation.scenario).items() })
+
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	tmp_path = f"{path}.{os.getpid()}.tmp"
+	with open(tmp_path, "wb") as f:
+		np.savez(f, **arrays)
+	os.replace(tmp_path, path)
+
+def load_snapshot(path, simulation=None, cam=None):
+	"""
+	Simulation in the state saved to `path`, set up again from the scenario in the snapshot (drawn with `cam`, if it's going to be)
+	With `simulation`, that's put into the saved state instead, which only works if it has the same bodies
+	"""
+	with np.load(path, allow_pickle=False) as data:
+		meta = json.loads(str(data["meta"]))
+		if meta["version"] != SNAPSHOT_VERSION:
+			raise ValueError(f"{path} is a version {meta['version']} snapshot, expected version {SNAPSHOT_VERSION}")
+		saved = { name: data[name] for name in STATE_ARRAYS }
+		offsets = np.concatenate(([ 0 ], np.cumsum(data["swarm_sizes"])))
+		swarm_pos = data["swarm_pos"]
+		swarm_vel = data["swarm_vel"]
+		saved["integrator"] = (meta["integrator"], { name[len("integrator_"):]: data[name] for name in data.files if name.startswith("integrator_") })
+		if simulation is None:
+			scenario = scenario_from_arrays(data, path, "scenario_")
+	saved["swarms"] = [ (swarm_pos[offsets[i]:offsets[i + 1]], swarm_vel[offsets[i]:offsets[i + 1]]) for i in range(len(meta["swarms"])) ]
+	saved.update(meta["values"])
+
+	if simulation is None:
+		simulation = sim.Simulation(scenario, cam, **meta["options"])
+		simulation.swarms = [ ParticleSwarm(pos, vel, info["colour"], info["name"]) for (pos, vel), info in zip(saved["swarms"], meta["swarms"]) ]
+	elif len(simulation.state) != len(saved["pos"]):
+		raise ValueError(f"{path} has {len(saved['pos'])} bodies, not {len(simulation.state)}")
+	simulation.restore_state(saved)
+	return simulation
@@ -0,0 +1,223 @@
+# Launch window sweep
+# Runs many headless slingshot trajectories (one per combination of launch epoch, speed, direction and gravity boost) across a process pool
+# python sweep.py --epochs 0 10 20 --speed-scales 0.002 0.003 --directions -5 0 5 --boosts 1e5 3e5 -o sweep.csv
+
+import argparse
+import calendar
+import csv
+import itertools
+import multiprocessing as mp
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from math import *
+from consts import *
+import simulation as sim
+from integrators import make_integrator
+from ephemeris import load_ephemeris
+from snapshot import load_snapshot
+from events import EventDetector, ClosestApproach, Impact, DistanceThreshold
+import kernels
+
+
+SWEEP_COLUMNS = [ "epoch_days", "speed_scale", "direction", "boost", "closest_approach", "closest_approach_time", "closest_approach_speed", "speed_gain", "escaped", "impacted" ]
+
+# Simulation (and ephemeris, if used) set up once by the parent. Forked workers inherit them copy-on-write rather than each building their own
+simulation = None
+options = {} # How it was set up (see Simulation), for workers that have to set up their own
+snapshot = None # Or the snapshot it was loaded from (see snapshot.py)
+initial_state = None
+epoch_states = {} # States at the epochs this worker has already simulated up to
+ephemeris = None
+ephemeris_days = None
+backend = KERNEL_BACKEND # Whether the physics runs as compiled kernels (see kernels.py)
+
+
+def init_worker(setup=None):
+	"""
+	Sets up the simulation in a worker process. Does nothing if it was inherited from the parent by forking
+	`setup` is (options, snapshot, ephemeris_days, backend) as sweep() set them, which spawned workers don't inherit
+	"""
+	global simulation, options, snapshot, initial_state, ephemeris, ephemeris_days, backend
+	if setup is not None:
+		options, snapshot, ephemeris_days, backend = setup
+	kernels.use_backend(backend)
+	kernels.warm_up() # Straight from the disk cache, unless the parent already had them compiled
+	if simulation is None:
+		simulation = sim.Simulation(**options) if snapshot is None else load_snapshot(snapshot)
+		initial_state = simulation.save_state()
+	if ephemeris is None and ephemeris_days is not None:
+		ephemeris = load_ephemeris(simulation, ephemeris_days) # Already built by the parent, so this just maps the file
+
+
+def fly(simulation, speed_scale, direction, boost, duration, dt, escape_dist, integrator=INTEGRATOR):
+	"""
+	Launches the rocket from the current state of `simulation` and follows it for `duration` seconds
+	The closest approaches to the moon are found between the steps (see events.py), and the flight stops exactly when the rocket hits the
+	moon (or the Earth) or escapes, so the encounter is pinned down however big the steps of `integrator` are
+	Returns (closest approach to the moon, time of it after launch, speed relative to the moon then, speed gain relative to the Earth, whether
+	it escaped, whether it hit anything)
+	"""
+	rocket, moon, earth = simulation.rocket, simulation.moon, simulation.earth
+	rocket.gravity_boost = boost
+	simulation.launch_rocket(speed_scale, direction)
+	stepper = None
+	rows = None
+	if ephemeris is not None:
+		stepper = lambda simulation, dt, integrator: ephemeris.advance_rocket(simulation, dt, integrator=integrator) # Only the rocket needs integrating
+		rows = [ rocket.index ]
+	detector = EventDetector(simulation, integrator=make_integrator(integrator), stepper=stepper, rows=rows)
+	detector.add(ClosestApproach(rocket, moon))
+	impacts = [ detector.add(Impact(rocket, moon)), detector.add(Impact(rocket, earth, name="crash")) ] # Falling back down counts too
+	escape = detector.add(DistanceThreshold(rocket, earth, escape_dist, "escape", direction=1, terminal=True)) # Nothing left out there to pull it back in this model
+	launch_time = simulation.sim_time
+	launch_speed = np.hypot(*(rocket.vel - earth.vel))
+
+	# The ends of the flight count too, in case it's still getting closer
+	start = ( np.hypot(*(rocket.pos - moon.pos)), launch_time, np.hypot(*(rocket.vel - moon.vel)) )
+	detector.run(launch_time + duration, dt)
+	end = ( np.hypot(*(rocket.pos - moon.pos)), simulation.sim_time, np.hypot(*(rocket.vel - moon.vel)) )
+	approaches = [ (hit.info["distance"], hit.t, hit.info["speed"]) for hit in detector.hits if hit.kind == "closest_approach" ]
+	closest, closest_time, closest_speed = min([ start, end ] + approaches, key=lambda approach: approach[0])
+
+	final_speed = np.hypot(*(rocket.vel - earth.vel))
+	stopped = detector.stopped.event if detector.stopped is not None else None
+	escaped = stopped is escape or np.hypot(*(rocket.pos - earth.pos)) > escape_dist
+	return closest, closest_time - launch_time, closest_speed, final_speed - launch_speed, bool(escaped), stopped in impacts
+
+def run_epoch(epoch_days, launches, duration, dt, warmup_dt, escape_dist, integrator=INTEGRATOR):
+	"""
+	Runs launches (speed_scale, direction, boost) from one epoch (days after the initial state). The years leading up to the epoch are
+	only simulated once by each worker, however many of the epoch's launches it's given
+	"""
+	init_worker()
+	if epoch_days not in epoch_states:
+		simulation.restore_state(initial_state)
+		epoch_time = initial_state["sim_time"] + epoch_days * SECS_IN_A_DAY
+		if ephemeris is not None:
+			ephemeris.jump_to(simulation, epoch_time)
+		else:
+			simulation.run(epoch_time, warmup_dt, make_integrator(INTEGRATOR))
+		epoch_states[epoch_days] = simulation.save_state()
+	at_epoch = epoch_states[epoch_days]
+
+	rows = []
+	for speed_scale, direction, boost in launches:
+		simulation.restore_state(at_epoch)
+		closest, closest_time, closest_speed, speed_gain, escaped, impacted = fly(simulation, speed_scale, direction, boost, duration, dt, escape_dist, integrator)
+		rows.append({
+			"epoch_days": epoch_days,
+			"speed_scale": speed_scale,
+			"direction": direction,
+			"boost": boost,
+			"closest_approach": closest,
+			"closest_approach_time": closest_time,
+			"closest_approach_speed": closest_speed,
+			"speed_gain": speed_gain,
+			"escaped": escaped,
+			"impacted": impacted,
+		})
+	return rows
+
+
+def predicted_speed_scales(epochs):
+	"""
+	Launch speed scales at `epochs` (days from the start of START_YEAR) from the launch speed model (see speed_ml/speed_model.py)
+	"""
+	sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)) # speed_ml sits next to this directory
+	from speed_ml import predict_speeds
+	start = calendar.timegm((START_YEAR, 1, 1, 0, 0, 0))
+	return predict_speeds(start + np.asarray(epochs, dtype=float) * SECS_IN_A_DAY) / MOON_ORBIT_RADIUS # Launches go at this times the Earth-moon distance
+
+
+def sweep(epochs, speed_scales=[ LAUNCH_SPEED_SCALE ], directions=[ 0 ], boosts=[ ROCKET_GRAVITY_BOOST ], duration=SWEEP_DURATION, dt=SWEEP_DT, warmup_dt=SWEEP_WARMUP_DT, escape_dist=SWEEP_ESCAPE_DIST, workers=None, use_ephemeris=False, use_kepler=False, integrator=INTEGRATOR, rocket_gravity=ROCKET_GRAVITY, perturbers=ROCKET_PERTURBERS, predicted_speed=False, kernel_backend=KERNEL_BACKEND, from_snapshot=None):
+	"""
+	Runs a trajectory for every combination of launch epoch (days from the start), speed scale, direction (degrees) and gravity boost
+	Yields one result row (dict with SWEEP_COLUMNS) per trajectory as they finish, in no particular order
+	With use_ephemeris the planets are looked up in a (cached) ephemeris rather than integrated, so only the rocket costs anything, and
+	with use_kepler they follow their starting orbits in closed form (see kepler.py), which needs nothing building first
+	`integrator` moves the rocket after launch. An adaptive one ("dopri5") can take big steps and still find the encounter exactly
+	rocket_gravity and perturbers pick how the rocket feels gravity (see Simulation). With "soi" the boosts don't do anything
+	With predicted_speed each epoch launches at the speed the launch speed model predicts for it, instead of at each of speed_scales
+	kernel_backend picks whether the physics runs as compiled kernels (see kernels.py), which are compiled before the workers start
+	With from_snapshot (see snapshot.py) everything starts from the state saved there rather than from the start, and the epochs are days
+	after it. The snapshot's own set up is used, so use_kepler, rocket_gravity and perturbers don't do anything
+	"""
+	global simulation, options, snapshot, initial_state, epoch_states, ephemeris, ephemeris_days, backend
+	backend = kernel_backend
+	kernels.use_backend(backend)
+	kernels.warm_up()
+	options = { "on_rails": "all" if use_kepler else None, "rocket_gravity": rocket_gravity, "perturbers": perturbers }
+	snapshot = from_snapshot
+	simulation = sim.Simulation(**options) if snapshot is None else load_snapshot(snapshot)
+	initial_state = simulation.save_state()
+	epoch_states = {}
+	ephemeris = None
+	ephemeris_days = None
+	if use_ephemeris:
+		ephemeris_days = ceil(max(epochs) + duration / SECS_IN_A_DAY) + 1
+		ephemeris = load_ephemeris(simulation, ephemeris_days)
+	launches = { epoch: list(itertools.product(speed_scales, directions, boosts)) for epoch in epochs }
+	if predicted_speed:
+		launches = { epoch: list(itertools.product([ float(scale) ], directions, boosts)) for epoch, scale in zip(epochs, predicted_speed_scales(np.asarray(epochs) + initial_state["sim_time"] / SECS_IN_A_DAY)) }
+
+	# Each epoch's launches are split into enough chunks to give every worker something to do, even with a single epoch
+	if workers is None:
+		workers = os.cpu_count() or 1
+	pieces = ceil(workers / len(epochs))
+	chunks = [ (epoch, launches[epoch][i::pieces]) for epoch in epochs for i in range(min(pieces, len(launches[epoch]))) ]
+
+	# Fork where we can so the workers share the parent's initial state copy-on-write. Otherwise they're told how to set it up again
+	context = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+	with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=((options, snapshot, ephemeris_days, backend), )) as pool:
+		futures = [ pool.submit(run_epoch, epoch, chunk, duration, dt, warmup_dt, escape_dist, integrator) for epoch, chunk in chunks ]
+		for future in as_completed(futures):
+			for row in future.result():
+				yield row
+
+def sweep_table(*args, **kwargs):
+	"""
+	Runs sweep() and returns all of the results as a NumPy structured array
+	"""
+	rows = list(sweep(*args, **kwargs))
+	table = np.zeros(len(rows), dtype=[ (col, bool if col in ( "escaped", "impacted" ) else float) for col in SWEEP_COLUMNS ])
+	for i, row in enumerate(rows):
+		table[i] = tuple(row[col] for col in SWEEP_COLUMNS)
+	return table
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Sweep launch windows for the slingshot")
+	parser.add_argument("--epochs", type=float, nargs="+", default=[ 0 ], help="Launch epochs (days from the start, or from --from-snapshot)")
+	parser.add_argument("--speed-scales", type=float, nargs="+", default=[ LAUNCH_SPEED_SCALE ], help="Launch speeds, as a fraction of the Earth-moon distance per second")
+	parser.add_argument("--predicted-speed", action="store_true", help="Launch at the speed the launch speed model predicts for each epoch instead")
+	parser.add_argument("--directions", type=float, nargs="+", default=[ 0 ], help="Launch directions (degrees away from the moon)")
+	parser.add_argument("--boosts", type=float, nargs="+", default=[ ROCKET_GRAVITY_BOOST ], help="Gravity boost factors")
+	parser.add_argument("--duration", type=float, default=SWEEP_DURATION, help="Seconds to follow each trajectory for")
+	parser.add_argument("--dt", type=float, default=SWEEP_DT, help="Timestep after launch (seconds)")
+	parser.add_argument("--integrator", default=INTEGRATOR, help="Integrator after launch (see integrators.py)")
+	parser.add_argument("--rocket-gravity", choices=[ "moon", "soi" ], default=ROCKET_GRAVITY, help="Rocket feels just the boosted moon, or the body whose sphere of influence it's in (see conics.py)")
+	parser.add_argument("--perturbers", nargs="*", default=list(ROCKET_PERTURBERS), help="Bodies (or all) adding their perturbations to the sphere of influence model")
+	parser.add_argument("--warmup-dt", type=float, default=SWEEP_WARMUP_DT, help="Timestep before launch (seconds)")
+	parser.add_argument("--ephemeris", action="store_true", help="Look the planets up in a cached ephemeris instead of integrating them")
+	parser.add_argument("--kepler", action="store_true", help="Put the planets on rails along their orbits instead of integrating them")
+	parser.add_argument("--from-snapshot", default=None, help="Start from a snapshot saved by simulation.py --headless --snapshot, with the epochs counted from it")
+	parser.add_argument("--backend", choices=kernels.BACKENDS, default=KERNEL_BACKEND, help="Run the physics' inner loops as compiled Numba kernels, or in NumPy (see kernels.py)")
+	parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (defaults to one per CPU)")
+	parser.add_argument("-o", "--output", default=None, help="CSV file to write the results to (defaults to stdout)")
+	args = parser.parse_args(argv)
+	perturbers = "all" if args.perturbers == [ "all" ] else args.perturbers
+
+	out = open(args.output, "w", newline="") if args.output else sys.stdout
+	writer = csv.DictWriter(out, SWEEP_COLUMNS)
+	writer.writeheader()
+	for row in sweep(args.epochs, args.speed_scales, args.directions, args.boosts, args.duration, args.dt, args.warmup_dt, workers=args.workers, use_ephemeris=args.ephemeris, use_kepler=args.kepler, integrator=args.integrator, rocket_gravity=args.rocket_gravity, perturbers=perturbers, predicted_speed=args.predicted_speed, kernel_backend=args.backend, from_snapshot=args.from_snapshot):
+		writer.writerow(row)
+		out.flush() # Stream the results as they come in
+	if out is not sys.stdout:
+		out.close()
+
+
+if __name__ == "__main__":
+	main()
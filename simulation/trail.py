@@ -0,0 +1,70 @@
+# Trail showing the path of the rocket
+# A fixed-size ring buffer of positions (relative to whatever the trail follows, e.g. the Earth). Points closer than min_dist to the last
+# one are dropped, and points carrying on in (nearly) the same direction just move the last point along, so a long run keeps the detail
+# where the path bends. Memory and drawing cost stay bounded however long the presentation runs
+
+import numpy as np
+from math import *
+from consts import *
+
+
+class Trail(object):
+	def __init__(self, capacity=TRAIL_CAPACITY, min_dist=TRAIL_MIN_DIST, min_angle=TRAIL_MIN_ANGLE):
+		assert capacity >= 2
+		self.buffer = np.zeros((capacity, 2))
+		self.capacity = capacity
+		self.min_dist = min_dist
+		self.min_angle = min_angle
+		self.start = 0   # Index of the oldest point in the buffer
+		self.count = 0
+		self.added = 0   # Number of changes to the end of the trail (appends and moved end points), for drawing just what's new
+		self.dropped = 0 # Number of old points pushed out of the buffer
+
+	def __len__(self):
+		return self.count
+
+	def clear(self):
+		self.start = 0
+		self.count = 0
+		self.added = 0
+		self.dropped = 0
+
+	def point(self, i):
+		"""
+		i-th point of the trail, oldest first (negative counts back from the newest)
+		"""
+		if i < 0:
+			i += self.count
+		return self.buffer[(self.start + i) % self.capacity]
+
+	def add(self, pos):
+		pos = np.asarray(pos, dtype=float)
+		if self.count > 0:
+			last = self.point(-1)
+			if hypot(pos[0] - last[0], pos[1] - last[1]) < self.min_dist:
+				return
+			if self.count > 1:
+				before = self.point(-2)
+				old_dir = atan2(last[1] - before[1], last[0] - before[0])
+				new_dir = atan2(pos[1] - last[1], pos[0] - last[0])
+				turn = abs((degrees(new_dir - old_dir) + 180) % 360 - 180)
+				if turn < self.min_angle: # Still going in a straight line, so extend the last segment rather than adding one
+					last[:] = pos
+					self.added += 1
+					return
+
+		if self.count == self.capacity:
+			self.start = (self.start + 1) % self.capacity
+			self.count -= 1
+			self.dropped += 1
+		self.buffer[(self.start + self.count) % self.capacity] = pos
+		self.count += 1
+		self.added += 1
+
+	def points(self, last=None):
+		"""
+		The points of the trail in order as an (n, 2) array (only the newest `last` of them if given)
+		"""
+		n = self.count if last is None else min(last, self.count)
+		idx = (self.start + np.arange(self.count - n, self.count)) % self.capacity
+		return self.buffer[idx]
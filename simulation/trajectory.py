@@ -0,0 +1,233 @@
+# Trajectory recordings
+# A run is saved as a directory of append-only .npy segments, one file per column (t, pos, vel, mass) per segment, plus index.json listing
+# the segments and the times they cover. The writer only ever keeps one segment in memory, and the reader memory-maps segments as they're
+# needed, so a multi-year run can be far bigger than RAM and still be seeked to any time straight away
+#
+# recording/
+#   index.json
+#   00000-t.npy      (n,)
+#   00000-pos.npy    (n, bodies, 2)
+#   00000-vel.npy    (n, bodies, 2)
+#   00000-mass.npy   (n, bodies)
+#   00001-t.npy ...
+
+import bisect
+import json
+import os
+import numpy as np
+from math import *
+from consts import *
+from utils import *
+
+
+TRAJECTORY_VERSION = 1
+COLUMNS = ("t", "pos", "vel", "mass")
+
+
+def segment_path(path, segment, column):
+	return os.path.join(path, f"{segment:05d}-{column}.npy")
+
+def write_atomic(filename, write):
+	"""
+	Writes a file under a temporary name then moves it into place, so readers never see half of one
+	"""
+	tmp = f"{filename}.{os.getpid()}.tmp"
+	write(tmp)
+	os.replace(tmp, filename)
+
+
+class TrajectoryWriter(object):
+	"""
+	Streams the states of the bodies to a recording directory, a segment of `segment_steps` samples at a time
+	Carries on from the end of the recording if there's one there already
+	"""
+	def __init__(self, path, names, segment_steps=TRAJECTORY_SEGMENT_STEPS):
+		self.path = path
+		self.names = list(names)
+		self.segment_steps = segment_steps
+		self.segments = []
+		os.makedirs(path, exist_ok=True)
+		if os.path.exists(os.path.join(path, "index.json")):
+			index = read_index(path)
+			if index["names"] != self.names:
+				raise ValueError(f"Recording {path} has different bodies ({', '.join(index['names'])})")
+			self.segments = index["segments"]
+
+		n = len(self.names)
+		self.t = np.zeros(segment_steps)
+		self.pos = np.zeros((segment_steps, n, 2))
+		self.vel = np.zeros((segment_steps, n, 2))
+		self.mass = np.zeros((segment_steps, n))
+		self.count = 0 # Samples waiting to be written
+		self.last_t = self.segments[-1]["end"] if self.segments else -inf
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def append(self, t, pos, vel, mass):
+		"""
+		Adds the state of every body at simulated time `t` (seconds, later than anything already recorded)
+		"""
+		if t <= self.last_t:
+			raise ValueError(f"Samples must be in time order ({t} after {self.last_t})")
+		i = self.count
+		self.t[i] = t
+		self.pos[i] = pos
+		self.vel[i] = vel
+		self.mass[i] = mass
+		self.count += 1
+		self.last_t = t
+		if self.count == self.segment_steps:
+			self.flush()
+
+	def record(self, state, t):
+		"""
+		Adds the current state of a SystemState
+		"""
+		self.append(t, state.pos, state.vel, state.mass)
+
+	def flush(self):
+		"""
+		Writes out the samples waiting as a new segment, then the index so that it shows up
+		"""
+		if self.count == 0:
+			return
+		segment = len(self.segments)
+		n = self.count
+		for column in COLUMNS:
+			data = getattr(self, column)[:n]
+			def write(tmp):
+				with open(tmp, "wb") as f:
+					np.save(f, data)
+			write_atomic(segment_path(self.path, segment, column), write)
+		self.segments.append({ "count": n, "start": float(self.t[0]), "end": float(self.t[n - 1]) })
+		self.count = 0
+		self.write_index()
+
+	def write_index(self):
+		index = { "version": TRAJECTORY_VERSION, "names": self.names, "segments": self.segments }
+		def write(tmp):
+			with open(tmp, "w") as f:
+				json.dump(index, f)
+		write_atomic(os.path.join(self.path, "index.json"), write)
+
+	def close(self):
+		self.flush()
+
+
+def read_index(path):
+	with open(os.path.join(path, "index.json")) as f:
+		index = json.load(f)
+	if index.get("version") != TRAJECTORY_VERSION:
+		raise ValueError(f"Recording {path} is version {index.get('version')}, expected {TRAJECTORY_VERSION}")
+	return index
+
+
+class TrajectoryReader(object):
+	"""
+	Random access to a recording. Segments are only memory-mapped once something in them is asked for
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.columns = {} # (segment, column) -> memory-mapped array
+		self.refresh()
+
+	def refresh(self):
+		"""
+		Picks up any segments written since the recording was opened (e.g. while it's still being recorded)
+		"""
+		index = read_index(self.path)
+		self.names = index["names"]
+		self.segments = index["segments"]
+		self.starts = [ seg["start"] for seg in self.segments ]
+		self.offsets = np.concatenate(([ 0 ], np.cumsum([ seg["count"] for seg in self.segments ], dtype=int))) # First sample of each segment
+
+	def __len__(self):
+		return int(self.offsets[-1])
+
+	@property
+	def start(self):
+		return self.segments[0]["start"]
+
+	@property
+	def end(self):
+		return self.segments[-1]["end"]
+
+	def column(self, segment, column):
+		key = (segment, column)
+		data = self.columns.get(key)
+		if data is None:
+			data = np.load(segment_path(self.path, segment, column), mmap_mode="r").view(np.ndarray) # Still backed by the file
+			self.columns[key] = data
+		return data
+
+	def locate(self, i):
+		"""
+		Segment and position within it of sample `i`
+		"""
+		if i < 0:
+			i += len(self)
+		if not 0 <= i < len(self):
+			raise IndexError(f"Sample {i} out of range")
+		segment = int(np.searchsorted(self.offsets, i, side="right")) - 1
+		return segment, i - int(self.offsets[segment])
+
+	def sample(self, i):
+		"""
+		Time, positions, velocities and masses of sample `i`
+		"""
+		segment, j = self.locate(i)
+		return tuple(self.column(segment, column)[j] for column in COLUMNS)
+
+	def index_at(self, t):
+		"""
+		Index of the last sample at or before simulated time `t`
+		"""
+		if len(self) == 0 or t < self.start:
+			raise ValueError(f"Time {t} is before the start of the recording")
+		segment = bisect.bisect_right(self.starts, t) - 1
+		j = int(np.searchsorted(self.column(segment, "t"), t, side="right")) - 1
+		return int(self.offsets[segment]) + j
+
+	def state_at(self, t):
+		"""
+		Positions, velocities and masses of the bodies at simulated time `t`, by cubic Hermite interpolation between the samples either side
+		"""
+		if t > self.end:
+			raise ValueError(f"Time {t} is after the end of the recording ({self.end})")
+		i = self.index_at(t)
+		t0, pos0, vel0, mass0 = self.sample(i)
+		if t == t0 or i == len(self) - 1:
+			return pos0.copy(), vel0.copy(), mass0.copy()
+		t1, pos1, vel1, mass1 = self.sample(i + 1)
+		h = t1 - t0
+		pos, vel = hermite(np.concatenate((pos0, vel0), axis=1), np.concatenate((pos1, vel1), axis=1), (t - t0) / h, h)
+		return pos, vel, mass0.copy() # Mass only changes in steps, so hold it until the next sample
+
+	def read(self, start=None, end=None, columns=COLUMNS):
+		"""
+		All of the samples from simulated time `start` to `end` (inclusive) as a dict of arrays, e.g. for analysing part of a run
+		"""
+		first = 0
+		if start is not None and start > self.start:
+			first = self.index_at(start)
+			if self.sample(first)[0] < start:
+				first += 1
+		last = len(self)
+		if end is not None:
+			last = self.index_at(end) + 1 if end >= self.start else 0
+		out = { column: [] for column in columns }
+		if first < last:
+			seg_first, j_first = self.locate(first)
+			seg_last, j_last = self.locate(last - 1)
+			for segment in range(seg_first, seg_last + 1):
+				a = j_first if segment == seg_first else 0
+				b = j_last + 1 if segment == seg_last else self.segments[segment]["count"]
+				for column in columns:
+					out[column].append(self.column(segment, column)[a:b])
+		n = len(self.names)
+		empty = { "t": (0,), "pos": (0, n, 2), "vel": (0, n, 2), "mass": (0, n) }
+		return { column: np.concatenate(parts) if parts else np.zeros(empty[column]) for column, parts in out.items() }
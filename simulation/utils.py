@@ -1,3 +1,4 @@
+import numpy as np
 from math import *
 from consts import *
 
@@ -43,6 +44,21 @@ def get_month(years_passed):
 	return MONTH_NAMES[floor((years_passed % 1) * 12)]
 
 
+def hermite(a, b, s, h):
+	"""
+	Cubic Hermite interpolation between states a and b (x, y, x_vel, y_vel in the last axis) `h` seconds apart, `s` of the way from a to b
+	Returns the interpolated positions and velocities
+	"""
+	# Basis functions and their derivatives
+	h00 = 2 * s**3 - 3 * s**2 + 1
+	h10 = s**3 - 2 * s**2 + s
+	h01 = -2 * s**3 + 3 * s**2
+	h11 = s**3 - s**2
+	pos = h00 * a[..., :2] + h10 * h * a[..., 2:] + h01 * b[..., :2] + h11 * h * b[..., 2:]
+	vel = ((6 * s**2 - 6 * s) / h) * (a[..., :2] - b[..., :2]) + (3 * s**2 - 4 * s + 1) * a[..., 2:] + (3 * s**2 - 2 * s) * b[..., 2:]
+	return pos, vel
+
+
 def orbit_on_screen(x, y, w, h, size):
 	count = 0
 	if x <= w and x >= 0 and y <= h and y >= 0: # If the centre is on the screen
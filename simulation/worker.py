@@ -0,0 +1,119 @@
+# Physics on a fixed timestep in a background thread
+# simulate() steps the physics by however long the last frame took, so a slow frame means a bigger (less accurate) step and no two runs
+# come out the same. Here a thread steps the simulation by exactly `dt` simulated seconds at a time until it catches up with the time the
+# presentation asks for, keeping the last few states as snapshots. The presentation draws the state interpolated between the snapshots
+# either side of the time it's showing, so the frame rate and the rate the physics runs at don't depend on each other.
+# Only the worker thread touches the simulation once it's started: anything that changes it (e.g. launching the rocket) is handed to
+# call() with the simulated time it should happen at, and run at the first step boundary from then on, so it lands at the same point of
+# the simulation however far the thread happened to have got. The presentation only ever reads snapshots
+
+import threading
+from collections import deque
+import numpy as np
+from math import *
+from consts import *
+from utils import *
+import simulation as sim
+
+
+class Snapshot(object):
+	def __init__(self, t, pos, vel):
+		self.t = t     # Simulated seconds
+		self.pos = pos # Copies of the rows of the SystemState
+		self.vel = vel
+
+
+class PhysicsWorker(object):
+	def __init__(self, simulation=None, dt=PHYSICS_DT, keep=PHYSICS_SNAPSHOTS):
+		self.sim = sim.current if simulation is None else simulation # The Simulation being stepped
+		self.dt = dt
+		self.state = self.sim.state
+		self.lock = threading.Lock()
+		self.wake = threading.Condition(self.lock)
+		self.target = self.sim.sim_time # Simulated time to step up to
+		self.commands = []         # (simulated time, function, args) to run at the first step boundary at or after that time
+		self.snapshots = deque(maxlen=keep)
+		self.steps = 0
+		self.running = False
+		self.thread = None
+		self.snapshots.append(self.snapshot())
+
+	def snapshot(self):
+		return Snapshot(self.sim.sim_time, self.state.pos.copy(), self.state.vel.copy())
+
+	def start(self):
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name="physics", daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		with self.wake:
+			self.running = False
+			self.wake.notify()
+		if self.thread is not None:
+			self.thread.join()
+
+	def run_to(self, t):
+		"""
+		Lets the physics carry on up to simulated time `t`
+		"""
+		with self.wake:
+			if t > self.target:
+				self.target = t
+				self.wake.notify()
+
+	def call(self, function, *args, at=None):
+		"""
+		Runs function(*args) on the worker thread at the first step boundary at or after simulated time `at` (the next one if not given)
+		The physics never goes past the time it's been let run up to (see run_to()), so an `at` no earlier than that always happens exactly
+		where it says
+		"""
+		with self.wake:
+			self.commands.append((-inf if at is None else at, function, args))
+			self.wake.notify()
+
+	def due(self):
+		return [ command for command in self.commands if command[0] <= self.sim.sim_time ]
+
+	def run(self):
+		while True:
+			with self.wake:
+				while self.running and not self.due() and self.sim.sim_time + self.dt > self.target:
+					self.wake.wait()
+				if not self.running:
+					return
+				commands = self.due()
+				self.commands = [ command for command in self.commands if command[0] > self.sim.sim_time ]
+				step = self.sim.sim_time + self.dt <= self.target
+
+			# The simulation is stepped without holding the lock, so the presentation is never kept waiting for a step
+			for _, function, args in commands:
+				function(*args)
+			if step:
+				self.sim.step(self.dt)
+				self.steps += 1
+			snapshot = self.snapshot()
+			with self.lock:
+				self.snapshots.append(snapshot)
+
+	def latest(self):
+		with self.lock:
+			return self.snapshots[-1]
+
+	def state_at(self, t):
+		"""
+		Simulated time, positions and velocities of everything at simulated time `t`, interpolated between the snapshots either side
+		If the physics hasn't got that far yet, it's the newest snapshot instead
+		"""
+		with self.lock:
+			snapshots = list(self.snapshots)
+		if t >= snapshots[-1].t:
+			return snapshots[-1].t, snapshots[-1].pos, snapshots[-1].vel
+		if t <= snapshots[0].t:
+			return snapshots[0].t, snapshots[0].pos, snapshots[0].vel
+		i = max(i for i, snap in enumerate(snapshots) if snap.t <= t) # Last one before `t` (later ones win if something changed between steps)
+		a = snapshots[i]
+		b = snapshots[i + 1]
+		h = b.t - a.t
+		pos, vel = hermite(np.concatenate((a.pos, a.vel), axis=1), np.concatenate((b.pos, b.vel), axis=1), (t - a.t) / h, h)
+		return t, pos, vel
@@ -0,0 +1 @@
+from .speed_model import SpeedModel, load_model, predict_speeds
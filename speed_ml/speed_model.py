@@ -0,0 +1,152 @@
+# Launch speed model
+# model.ipynb fits a 4x256 Keras network for 1000 epochs to seven (time, speed) points every time it's run, just to predict one more. Seven
+# points don't need that: this fits a small polynomial to them in closed form (least squares on normalised times, with a touch of ridge so
+# higher degrees stay sensible), saves it once to a versioned JSON artifact, and predicts whole NumPy arrays of epochs at once without
+# importing TensorFlow. Later loads just read the artifact back, and refit only if the data, the settings or the version have changed
+# Times are Unix timestamps (seconds) and speeds are in meters/sec, as in the notebook
+
+import hashlib
+import json
+import os
+import numpy as np
+
+
+MODEL_VERSION = 1 # Bump whenever the fitting or the artifact's contents change, so old artifacts get refitted
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "speed_model.json")
+DEGREE = 1     # Degree of the polynomial. A straight line extrapolates the most sensibly from so few points
+RIDGE = 1e-6   # How much large coefficients are penalised (relative to the number of points)
+
+# The notebook's training data
+TIMES = np.array([
+	92534400,
+	242265600,
+	624672000,
+	1244419200,
+	1539993600,
+	1596067200,
+	1714521600,
+], dtype=float)
+SPEEDS = np.array([
+	1277.997759,
+	1106.938346,
+	3019.28,
+	3133.160588,
+	3510.152863,
+	3390.350877,
+	3683.833333,
+])
+
+
+class SpeedModel(object):
+	"""
+	Polynomial in (time - mean) / scale, with coefficients from the highest power down (as np.polyval takes them)
+	"""
+	def __init__(self, coefficients, mean, scale, key=None):
+		self.coefficients = np.asarray(coefficients, dtype=float)
+		self.mean = float(mean)
+		self.scale = float(scale)
+		self.key = key # Hash of what it was fitted from (see training_key())
+
+	@property
+	def degree(self):
+		return len(self.coefficients) - 1
+
+	@classmethod
+	def fit(cls, times=TIMES, speeds=SPEEDS, degree=DEGREE, ridge=RIDGE):
+		"""
+		Least-squares fit of a polynomial of `degree` to the speeds at `times`, solved directly from the normal equations
+		"""
+		times = np.asarray(times, dtype=float).ravel()
+		speeds = np.asarray(speeds, dtype=float).ravel()
+		if len(times) != len(speeds) or len(times) <= degree:
+			raise ValueError(f"Need matching times and speeds, and more than {degree} of them")
+		mean = times.mean()
+		scale = times.std() or 1.0
+		x = np.vander((times - mean) / scale, degree + 1) # Columns of x^degree down to x^0
+		penalty = ridge * len(times) * np.eye(degree + 1)
+		penalty[-1, -1] = 0 # The constant term is free
+		coefficients = np.linalg.solve(x.T @ x + penalty, x.T @ speeds)
+		return cls(coefficients, mean, scale, training_key(times, speeds, degree, ridge))
+
+	def predict(self, epochs):
+		"""
+		Predicted speeds at `epochs` (a Unix timestamp, or an array of them of any shape, all done at once)
+		"""
+		x = (np.asarray(epochs, dtype=float) - self.mean) / self.scale
+		speeds = np.full(x.shape, self.coefficients[0])
+		for c in self.coefficients[1:]: # Horner's method
+			speeds *= x
+			speeds += c
+		return float(speeds) if speeds.ndim == 0 else speeds
+
+	__call__ = predict
+
+	def to_dict(self):
+		return {
+			"version": MODEL_VERSION,
+			"key": self.key,
+			"coefficients": self.coefficients.tolist(),
+			"mean": self.mean,
+			"scale": self.scale,
+		}
+
+	def save(self, path=MODEL_PATH):
+		"""
+		Writes the artifact, to a temporary file first so a half-written one is never left behind
+		"""
+		tmp = f"{path}.tmp{os.getpid()}"
+		with open(tmp, "w") as f:
+			json.dump(self.to_dict(), f, indent=1)
+		os.replace(tmp, path)
+
+	@classmethod
+	def load(cls, path=MODEL_PATH):
+		"""
+		The model saved at `path`, or None if there isn't one or it's from another version
+		"""
+		try:
+			with open(path) as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			return None
+		if data.get("version") != MODEL_VERSION:
+			return None
+		return cls(data["coefficients"], data["mean"], data["scale"], data.get("key"))
+
+
+def training_key(times, speeds, degree, ridge):
+	"""
+	Hash of everything a fitted model depends on
+	"""
+	key = hashlib.sha1(repr(( MODEL_VERSION, degree, ridge )).encode())
+	key.update(np.ascontiguousarray(times, dtype=float).tobytes())
+	key.update(np.ascontiguousarray(speeds, dtype=float).tobytes())
+	return key.hexdigest()
+
+
+loaded = {} # (path, key) -> SpeedModel, so each process only reads the artifact once
+
+def load_model(path=MODEL_PATH, times=TIMES, speeds=SPEEDS, degree=DEGREE, ridge=RIDGE):
+	"""
+	The model for the training data, read from the artifact at `path` if it was fitted from the same data and settings, otherwise fitted
+	and saved there for next time
+	"""
+	key = training_key(times, speeds, degree, ridge)
+	model = loaded.get((path, key))
+	if model is not None:
+		return model
+	model = SpeedModel.load(path)
+	if model is None or model.key != key:
+		model = SpeedModel.fit(times, speeds, degree, ridge)
+		try:
+			model.save(path)
+		except OSError:
+			pass # Read-only checkout, so just fit it each time
+	loaded[(path, key)] = model
+	return model
+
+def predict_speeds(epochs, path=MODEL_PATH):
+	"""
+	Predicted speeds (meters/sec) at Unix timestamps `epochs`, from the saved model
+	"""
+	return load_model(path).predict(epochs)